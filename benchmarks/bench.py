@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+benchmarks.bench
+~~~~~~~~~~~~~~~~
+
+Benchmarks csv2ofx conversions of synthetic csv files (see
+`benchmarks.generate`) and compares the results against a baseline
+
+Each conversion runs in a fresh interpreter so that its peak memory use can be
+measured. Results are saved as JSON.
+
+Examples:
+    literal blocks::
+
+        python -m benchmarks.bench --sizes 10k,1M --output base.json
+        python -m benchmarks.bench --sizes 10k,1M --baseline base.json
+
+Attributes:
+    SIZES (str): The default number of rows to convert.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from argparse import SUPPRESS, ArgumentParser
+from datetime import datetime as dt
+from importlib import metadata
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .generate import SHAPES, write_csv
+
+SIZES = "10k,1M,10M"
+MULTIPLIERS = {"k": 10**3, "M": 10**6}
+
+
+def parse_size(size):
+    """Parses a number of rows
+
+    Examples:
+        >>> [parse_size(size) for size in ['500', '10k', '1M']]
+        [500, 10000, 1000000]
+    """
+    multiplier = MULTIPLIERS.get(size[-1])
+    return int(size[:-1]) * multiplier if multiplier else int(size)
+
+
+def get_peak_rss():
+    """Gets the peak resident memory of the current process in KiB"""
+    if not resource:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes rather than KiB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def convert(shape, source, qif=False):
+    """Converts a synthetic csv file while timing each stage
+
+    Args:
+        shape (str): The csv shape (one of `generate.SHAPES`).
+        source (str): The csv file path.
+        qif (bool): Convert to QIF instead of OFX.
+
+    Returns:
+        (dict): the benchmark result
+    """
+    from meza.io import read_csv
+
+    from csv2ofx import utils
+    from csv2ofx.api import write_content
+    from csv2ofx.main import load_package_module
+    from csv2ofx.ofx import OFX
+    from csv2ofx.profile import Profiler
+    from csv2ofx.qif import QIF
+
+    mapping = load_package_module(SHAPES[shape]["mapping"]).mapping
+    cont = QIF(mapping) if qif else OFX(mapping, end=dt(2030, 1, 1))
+    profiler = Profiler(cont)
+    wrap = profiler.wrap
+
+    with open(source, encoding="utf-8") as f, open(os.devnull, "w") as dest:
+        records = wrap("read", read_csv(f, has_header=cont.has_header))
+        groups = wrap("group", cont.gen_groups(records, 2**14))
+        trxns = wrap("trxns", cont.gen_trxns(groups))
+        cleaned = wrap("clean", cont.clean_trxns(trxns))
+        data = wrap("data", utils.gen_data(cleaned))
+        body = wrap("body", cont.gen_body(data))
+        header = cont.header(date=dt(2030, 1, 1))
+        footer = cont.footer(date=dt(2030, 1, 1))
+        content = (chunk for part in [header, body, footer] if part for chunk in part)
+        written = write_content(content, dest)
+
+    profiler.stop()
+    report = profiler.report()
+    stages = {name: times["wall"] for name, times in report["stages"].items()}
+    return {"seconds": report["wall"], "stages": stages, "bytes": written}
+
+
+def run_child(shape, source, rows, fmt):
+    """Runs a single benchmark in a fresh interpreter"""
+    spec = json.dumps([shape, source, rows, fmt])
+    command = [sys.executable, "-m", "benchmarks.bench", "--child", spec]
+    output = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout)
+
+
+def compare(results, baseline, max_slowdown, max_growth):
+    """Compares benchmark results against a baseline
+
+    Args:
+        results (List[dict]): The benchmark results.
+        baseline (List[dict]): The baseline benchmark results.
+        max_slowdown (float): Allowed fractional drop in rows/sec.
+        max_growth (float): Allowed fractional growth of the peak memory.
+
+    Returns:
+        (List[str]): the regressions
+
+    Examples:
+        >>> base = [{'shape': 'mint', 'format': 'qif', 'rows': 10,
+        ...          'rows_per_sec': 100, 'peak_rss_kb': 1000}]
+        >>> res = [{'shape': 'mint', 'format': 'qif', 'rows': 10,
+        ...         'rows_per_sec': 80, 'peak_rss_kb': 1050}]
+        >>> compare(res, base, 0.1, 0.1)
+        ['mint/qif/10: 80 rows/sec is 20.0% slower than 100']
+    """
+    regressions = []
+    indexed = {(r["shape"], r["format"], r["rows"]): r for r in baseline}
+
+    for result in results:
+        key = (result["shape"], result["format"], result["rows"])
+        base = indexed.get(key)
+        name = "/".join(map(str, key))
+
+        if not base:
+            continue
+
+        speed, base_speed = result["rows_per_sec"], base["rows_per_sec"]
+        slowdown = 1 - speed / base_speed
+
+        if slowdown > max_slowdown:
+            msg = f"{speed:.0f} rows/sec is {slowdown:.1%} slower than {base_speed:.0f}"
+            regressions.append(f"{name}: {msg}")
+
+        rss, base_rss = result.get("peak_rss_kb"), base.get("peak_rss_kb")
+
+        if rss and base_rss and rss / base_rss - 1 > max_growth:
+            msg = f"peak memory of {rss} KiB is over {base_rss} KiB"
+            regressions.append(f"{name}: {msg} by more than {max_growth:.0%}")
+
+    return regressions
+
+
+parser = ArgumentParser(description="benchmarks csv2ofx conversions")
+parser.add_argument(
+    "-s",
+    "--shapes",
+    default=",".join(SHAPES),
+    help="comma separated csv shapes (default: all)",
+)
+parser.add_argument(
+    "-n",
+    "--sizes",
+    default=SIZES,
+    help=f"comma separated row counts (default: {SIZES})",
+)
+parser.add_argument(
+    "-f", "--formats", default="ofx,qif", help="comma separated output formats"
+)
+parser.add_argument(
+    "-d",
+    "--data-dir",
+    default=os.path.join(tempfile.gettempdir(), "csv2ofx-bench"),
+    help="where to keep the generated csv files",
+)
+parser.add_argument("-o", "--output", help="save the results to this JSON file")
+parser.add_argument("-b", "--baseline", help="compare the results to this JSON file")
+parser.add_argument(
+    "--max-slowdown",
+    type=float,
+    default=0.1,
+    help="allowed fractional drop in rows/sec versus the baseline (default: 0.1)",
+)
+parser.add_argument(
+    "--max-memory-growth",
+    type=float,
+    default=0.1,
+    help="allowed fractional growth of peak memory versus the baseline (default: 0.1)",
+)
+parser.add_argument("--child", help=SUPPRESS)
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+
+    if args.child:
+        shape, source, rows, fmt = json.loads(args.child)
+        result = convert(shape, source, qif=fmt == "qif")
+        result.update({"peak_rss_kb": get_peak_rss()})
+        print(json.dumps(result))
+        return 0
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+
+    for size in args.sizes.split(","):
+        rows = parse_size(size)
+
+        for shape in args.shapes.split(","):
+            source = os.path.join(args.data_dir, f"{shape}-{rows}.csv")
+
+            if not os.path.exists(source):
+                write_csv(shape, rows, source)
+
+            for fmt in args.formats.split(","):
+                result = {"shape": shape, "format": fmt, "rows": rows}
+                result.update(run_child(shape, source, rows, fmt))
+                result["rows_per_sec"] = rows / result["seconds"]
+                results.append(result)
+
+                stages = ", ".join(
+                    f"{name} {secs:.2f}s" for name, secs in result["stages"].items()
+                )
+                print(
+                    f"{shape}/{fmt}/{rows}: {result['rows_per_sec']:.0f} rows/sec, "
+                    f"{result['peak_rss_kb']} KiB peak ({stages})",
+                    file=sys.stderr,
+                )
+
+    report = {
+        "meta": {
+            "date": dt.now().isoformat(),
+            "version": metadata.version("csv2ofx"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+        limits = (args.max_slowdown, args.max_memory_growth)
+        regressions = compare(results, baseline, *limits)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
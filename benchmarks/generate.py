@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+benchmarks.generate
+~~~~~~~~~~~~~~~~~~~
+
+Generates synthetic csv files shaped like the exports of the bundled mappings
+
+Examples:
+    literal blocks::
+
+        python -m benchmarks.generate xero 1000000 xero-1M.csv
+
+Attributes:
+    SHAPES (dict): The csv shapes, keyed by name. Each shape has the `mapping`
+        used to convert it, its `header`, and a `row` function which receives
+        the row number and a `random.Random` instance.
+"""
+
+import csv
+import random
+import sys
+from datetime import date, timedelta
+
+START = date(2015, 1, 1)
+PAYEES = [
+    "Ằdøłƥh Noƴa",
+    "Ómary Akida",
+    "Sadrick Mtel",
+    "Shell, Inc.",
+    'The "Corner" Store',
+    "Amazon & Co",
+]
+ACCOUNTS = ["Checking", "Savings", "Visa", "Cash"]
+CATEGORIES = ["Expenses", "Income", "Groceries", "Transfer", "Utilities"]
+JOURNAL_ACCOUNTS = ["Income", "Cash", "Checking", "Sales", "Expenses"]
+
+STRIPE_HEADER = [
+    "id",
+    "description",
+    "seller_message",
+    "created",
+    "amount",
+    "amount_refunded",
+    "currency",
+    "converted_amount",
+    "converted_amount_refunded",
+    "fee",
+    "tax",
+    "converted_currency",
+    "mode",
+    "status",
+    "statement_descriptor",
+    "customer_id",
+    "customer_description",
+    "customer_email",
+    "captured",
+    "card_id",
+    "card_last4",
+    "card_brand",
+    "card_funding",
+    "card_exp_month",
+    "card_exp_year",
+    "card_name",
+    "card_address_line1",
+    "card_address_line2",
+    "card_address_city",
+    "card_address_state",
+    "card_address_country",
+    "card_address_zip",
+    "card_issue_country",
+    "card_fingerprint",
+    "card_cvc_status",
+    "card_avs_zip_status",
+    "card_avs_line1_status",
+    "card_tokenization_method",
+    "disputed_amount",
+    "dispute_status",
+    "dispute_reason",
+    "dispute_date",
+    "dispute_evidence_due",
+    "invoice_id",
+    "invoice_number",
+    "payment_source_type",
+    "destination",
+    "transfer",
+    "transfer_group",
+    "payment_intent_id",
+]
+
+
+def get_date(num):
+    """Gets the date of a row (about 100 rows per day, starting 2015-01-01)
+
+    Examples:
+        >>> get_date(250)
+        datetime.date(2015, 1, 3)
+    """
+    return START + timedelta(days=num // 100)
+
+
+def get_amount(rng, cents=True):
+    """Gets a random non-zero amount
+
+    Examples:
+        >>> get_amount(random.Random(1))
+        -7182.17
+    """
+    amount = rng.randint(-999999, 999999) or 1
+    return amount / 100 if cents else amount
+
+
+def default_row(num, rng):
+    amount = get_amount(rng)
+    return [
+        f"{num:032x}",
+        f"INV-{num}",
+        get_date(num).isoformat(),
+        "",
+        rng.choice(PAYEES),
+        f"{amount:.2f}",
+        rng.choice(ACCOUNTS),
+        rng.choice(CATEGORIES),
+        "notes" if num % 3 else "",
+    ]
+
+
+def many_accounts_row(num, rng):
+    row = default_row(num, rng)
+    row[6] = f"Account {rng.randrange(1000):03d}"
+    return row
+
+
+def mint_row(num, rng):
+    amount = get_amount(rng)
+    day = get_date(num)
+    return [
+        f"{day.month}/{day.day}/{day:%y}",
+        rng.choice(PAYEES),
+        "Account Transfer",
+        f"{abs(amount):,.2f}",
+        "debit" if amount < 0 else "credit",
+        rng.choice(CATEGORIES),
+        rng.choice(ACCOUNTS),
+        "",
+        "",
+    ]
+
+
+def xero_row(num, rng):
+    # journals have two lines which sum to zero
+    journal, second = divmod(num, 2)
+    jrng = random.Random(journal)
+    amount = get_amount(jrng, cents=False)
+    accounts = jrng.sample(JOURNAL_ACCOUNTS, 2)
+    return [
+        journal + 1,
+        get_date(journal).strftime("%d-%b-%y"),
+        accounts[second],
+        -amount if second else amount,
+        "Tax on Sales" if second else "",
+        "Office" if second else "",
+        "Charger" if second else "",
+        f"INV-{journal:04d}",
+        rng.choice(PAYEES),
+    ]
+
+
+def schwab_row(num, rng):
+    # newest first, with a running balance
+    amount = get_amount(rng)
+    balance = 1000000 - num * 7.5
+    money = f"${abs(amount):,.2f}"
+    return [
+        (date(2022, 9, 1) - timedelta(days=num // 100)).strftime("%m/%d/%Y"),
+        "Pending" if num % 50 == 1 else "Posted",
+        "CHECK" if num % 10 == 0 else "ATM",
+        str(1000 + num) if num % 10 == 0 else "",
+        rng.choice(PAYEES),
+        money if amount < 0 else "",
+        "" if amount < 0 else money,
+        f"${balance:,.2f}",
+    ]
+
+
+def stripe_row(num, rng):
+    row = dict.fromkeys(STRIPE_HEADER, "")
+    amount = abs(get_amount(rng))
+    customer = rng.choice(PAYEES) if num % 4 else ""
+    row.update({
+        "id": f"ch_{num:024d}",
+        "description": f"Entry ID: {num}, Product: Big Event",
+        "seller_message": "Payment complete.",
+        "created": f"{get_date(num).isoformat()} {num % 24:02d}:{num % 60:02d}",
+        "amount": f"{amount:.2f}",
+        "amount_refunded": "0.00",
+        "currency": "cad",
+        "converted_amount": f"{amount:.2f}",
+        "converted_amount_refunded": "0.00",
+        "fee": f"{amount * 0.03:.2f}",
+        "tax": "0.00",
+        "converted_currency": "cad",
+        "mode": "Live",
+        "status": "Paid",
+        "customer_description": customer,
+        "captured": "true",
+        "card_last4": f"{num % 10000:04d}",
+        "card_brand": "Visa",
+        "card_funding": "credit",
+        "card_exp_month": str(num % 12 + 1),
+        "card_exp_year": "2030",
+        "card_name": rng.choice(PAYEES),
+        "card_address_zip": "Z9H 7B6",
+        "card_issue_country": "CA",
+        "card_cvc_status": "pass",
+        "payment_source_type": "card",
+        "payment_intent_id": f"pi_{num:024d}",
+    })
+    return list(row.values())
+
+
+DEFAULT_HEADER = [
+    "Row",
+    "Num",
+    "Date",
+    "Reference",
+    "Description",
+    "Amount",
+    "Account",
+    "Category",
+    "Notes",
+]
+
+SHAPES = {
+    "default": {"mapping": "default", "header": DEFAULT_HEADER, "row": default_row},
+    "mint": {
+        "mapping": "mint",
+        "header": [
+            "Date",
+            "Description",
+            "Original Description",
+            "Amount",
+            "Transaction Type",
+            "Category",
+            "Account Name",
+            "Labels",
+            "Notes",
+        ],
+        "row": mint_row,
+    },
+    "many_accounts": {
+        "mapping": "default",
+        "header": DEFAULT_HEADER,
+        "row": many_accounts_row,
+    },
+    "split_account": {
+        "mapping": "split_account",
+        "header": DEFAULT_HEADER,
+        "row": default_row,
+    },
+    "xero": {
+        "mapping": "xero",
+        "header": [
+            "JournalNumber",
+            "JournalDate",
+            "AccountName",
+            "NetAmount",
+            "TaxCode",
+            "Resource",
+            "Product",
+            "Reference",
+            "Description",
+        ],
+        "row": xero_row,
+    },
+    "schwabchecking": {
+        "mapping": "schwabchecking",
+        "header": [
+            "Date",
+            "Status",
+            "Type",
+            "CheckNumber",
+            "Description",
+            "Withdrawal",
+            "Deposit",
+            "RunningBalance",
+        ],
+        "row": schwab_row,
+    },
+    "stripe": {"mapping": "stripe", "header": STRIPE_HEADER, "row": stripe_row},
+}
+
+
+def gen_rows(shape, rows, seed=0):
+    """Generates the header and rows of a synthetic csv file
+
+    Args:
+        shape (str): The csv shape (one of `SHAPES`).
+        rows (int): The number of rows.
+        seed (int): The random seed.
+
+    Yields:
+        (list): the header followed by each row
+
+    Examples:
+        >>> header, row = gen_rows('xero', 1)
+        >>> dict(zip(header, row))['JournalDate']
+        '01-Jan-15'
+        >>> [len(row) for row in gen_rows('stripe', 2)]
+        [50, 50, 50]
+    """
+    spec = SHAPES[shape]
+    row = spec["row"]
+    rng = random.Random(seed)
+    yield spec["header"]
+
+    for num in range(rows):
+        yield row(num, rng)
+
+
+def write_csv(shape, rows, path, seed=0):
+    """Writes a synthetic csv file
+
+    Args:
+        shape (str): The csv shape (one of `SHAPES`).
+        rows (int): The number of rows.
+        path (str): The destination file path.
+        seed (int): The random seed.
+    """
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(gen_rows(shape, rows, seed))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in SHAPES:
+        shapes = "|".join(SHAPES)
+        sys.exit(f"usage: {sys.argv[0]} {{{shapes}}} ROWS DEST")
+
+    write_csv(sys.argv[1], int(sys.argv[2]), sys.argv[3])
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+benchmarks.grouping
+~~~~~~~~~~~~~~~~~~~
+
+Benchmarks the grouping engines (see `csv2ofx.grouping`) against the original
+per chunk `meza.process.group` grouping
+
+The records are read and parsed up front so that only grouping is timed.
+
+Examples:
+    literal blocks::
+
+        python -m benchmarks.grouping --sizes 100k,1M
+
+Attributes:
+    SHAPES (str): The default csv shapes (many accounts and many split ids).
+    ENGINES (dict): The grouping functions, keyed by name. Each receives the
+        records, key function, and chunk size.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from meza.fntools import chunk
+from meza.process import group
+
+from csv2ofx.grouping import group_hashed, group_records
+
+from .bench import parse_size
+from .generate import SHAPES as CSV_SHAPES
+from .generate import write_csv
+
+SHAPES = "many_accounts,xero"
+
+
+def group_chunks(records, keyfunc, chunksize):
+    for chnk in chunk(records, chunksize):
+        yield from group(chnk, keyfunc)
+
+
+ENGINES = {
+    "meza (per chunk)": group_chunks,
+    "sorted": group_records,
+    "sorted (in memory)": lambda *args: group_records(*args[:2]),
+    "appearance": group_hashed,
+    "appearance (in memory)": lambda *args: group_hashed(*args[:2]),
+}
+
+
+def load_trxns(shape, source):
+    """Reads the transactions of a synthetic csv file
+
+    Returns:
+        (Tuple): the transactions and their grouping key function
+    """
+    from meza.io import read_csv
+
+    from csv2ofx.main import load_package_module
+    from csv2ofx.qif import QIF
+
+    cont = QIF(load_package_module(CSV_SHAPES[shape]["mapping"]).mapping)
+
+    with open(source, encoding="utf-8") as f:
+        trxns = list(cont.gen_records(read_csv(f, has_header=cont.has_header)))
+
+    keyfunc = cont.id if cont.is_split else cont.account
+    return trxns, keyfunc
+
+
+def time_engine(engine, trxns, keyfunc, chunksize):
+    """Times a grouping engine
+
+    Returns:
+        (Tuple): the elapsed seconds and number of groups
+    """
+    start = time.perf_counter()
+    groups = sum(1 for _ in engine(trxns, keyfunc, chunksize))
+    return time.perf_counter() - start, groups
+
+
+parser = ArgumentParser(description="benchmarks csv2ofx grouping engines")
+parser.add_argument(
+    "-s", "--shapes", default=SHAPES, help=f"comma separated csv shapes ({SHAPES})"
+)
+parser.add_argument(
+    "-n", "--sizes", default="100k,1M", help="comma separated row counts"
+)
+parser.add_argument(
+    "-C", "--chunksize", type=int, default=2**14, help="rows per chunk or run"
+)
+parser.add_argument(
+    "-d",
+    "--data-dir",
+    default=os.path.join(tempfile.gettempdir(), "csv2ofx-bench"),
+    help="where to keep the generated csv files",
+)
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    os.makedirs(args.data_dir, exist_ok=True)
+    print(f"{'shape/rows':<24}{'engine':<24}{'seconds':>9}{'groups':>9}")
+
+    for size in args.sizes.split(","):
+        rows = parse_size(size)
+
+        for shape in args.shapes.split(","):
+            source = os.path.join(args.data_dir, f"{shape}-{rows}.csv")
+
+            if not os.path.exists(source):
+                write_csv(shape, rows, source)
+
+            trxns, keyfunc = load_trxns(shape, source)
+            name = f"{shape}/{rows}"
+
+            for engine, func in ENGINES.items():
+                seconds, groups = time_engine(func, trxns, keyfunc, args.chunksize)
+                print(f"{name:<24}{engine:<24}{seconds:>9.3f}{groups:>9}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
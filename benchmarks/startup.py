@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+benchmarks.startup
+~~~~~~~~~~~~~~~~~~
+
+Benchmarks the startup of the csv2ofx CLI with `python -X importtime` and
+checks it against a time budget
+
+Each measurement runs in a fresh interpreter. The fastest of `--repeat` runs
+is reported, along with the modules which took the longest to import. Modules
+which should only be imported once a conversion starts (see `LAZY_MODULES`)
+are reported as well.
+
+Examples:
+    literal blocks::
+
+        python -m benchmarks.startup --budget 40
+
+Attributes:
+    LAZY_MODULES (list): Prefixes of the modules `csv2ofx.main` shouldn't
+        import.
+    COMMANDS (list): The CLI commands timed (as arguments to `csv2ofx`).
+"""
+
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+LAZY_MODULES = [
+    "meza",
+    "dateutil",
+    "numpy",
+    "csv2ofx.api",
+    "csv2ofx.ofx",
+    "csv2ofx.qif",
+    "csv2ofx.mappings.",
+]
+COMMANDS = [["--version"], ["--list-mappings"]]
+
+
+def parse_importtime(lines):
+    """Parses the output of `python -X importtime`
+
+    Args:
+        lines (Iter[str]): The lines written to stderr.
+
+    Returns:
+        (dict): the self and cumulative import time (in microseconds) of each
+            module, in import order
+
+    Examples:
+        >>> lines = [
+        ...     'import time: self [us] | cumulative | imported package',
+        ...     'import time:       120 |        120 |   csv2ofx.utils',
+        ...     'import time:       300 |        420 | csv2ofx']
+        >>> parse_importtime(lines)
+        {'csv2ofx.utils': (120, 120), 'csv2ofx': (300, 420)}
+    """
+    times = {}
+
+    for line in lines:
+        _, _, fields = line.partition("import time:")
+        columns = [column.strip() for column in fields.split("|")]
+
+        if len(columns) == 3 and columns[0].isdigit():
+            times[columns[2]] = (int(columns[0]), int(columns[1]))
+
+    return times
+
+
+def find_lazy(modules):
+    """Finds the modules which should have been imported lazily
+
+    Examples:
+        >>> find_lazy(['csv2ofx.utils', 'meza.io', 'csv2ofx.mappings.mint'])
+        ['meza.io', 'csv2ofx.mappings.mint']
+    """
+    return [m for m in modules if any(m.startswith(p) for p in LAZY_MODULES)]
+
+
+def measure_import(code="import csv2ofx.main"):
+    """Runs code in a fresh interpreter and times its imports
+
+    Returns:
+        (dict): see `parse_importtime` (including the interpreter's own
+            startup imports)
+    """
+    command = [sys.executable, "-X", "importtime", "-c", code]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    return parse_importtime(result.stderr.splitlines())
+
+
+def measure_command(args):
+    """Times a CLI command in a fresh interpreter
+
+    Returns:
+        (float): the elapsed milliseconds
+    """
+    command = [sys.executable, "-m", "csv2ofx", *args]
+    start = time.perf_counter()
+    subprocess.run(command, capture_output=True, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+parser = ArgumentParser(description="benchmarks csv2ofx CLI startup")
+parser.add_argument(
+    "-r", "--repeat", type=int, default=5, help="runs per measurement (default: 5)"
+)
+parser.add_argument(
+    "-b",
+    "--budget",
+    type=float,
+    default=40,
+    help="maximum milliseconds to import csv2ofx.main (default: 40)",
+)
+parser.add_argument(
+    "-t", "--top", type=int, default=10, help="number of slowest imports to show"
+)
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    runs = [measure_import() for _ in range(args.repeat)]
+    times = min(runs, key=lambda run: run["csv2ofx.main"][1])
+    elapsed = times["csv2ofx.main"][1] / 1000
+
+    # leave out the modules the interpreter imports at startup
+    startup = measure_import("pass")
+    imported = [name for name in times if name not in startup]
+
+    print(f"{'import':<40}{'self ms':>10}{'total ms':>10}")
+    slowest = sorted(imported, key=lambda name: times[name][0], reverse=True)
+
+    for name in slowest[: args.top]:
+        self_ms, total_ms = (t / 1000 for t in times[name])
+        print(f"{name:<40}{self_ms:>10.2f}{total_ms:>10.2f}")
+
+    print()
+
+    for command in COMMANDS:
+        ms = min(measure_command(command) for _ in range(args.repeat))
+        print(f"{'csv2ofx ' + ' '.join(command):<40}{ms:>20.2f}")
+
+    lazy = find_lazy(imported)
+    print(f"\nImported csv2ofx.main in {elapsed:.2f}ms (budget: {args.budget:g}ms)")
+
+    if lazy:
+        print(f"Imported eagerly: {', '.join(lazy)}")
+
+    return 1 if lazy or elapsed > args.budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
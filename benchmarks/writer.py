@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+benchmarks.writer
+~~~~~~~~~~~~~~~~~
+
+Benchmarks end to end conversions of synthetic csv files (see
+`benchmarks.generate`) with the block writer (see `csv2ofx.sink`) against the
+original `meza.io.IterStringIO` and `meza.io.write` writer
+
+Each conversion reads its csv file and writes a real file, so the numbers
+include the whole pipeline.
+
+Examples:
+    literal blocks::
+
+        python -m benchmarks.writer --sizes 100k,1M
+
+Attributes:
+    SHAPES (str): The default csv shapes.
+    WRITERS (dict): The writers, keyed by name. Each receives the content
+        chunks, a text file, and the buffer size, and returns the number of
+        bytes (or characters) written.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from datetime import datetime as dt
+
+from .bench import parse_size
+from .generate import SHAPES as CSV_SHAPES
+from .generate import write_csv
+
+SHAPES = "mint,xero"
+
+
+def meza_write(content, f, buffer_size):
+    from meza.io import IterStringIO, write
+
+    from csv2ofx.api import check
+
+    return write(f, IterStringIO(check(content)), chunksize=buffer_size)
+
+
+def block_write(content, f, buffer_size):
+    from csv2ofx.api import write_content
+
+    return write_content(content, f, buffer_size)
+
+
+WRITERS = {"meza": meza_write, "block": block_write}
+
+
+def time_writer(writer, shape, source, dest, qif=False, buffer_size=2**16):
+    """Times the conversion of a synthetic csv file
+
+    Returns:
+        (Tuple): the elapsed seconds and the size of the output file
+    """
+    from meza.io import read_csv
+
+    from csv2ofx.api import gen_content, get_content
+    from csv2ofx.main import load_package_module
+
+    mapping = load_package_module(CSV_SHAPES[shape]["mapping"]).mapping
+    cont = get_content(mapping, qif=qif, end=dt(2030, 1, 1))
+    start = time.perf_counter()
+
+    with open(source, encoding="utf-8") as f, open(dest, "w", encoding="utf-8") as g:
+        records = read_csv(f, has_header=cont.has_header)
+        content = gen_content(cont, records, server_date=dt(2030, 1, 1))
+        writer(content, g, buffer_size)
+
+    return time.perf_counter() - start, os.path.getsize(dest)
+
+
+parser = ArgumentParser(description="benchmarks csv2ofx output writers")
+parser.add_argument(
+    "-s", "--shapes", default=SHAPES, help=f"comma separated csv shapes ({SHAPES})"
+)
+parser.add_argument(
+    "-n", "--sizes", default="100k,1M", help="comma separated row counts"
+)
+parser.add_argument(
+    "-f", "--formats", default="ofx,qif", help="comma separated output formats"
+)
+parser.add_argument(
+    "-B",
+    "--buffer-size",
+    type=int,
+    default=2**16,
+    help="characters written at a time",
+)
+parser.add_argument(
+    "-d",
+    "--data-dir",
+    default=os.path.join(tempfile.gettempdir(), "csv2ofx-bench"),
+    help="where to keep the generated csv files",
+)
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    os.makedirs(args.data_dir, exist_ok=True)
+    header = f"{'shape/format/rows':<28}{'writer':<8}{'seconds':>9}{'MB/sec':>9}"
+    print(f"{header}{'rows/sec':>12}")
+
+    for size in args.sizes.split(","):
+        rows = parse_size(size)
+
+        for shape in args.shapes.split(","):
+            source = os.path.join(args.data_dir, f"{shape}-{rows}.csv")
+
+            if not os.path.exists(source):
+                write_csv(shape, rows, source)
+
+            for fmt in args.formats.split(","):
+                name = f"{shape}/{fmt}/{rows}"
+                dest = os.path.join(args.data_dir, f"{shape}-{rows}.{fmt}")
+
+                for writer, func in WRITERS.items():
+                    tkwargs = {"qif": fmt == "qif", "buffer_size": args.buffer_size}
+                    seconds, size = time_writer(func, shape, source, dest, **tkwargs)
+                    speed = f"{size / seconds / 2**20:>9.1f}{rows / seconds:>12.0f}"
+                    print(f"{name:<28}{writer:<8}{seconds:>9.3f}{speed}")
+
+                os.remove(dest)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,26 +16,97 @@ Attributes:
     ENCODING (str): Default file encoding.
 """
 
+import copy
 import hashlib
+from contextlib import suppress
 from datetime import datetime as dt
 from decimal import Decimal
-from functools import partial
-
-from dateutil.parser import parse
-from meza.process import group, merge
+from functools import lru_cache, partial
 
 from . import utils
 
+DATE_CACHE_SIZE = 2**12
+IDENTITY_CACHE_SIZE = 2**10
+INFER_SAMPLE_SIZE = 64
+
+# Number of rendered records joined into each block yielded by `gen_body`
+BLOCK_SIZE = 2**9
+
+# Mapping fields read by `Content.transaction_data` along with their defaults
+FIELDS = {
+    "account": None,
+    "split_account": None,
+    "inv_split_account": None,
+    "bank": None,
+    "bank_id": None,
+    "account_id": None,
+    "amount": None,
+    "type": "",
+    "date": None,
+    "payee": None,
+    "desc": None,
+    "notes": None,
+    "check_num": None,
+    "category": "",
+    "shares": 0,
+    "symbol": "",
+    "price": 0,
+    "balance": None,
+    "currency": "USD",
+    "class": None,
+    "id": None,
+}
+
 
 # pylint: disable=invalid-name
 def md5(content):
     return hashlib.md5(content.encode("utf-8")).hexdigest()
 
 
-class BalanceError(Exception):
+class ConversionError(Exception):
+    """Base class of the errors raised while converting"""
+
+
+class BalanceError(ConversionError):
     """Raised if no ending balance when MS Money compatible output requested"""
 
-    pass
+
+class UnsortedError(ConversionError):
+    """Raised if a group reappears in a source which was said to be presorted"""
+
+
+class MissingFieldError(ConversionError):
+    """Raised if a field the mapping reads is missing from the source"""
+
+
+class NoDataError(ConversionError):
+    """Raised if there is nothing to write"""
+
+
+class MappingError(ConversionError):
+    """Raised if a value can't be parsed, e.g., because of a broken mapping"""
+
+
+class Transaction(dict):
+    """A csv row which holds on to its parsed date, amount and balance (and
+    possibly its transaction data) so that each of them is only parsed once
+    (see `Content.gen_records` and `csv2ofx.parallel`). An escaped row (see
+    `OFX.gen_records`) also holds on to the `raw` csv row.
+
+    Examples:
+        >>> from csv2ofx.mappings.mint import mapping
+        >>>
+        >>> content = Content(mapping)
+        >>> trxn = Transaction({'Date': '06/12/10', 'Amount': '$1,000'})
+        >>> trxn['Amount']
+        '$1,000'
+        >>> content.convert_amount(trxn)
+        Decimal('1000.00')
+        >>> trxn.amount
+        Decimal('1000.00')
+    """
+
+    __slots__ = ("amount", "balance", "data", "date", "raw")
 
 
 class Content:  # pylint: disable=too-many-instance-attributes
@@ -53,6 +124,18 @@ class Content:  # pylint: disable=too-many-instance-attributes
             date_fmt (str): Transaction date format (defaults to '%m/%d/%y').
             dayfirst (bool): Interpret the first value in ambiguous dates (e.g. 01/05/09)
                 as the day (ignored if `parse_fmt` is present).
+            infer_fmt (bool or int): Infer a date parsing format from the first
+                (distinct) dates of the file, falling back to `dateutil` for
+                dates which don't match it (ignored if `parse_fmt` is present).
+                An integer sets the number of dates to sample (default: 64).
+            date_cache_size (int): Number of parsed dates to keep in memory
+                (default: 4096).
+            thousand_sep (char): Amount thousand's separator (default: None,
+                i.e., detect from the first amounts).
+            decimal_sep (char): Amount decimal separator (default: None, i.e.,
+                detect from the first amounts).
+            fitid_hash (str): `hashlib` algorithm used to generate transaction
+                ids for transactions without one (default: 'md5').
             filter (func): Keep transactions for which function returns true
 
         Examples:
@@ -67,6 +150,10 @@ class Content:  # pylint: disable=too-many-instance-attributes
         self.account = "N/A"
         self.parse_fmt = kwargs.get("parse_fmt")
         self.dayfirst = kwargs.get("dayfirst")
+        self.infer_fmt = kwargs.get("infer_fmt")
+        self.thousand_sep = kwargs.get("thousand_sep")
+        self.decimal_sep = kwargs.get("decimal_sep")
+        self.fitid_hash = kwargs.get("fitid_hash") or "md5"
         self.filter = kwargs.get("filter") or bool
         self.ms_money = kwargs.get("ms_money")
         self.split_account = None
@@ -87,15 +174,199 @@ class Content:  # pylint: disable=too-many-instance-attributes
 
         self.start = kwargs.get("start") or dt(1970, 1, 1)
         self.end = kwargs.get("end") or dt.now()
+        self.plan = {name: self.compile(name, FIELDS[name]) for name in FIELDS}
+
+        self.hash_identity = lru_cache(maxsize=IDENTITY_CACHE_SIZE)(md5)
+        self.hash_fitid = utils.get_hasher(self.fitid_hash)
+        self.classify_action = utils.Classifier(utils.ACTION_TYPES, "ShrsIn")
+        self.date_cache_size = kwargs.get("date_cache_size", DATE_CACHE_SIZE)
+
+        if self.infer_fmt and not self.parse_fmt:
+            infer_fmt = self.infer_fmt
+            self.sample_size = INFER_SAMPLE_SIZE if infer_fmt is True else infer_fmt
+
+        self.init_context()
+
+    def init_context(self):
+        """Sets up the state of a single conversion, i.e., what is learned
+        about the dates and amounts along with any subclass output state. The
+        rest of the attributes (the configuration) is never changed by a
+        conversion."""
+        separators = (self.thousand_sep, self.decimal_sep)
+        self.amount_parser = utils.AmountParser(*separators)
+        self.balance_parser = utils.AmountParser(*separators)
+
+        parse_datestr = partial(type(self).parse_datestr, self)
+        self.parse_datestr = lru_cache(maxsize=self.date_cache_size)(parse_datestr)
+        self.inferred_fmt = None
+        self.date_fallbacks = 0
+
+        if self.infer_fmt and not self.parse_fmt:
+            self.date_samples = []
+        else:
+            self.date_samples = None
+
+    def context(self):
+        """Creates a per conversion context
+
+        The context shares this object's configuration (e.g., the compiled
+        mapping and account type tables) but has its own conversion state (see
+        `init_context`), so one configured object can serve any number of
+        (concurrent) conversions.
+
+        Returns:
+            (obj): a shallow copy with a fresh conversion state
+
+        Examples:
+            >>> content = Content({'infer_fmt': 2})
+            >>> context = content.context()
+            >>> context.parse_datestr('12/06/10')
+            datetime.datetime(2010, 12, 6, 0, 0)
+            >>> context.date_samples, content.date_samples
+            (['12/06/10'], [])
+            >>> context.plan is content.plan
+            True
+        """
+        context = copy.copy(self)
+        context.init_context()
+        return context
+
+    def compile(self, name, default=None):
+        """Compiles a mapping attribute into a function of the transaction.
+        The resulting function behaves like `get`, but all the attribute
+        lookups and type checks are done once up front.
+
+        Args:
+            name (str): The attribute.
+            default (str): Value to use if `name` isn't found (default: None).
+
+        Returns:
+            (func): Function which receives a transaction (and optionally a
+                default) and returns the attribute value.
+
+        Examples:
+            >>> from csv2ofx.mappings.mint import mapping
+            >>>
+            >>> trxn = {'Transaction Type': 'DEBIT', 'Amount': 1000.00}
+            >>> content = Content(mapping)
+            >>> content.compile('amount')(trxn)  # mapping function
+            1000.0
+            >>> content.compile('has_header')(trxn)  # mapping attribute
+            True
+            >>> content.compile('symbol', 'N/A')(trxn)  # missing attribute
+            'N/A'
+            >>> content.compile('payee')(trxn, 'payee')  # missing column
+            'payee'
+        """
+        attr = getattr(self, name, None)
+
+        if not attr:
+
+            def getter(trxn, default=default):
+                return default
+
+        elif callable(attr):
+
+            def getter(trxn, default=default):
+                try:
+                    return attr(trxn)
+                except TypeError:
+                    return attr
+                except KeyError:
+                    return default
+
+        else:
+
+            def getter(trxn, default=default):
+                return attr
+
+        return getter
 
     def parse_date(self, trxn):
+        try:
+            return trxn.date
+        except AttributeError:
+            parsed = self.parse_datestr(self.plan["date"](trxn))
+
+        if isinstance(trxn, Transaction):
+            trxn.date = parsed
+
+        return parsed
+
+    def parse_datestr(self, content):
+        """Parses a date string (results are cached per distinct string)
+
+        Args:
+            content (str): The date string.
+
+        Returns:
+            (datetime): The parsed date.
+
+        Examples:
+            >>> content = Content({'dayfirst': True, 'infer_fmt': 2})
+            >>> content.parse_datestr('12/06/10')
+            datetime.datetime(2010, 6, 12, 0, 0)
+            >>> content.parse_datestr('13/06/10')
+            datetime.datetime(2010, 6, 13, 0, 0)
+            >>> content.inferred_fmt
+            '%d/%m/%y'
+            >>> content.parse_datestr('2010-06-14')
+            datetime.datetime(2010, 6, 14, 0, 0)
+            >>> content.date_fallbacks
+            1
+        """
         if self.parse_fmt:
-            parsed = dt.strptime(self.get("date", trxn), self.parse_fmt)
-        else:
-            parsed = parse(self.get("date", trxn), dayfirst=self.dayfirst)
+            return dt.strptime(content, self.parse_fmt)
+
+        if self.inferred_fmt:
+            try:
+                return dt.strptime(content, self.inferred_fmt)
+            except ValueError:
+                self.date_fallbacks += 1
+
+        from dateutil.parser import parse
+
+        parsed = parse(content, dayfirst=self.dayfirst)
+
+        if self.date_samples is not None:
+            self.date_samples.append(content)
+
+            if len(self.date_samples) >= self.sample_size:
+                samples, self.date_samples = self.date_samples, None
+                self.inferred_fmt = utils.infer_date_format(samples, self.dayfirst)
 
         return parsed
 
+    def date_stats(self):
+        """Gets the date parsing statistics
+
+        Returns:
+            (dict): The date cache hits, misses, hit rate and size, along with
+                the inferred format and number of dates which didn't match it.
+
+        Examples:
+            >>> from csv2ofx.mappings.mint import mapping
+            >>>
+            >>> content = Content(mapping)
+            >>> trxn = {'Date': '06/12/10'}
+            >>> dates = [content.parse_date(trxn) for _ in range(4)]
+            >>> content.date_stats() == {
+            ...     'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'size': 1,
+            ...     'inferred_fmt': None, 'fallbacks': 0}
+            True
+        """
+        info = self.parse_datestr.cache_info()
+        lookups = info.hits + info.misses
+
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "hit_rate": info.hits / lookups if lookups else 0,
+            "size": info.currsize,
+            "inferred_fmt": self.inferred_fmt,
+            "fallbacks": self.date_fallbacks,
+        }
+
     def get(self, name, trxn=None, default=None):
         """Gets an attribute which could be either a normal attribute,
         a mapping function, or a mapping attribute
@@ -195,7 +466,46 @@ class Content:  # pylint: disable=too-many-instance-attributes
             >>> Content(mapping, start=dt(2010, 1, 1)).convert_amount(trxn)
             Decimal('1000.00')
         """
-        return utils.convert_amount(self.get("amount", trxn))
+        try:
+            return trxn.amount
+        except AttributeError:
+            amount = self.amount_parser(self.plan["amount"](trxn))
+
+        if isinstance(trxn, Transaction):
+            trxn.amount = amount
+
+        return amount
+
+    def convert_balance(self, trxn):
+        """Converts a string balance into a number
+
+        Args:
+            trxn (dict): The transaction.
+
+        Returns:
+            (decimal): The converted balance (or None if there is no balance).
+
+        Examples:
+            >>> from csv2ofx.mappings.schwabchecking import mapping
+            >>>
+            >>> trxn = {'RunningBalance': '$1,036.47'}
+            >>> Content(mapping).convert_balance(trxn)
+            Decimal('1036.47')
+            >>> Content().convert_balance(trxn) is None
+            True
+        """
+        try:
+            return trxn.balance
+        except AttributeError:
+            balance = self.plan["balance"](trxn)
+
+        if balance is not None:
+            balance = self.balance_parser(balance)
+
+        if isinstance(trxn, Transaction):
+            trxn.balance = balance
+
+        return balance
 
     def transaction_data(self, trxn):  # pylint: disable=too-many-locals
         """gets transaction data
@@ -231,47 +541,51 @@ class Content:  # pylint: disable=too-many-instance-attributes
             ...     'x_action': '', 'balance': None}
             True
         """
-        account = self.get("account", trxn)
-        split_account = self.get("split_account", trxn)
-        bank = self.get("bank", trxn, account)
-        raw_amount = str(self.get("amount", trxn))
+        plan = self.plan
+        account = plan["account"](trxn)
+        split_account = plan["split_account"](trxn)
+        bank = plan["bank"](trxn, account)
+        raw_amount = str(plan["amount"](trxn))
         amount = self.convert_amount(trxn)
-        _type = self.get("type", trxn, "").upper()
+        _type = plan["type"](trxn).upper()
 
         if _type not in {"DEBIT", "CREDIT"}:
             _type = "CREDIT" if amount > 0 else "DEBIT"
 
-        date = self.get("date", trxn)
-        payee = self.get("payee", trxn)
-        desc = self.get("desc", trxn)
-        notes = self.get("notes", trxn)
+        date = plan["date"](trxn)
+        payee = plan["payee"](trxn)
+        desc = plan["desc"](trxn)
+        notes = plan["notes"](trxn)
         memo = f"{desc} {notes}" if desc and notes else desc or notes
-        check_num = self.get("check_num", trxn)
+        check_num = plan["check_num"](trxn)
         details = "".join(filter(None, [date, raw_amount, payee, memo]))
-        category = self.get("category", trxn, "")
-        shares = Decimal(self.get("shares", trxn, 0))
-        symbol = self.get("symbol", trxn, "")
-        price = Decimal(self.get("price", trxn, 0))
+        category = plan["category"](trxn)
+        shares = Decimal(plan["shares"](trxn))
+        symbol = plan["symbol"](trxn)
+        price = Decimal(plan["price"](trxn))
         invest = shares or (symbol and symbol != "N/A") or "invest" in category
-        balance = self.get("balance", trxn)
-        if balance is not None:
-            balance = utils.convert_amount(balance)
+        balance = self.convert_balance(trxn)
+
+        if split_account:
+            split_account_id = self.hash_identity(split_account)
+        else:
+            split_account_id = None
 
         if invest:
             amount = abs(amount)
             shares = shares or (amount / price) if price else shares
             amount = amount or shares * price
             price = price or (amount / shares) if shares else price
-            action = utils.get_action(category)
-            x_action = utils.get_action(category, True)
+            action = self.classify_action(category)
+            x_action = f"{action}X" if action in utils.TRANSFERABLE else action
         else:
             amount = -1 * abs(amount) if _type == "DEBIT" else abs(amount)
             action = ""
             x_action = ""
 
-        return {
+        data = {
             "date": self.parse_date(trxn),
-            "currency": self.get("currency", trxn, "USD"),
+            "currency": plan["currency"](trxn),
             "shares": shares,
             "symbol": symbol,
             "price": price,
@@ -280,34 +594,148 @@ class Content:  # pylint: disable=too-many-instance-attributes
             "category": category,
             "is_investment": invest,
             "bank": bank,
-            "bank_id": self.get("bank_id", trxn, md5(bank)),
+            "bank_id": plan["bank_id"](trxn, self.hash_identity(bank)),
             "account": account,
-            "account_id": self.get("account_id", trxn, md5(account)),
+            "account_id": plan["account_id"](trxn, self.hash_identity(account)),
             "split_account": split_account,
-            "inv_split_account": self.get("inv_split_account", trxn),
-            "split_account_id": md5(split_account) if split_account else None,
+            "inv_split_account": plan["inv_split_account"](trxn),
+            "split_account_id": split_account_id,
             "amount": amount,
             "payee": payee,
             "memo": memo,
-            "class": self.get("class", trxn),
-            "id": self.get("id", trxn, check_num) or md5(details),
+            "class": plan["class"](trxn),
+            "id": plan["id"](trxn, check_num) or self.hash_fitid(details),
             "check_num": check_num,
             "type": _type,
             "balance": balance,
         }
 
+        return self.format_data(data)
+
+    def format_data(self, data):
+        """Adds the output format specific transaction data (see the `OFX` and
+        `QIF` subclasses)
+
+        Args:
+            data (dict): the transaction data
+
+        Returns:
+            (dict): the transaction data
+        """
+        return data
+
+    def get_data(self, trxn):
+        """Gets the transaction data, reusing any data already attached to the
+        transaction (e.g., by a `csv2ofx.parallel` worker)
+
+        Args:
+            trxn (dict): the transaction
+
+        Returns:
+            (dict): the transaction data (see `transaction_data`)
+
+        Examples:
+            >>> trxn = Transaction({'Amount': '1'})
+            >>> trxn.data = {'amount': 1}
+            >>> Content().get_data(trxn)
+            {'amount': 1}
+        """
+        try:
+            return trxn.data
+        except AttributeError:
+            return self.transaction_data(trxn)
+
+    def gen_records(self, records):
+        """Generate normalized transaction records
+
+        Args:
+            records (Iter[dict]): The csv rows.
+
+        Yields:
+            (Transaction): a transaction record
+
+        Examples:
+            >>> records = Content().gen_records([{'Amount': '$1,000'}])
+            >>> next(records)
+            {'Amount': '$1,000'}
+        """
+        for record in records:
+            yield record if isinstance(record, Transaction) else Transaction(record)
+
+    @property
+    def settled(self):
+        """Whether the date format and amount separators have been learned
+        (or aren't being learned), i.e., parsing more rows won't change them
+
+        Examples:
+            >>> content = Content({'infer_fmt': 2})
+            >>> content.parse_datestr('06/12/10')
+            datetime.datetime(2010, 6, 12, 0, 0)
+            >>> content.settled
+            False
+            >>> content.parse_datestr('06/13/10')
+            datetime.datetime(2010, 6, 13, 0, 0)
+            >>> content.settled
+            True
+        """
+        parsers = (self.amount_parser, self.balance_parser)
+        settled = all(parser.settled for parser in parsers)
+        return self.date_samples is None and settled
+
+    def gen_learned(self, records):
+        """Generate normalized transaction records, parsing the date, amount,
+        and balance of the first ones until they are `settled`
+
+        What is learned from the values (see `parse_datestr` and
+        `utils.AmountParser`) then only depends on the file order of the
+        records (rather than on the order of the groups or on which records
+        are filtered out), the same as in a parallel or columnar conversion.
+        Any error is left for the later stages to raise.
+
+        Args:
+            records (Iter[dict]): The csv rows.
+
+        Yields:
+            (Transaction): a transaction record
+
+        Examples:
+            >>> from operator import itemgetter
+            >>>
+            >>> content = Content({'date': itemgetter('Date'), 'infer_fmt': 2})
+            >>> records = [{'Date': '13/01/15'}, {'Date': '14/01/15'}]
+            >>> trxns = list(content.gen_learned(records))
+            >>> content.inferred_fmt, trxns[0].date
+            ('%d/%m/%y', datetime.datetime(2015, 1, 13, 0, 0))
+        """
+        trxns = self.gen_records(records)
+
+        for trxn in trxns:
+            for parse in (self.parse_date, self.convert_amount, self.convert_balance):
+                # pylint: disable=broad-except
+                with suppress(Exception):
+                    parse(trxn)
+
+            yield trxn
+
+            if self.settled:
+                break
+
+        yield from trxns
+
     def gen_trxns(self, groups, collapse=False):
         """Generate transactions"""
+        from meza.process import group, merge
+
         for grp, transactions in groups:
             if self.is_split and collapse:
                 # group transactions by `collapse` field and sum the amounts
                 byaccount = group(transactions, collapse)
 
                 def oprtn(values):
-                    return sum(map(utils.convert_amount, values))
+                    return sum(map(self.amount_parser, values))
 
                 merger = partial(merge, pred=self.amount, op=oprtn)
-                trxns = [merger(dicts) for _, dicts in byaccount]
+                trxns = [Transaction(merger(dicts)) for _, dicts in byaccount]
             else:
                 trxns = transactions
 
@@ -330,12 +758,15 @@ class Content:  # pylint: disable=too-many-instance-attributes
 
             if self.is_split:
                 main_pos = utils.get_max_split(*_args)[0]
+
+                # pylint: disable=cell-var-from-loop
+                def keyfunc(enum):
+                    return enum[0] != main_pos
+
+                sorted_trxns = sorted(enumerate(filtered_trxns), key=keyfunc)
             else:
+                # the main transaction is already first, so stream the group
                 main_pos = 0
+                sorted_trxns = enumerate(filtered_trxns)
 
-            # pylint: disable=cell-var-from-loop
-            def keyfunc(enum):
-                return enum[0] != main_pos
-
-            sorted_trxns = sorted(enumerate(filtered_trxns), key=keyfunc)
             yield (grp, main_pos, sorted_trxns)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+csv2ofx.api
+~~~~~~~~~~~
+
+Provides a library interface to the conversion pipeline, i.e., without
+`argparse` or `sys.exit`
+
+Examples:
+    literal blocks::
+
+        from csv2ofx.api import convert
+        from csv2ofx.mappings.mint import mapping
+
+        with open('transactions.csv') as source, open('out.ofx', 'w') as sink:
+            convert(source, mapping, sink, start='2024-01-01')
+"""
+
+import itertools as it
+from datetime import datetime as dt
+from math import inf
+
+from dateutil.parser import parse
+from meza.io import read_csv
+
+from . import Content, MappingError, MissingFieldError, NoDataError, utils
+from .ofx import OFX
+from .profile import no_wrap
+from .qif import QIF
+from .sink import BlockWriter
+
+
+def get_content(mapping, qif=False, **kwargs):
+    """Creates the OFX or QIF content object
+
+    Args:
+        mapping (dict): The bank mapping (see `csv2ofx.mappings`).
+        qif (bool): Create QIF (rather than OFX) content.
+        kwargs (dict): Keyword arguments.
+
+    Kwargs:
+        account_type (str): The default QIF account type (default: 'Bank').
+            OFX content always defaults to 'CHECKING'.
+        start (str or datetime): Date from which to begin including
+            transactions.
+        end (str or datetime): Date from which to exclude transactions.
+        dayfirst (bool): Interpret the first value in ambiguous `start` and
+            `end` dates as the day.
+        ms_money (bool): Create MS Money compatible OFX content.
+        infer_fmt (bool or int): Infer the date format (see `Content`).
+        fitid_hash (str): `hashlib` algorithm used to generate transaction
+            ids (see `Content`).
+
+    Returns:
+        (obj): the OFX or QIF content object
+
+    Examples:
+        >>> from csv2ofx.mappings.default import mapping
+        >>> get_content(mapping, start='2015-03-01').start
+        datetime.datetime(2015, 3, 1, 0, 0)
+        >>> get_content(mapping, qif=True).def_type
+        'Bank'
+    """
+    dates = {}
+
+    for name in ["start", "end"]:
+        date = kwargs.get(name)
+
+        if isinstance(date, str):
+            date = parse(date, dayfirst=kwargs.get("dayfirst"))
+
+        dates[name] = date
+
+    okwargs = {
+        "def_type": kwargs.get("account_type") or "Bank" if qif else "CHECKING",
+        "ms_money": kwargs.get("ms_money"),
+        "infer_fmt": kwargs.get("infer_fmt"),
+        "fitid_hash": kwargs.get("fitid_hash"),
+        **dates,
+    }
+
+    return QIF(mapping, **okwargs) if qif else OFX(mapping, **okwargs)
+
+
+def get_read_kwargs(cont, first_row=0, last_row=inf, first_col=0):
+    """Gets the keyword arguments `meza.io.read_csv` needs to read a source
+
+    Args:
+        cont (obj): The OFX or QIF content object.
+        first_row (int): The first row to process (zero based).
+        last_row (int): The last row to process (zero based).
+        first_col (int): The first column to process (zero based).
+
+    Returns:
+        (dict): the `read_csv` keyword arguments (the mapping's rows and
+            columns take precedence)
+
+    Examples:
+        >>> from csv2ofx.mappings.default import mapping
+        >>> get_read_kwargs(get_content(mapping))['delimiter']
+        ','
+    """
+    return {
+        "has_header": cont.has_header,
+        "custom_header": getattr(cont, "custom_header", None),
+        "delimiter": getattr(cont, "delimiter", ","),
+        "first_row": getattr(cont, "first_row", first_row),
+        "last_row": getattr(cont, "last_row", last_row),
+        "first_col": getattr(cont, "first_col", first_col),
+    }
+
+
+def gen_content(cont, records, collapse=None, chunksize=None, **kwargs):
+    """Generates the OFX or QIF content of csv records
+
+    Args:
+        cont (obj): The OFX or QIF content object.
+        records (Iter[dict]): The csv records.
+        collapse (str): Field used to combine transactions within a split for
+            double entry statements.
+        chunksize (int): Maximum number of records held in memory while
+            grouping (default: unlimited).
+        kwargs (dict): Keyword arguments.
+
+    Kwargs:
+        presorted (bool): The records are already contiguous by account (or
+            split id), see `Content.gen_groups`.
+        group_order (str): Order of the groups, 'sorted' or 'appearance'.
+        server_date (datetime): The OFX server date (default: now).
+        language (str): The OFX language (default: 'ENG').
+        ending_balance (float): The OFX ending balance.
+        deduper (obj): A `csv2ofx.dedupe.Deduper` to remove duplicate
+            transactions with.
+        profiler (obj): A `csv2ofx.profile.Profiler` to time the stages with.
+
+    Yields:
+        (str): the content chunks
+
+    Examples:
+        >>> from csv2ofx.mappings.default import mapping
+        >>>
+        >>> qif = get_content(mapping, qif=True)
+        >>> with open('data/test/default.csv', encoding='utf-8') as f:
+        ...     content = ''.join(gen_content(qif, read_csv(f)))
+        >>> content.splitlines()[:2]
+        ['!Account', 'NCash']
+    """
+    profiler = kwargs.get("profiler")
+    deduper = kwargs.get("deduper")
+    wrap = profiler.wrap if profiler else no_wrap
+
+    records = wrap("read", records, profiler and profiler.count("rows_read"))
+    records = cont.gen_learned(records)
+    gargs = (kwargs.get("presorted"), kwargs.get("group_order") or "sorted")
+    groups = wrap("group", cont.gen_groups(records, chunksize, *gargs))
+    trxns = wrap("trxns", cont.gen_trxns(groups, collapse))
+    cleaned = cont.clean_trxns(trxns)
+    cleaned_trxns = wrap("clean", cleaned, profiler and profiler.count("groups"))
+    data = utils.gen_data(cleaned_trxns)
+
+    if deduper:
+        data = deduper.filter(data, cont)
+
+    data = wrap("data", data, profiler and profiler.count_data)
+    body = wrap("body", cont.gen_body(data))
+    server_date = kwargs.get("server_date") or dt.now()
+    language = kwargs.get("language") or "ENG"
+    header = cont.header(date=server_date, language=language)
+    footer = cont.footer(date=server_date, balance=kwargs.get("ending_balance"))
+    yield from it.chain.from_iterable(filter(None, [header, body, footer]))
+
+
+def check(content):
+    """Raises the errors of the conversion pipeline as `ConversionError`s
+
+    Args:
+        content (Iter[str]): The content chunks.
+
+    Yields:
+        (str): the content chunks
+
+    Raises:
+        MissingFieldError: If a field the mapping reads is missing.
+        NoDataError: If there is nothing to write.
+        MappingError: If a value can't be parsed (e.g., a broken mapping).
+
+    Examples:
+        >>> list(check(iter(['a'])))
+        ['a']
+        >>> list(check(iter([])))
+        Traceback (most recent call last):
+        ...
+        csv2ofx.NoDataError
+    """
+    empty = True
+
+    try:
+        for chunk in content:
+            empty = empty and not chunk
+            yield chunk
+    except KeyError as err:
+        raise MissingFieldError(f"Field {err} is missing from file") from err
+    except TypeError as err:
+        raise NoDataError(str(err)) from err
+    except ValueError as err:
+        raise MappingError(str(err)) from err
+
+    if empty:
+        raise NoDataError()
+
+
+def write_content(content, sink, buffer_size=None, encoding="utf-8", errors="strict"):
+    """Writes content chunks to a file, encoding them a block at a time (see
+    `csv2ofx.sink.BlockWriter`)
+
+    Args:
+        content (Iter[str]): The content chunks.
+        sink (obj): The file like object (opened in text or binary mode).
+        buffer_size (int): Number of characters written at a time (default:
+            2 ** 16).
+        encoding (str): The encoding of a binary `sink`.
+        errors (str): The encoding error policy of a binary `sink`.
+
+    Returns:
+        (int): the number of bytes written
+
+    Raises:
+        ConversionError: See `check`.
+
+    Examples:
+        >>> from io import BytesIO
+        >>>
+        >>> sink = BytesIO()
+        >>> write_content(iter(['caf', 'é']), sink, encoding='latin-1')
+        4
+        >>> sink.getvalue()
+        b'caf\\xe9'
+    """
+    writer = BlockWriter(sink, encoding, errors, buffer_size)
+    writer.writelines(check(content))
+    writer.close()
+    return writer.written
+
+
+def convert(source, mapping, sink=None, qif=False, **kwargs):
+    """Converts csv records to OFX or QIF
+
+    Args:
+        source (obj): A csv file like object (opened in text mode) or the
+            records themselves (an iterable of dicts).
+        mapping (dict): The bank mapping (see `csv2ofx.mappings`), or an
+            `OFX` or `QIF` object (which may serve concurrent conversions, see
+            `Content.context`). The object's configuration takes precedence
+            over `qif`, `start`, `end`, and `ms_money`.
+        sink (obj): A file like object to write the content to (opened in text
+            or binary mode). If omitted, the content chunks are returned instead.
+        qif (bool): Convert to QIF (rather than OFX).
+        kwargs (dict): Keyword arguments (see `get_content`,
+            `get_read_kwargs`, and `gen_content`).
+
+    Kwargs:
+        start (str or datetime): Date from which to begin including
+            transactions.
+        end (str or datetime): Date from which to exclude transactions.
+        ms_money (bool): Create MS Money compatible OFX content.
+        collapse (str): Field used to combine transactions within a split for
+            double entry statements.
+        chunksize (int): Maximum number of records held in memory while
+            grouping (default: 2 ** 14).
+        buffer_size (int): Number of characters written to `sink` at a time
+            (default: 2 ** 16).
+        ending_balance (float): The OFX ending balance.
+        encoding (str): The `sink` encoding (default: 'utf-8').
+
+    Returns:
+        (Iter[str]): the content chunks (if there is no `sink`)
+
+    Raises:
+        ConversionError: If the conversion fails (raised while iterating over
+            the content chunks if there is no `sink`), e.g., `BalanceError`,
+            `MissingFieldError`, `NoDataError`, or `MappingError`.
+
+    Examples:
+        >>> from csv2ofx.mappings.default import mapping
+        >>>
+        >>> records = [{
+        ...     'Account': 'Checking', 'Date': '3/1/15', 'Amount': '-10',
+        ...     'Reference': '', 'Description': 'Store', 'Notes': '',
+        ...     'Num': '', 'Row': '1'}]
+        >>> print(''.join(convert(records, mapping, qif=True)))
+        !Account
+        NChecking
+        TBank
+        ^
+        !Type:Bank
+        D03/01/2015
+        PStore
+        T-10.00
+        ^
+        <BLANKLINE>
+        >>> from io import StringIO
+        >>> sink = StringIO()
+        >>> convert(records, mapping, sink, qif=True)
+        >>> sink.getvalue().splitlines()[-2:]
+        ['T-10.00', '^']
+        >>> qif = get_content(mapping, qif=True)
+        >>> outputs = [''.join(convert(records, qif)) for _ in range(2)]
+        >>> outputs[0] == outputs[1], outputs[0].count('!Account')
+        (True, 1)
+        >>> list(convert(records, mapping, qif=True, start='2016-01-01'))
+        Traceback (most recent call last):
+        ...
+        csv2ofx.NoDataError
+    """
+    if isinstance(mapping, Content):
+        cont = mapping.context()
+    else:
+        cont = get_content(mapping, qif=qif, **kwargs)
+
+    chunksize = kwargs.pop("chunksize", None) or 2**14
+
+    if hasattr(source, "read"):
+        names = ["first_row", "last_row", "first_col"]
+        rkwargs = {name: kwargs[name] for name in names if name in kwargs}
+        records = read_csv(source, **get_read_kwargs(cont, **rkwargs))
+    else:
+        records = source
+
+    content = gen_content(cont, records, chunksize=chunksize, **kwargs)
+
+    if sink is None:
+        return check(content)
+
+    encoding = kwargs.get("encoding") or "utf-8"
+    write_content(content, sink, kwargs.get("buffer_size"), encoding)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+csv2ofx.batch
+~~~~~~~~~~~~~
+
+Provides functions for converting many csv files with a pool of worker
+processes
+
+Examples:
+    literal blocks::
+
+        csv2ofx -q --batch 'statements/*.csv' --outdir converted --jobs 4
+
+Attributes:
+    MANIFEST_FIELDS (list): The manifest columns.
+"""
+
+import csv
+import glob
+import os
+import shlex
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+from copy import copy
+from functools import partial
+from pathlib import Path
+
+from . import ConversionError
+from .main import MODULES, convert_file, load_package_module, parser
+from .source import COMPRESSIONS, get_compression
+
+MANIFEST_FIELDS = ["source", "dest", "mapping", "options"]
+
+
+def gen_sources(pattern):
+    """Generates the csv files matching a glob pattern or within a directory
+    (including compressed csv files, see `csv2ofx.source`)
+
+    Args:
+        pattern (str): A glob pattern or directory path.
+
+    Yields:
+        (str): source file paths, sorted
+
+    Examples:
+        >>> next(gen_sources('data/test'))
+        'data/test/amazon.csv'
+        >>> list(gen_sources('data/test/mint*.csv'))[-1]
+        'data/test/mint_headerless.csv'
+    """
+    if os.path.isdir(pattern):
+        extensions = ["", *COMPRESSIONS]
+        patterns = [os.path.join(pattern, f"*.csv{ext}") for ext in extensions]
+    else:
+        patterns = [pattern]
+
+    paths = (glob.iglob(path, recursive=True) for path in patterns)
+    yield from sorted(set().union(*paths))
+
+
+def get_dest(source, outdir=None, qif=False):
+    """Gets the output path for a source file
+
+    Args:
+        source (str): The source file path.
+        outdir (str): The output directory (default: the source's directory).
+        qif (bool): Use the QIF file extension.
+
+    Returns:
+        (str): the output file path
+
+    Examples:
+        >>> get_dest('data/test/mint.csv')
+        'data/test/mint.ofx'
+        >>> get_dest('data/test/mint.csv', 'out', qif=True)
+        'out/mint.qif'
+        >>> get_dest('archive/mint.csv.gz')
+        'archive/mint.ofx'
+    """
+    path = Path(source)
+    path = path.with_suffix("") if get_compression(source) else path
+    path = path.with_suffix(".qif" if qif else ".ofx")
+    return str(Path(outdir, path.name) if outdir else path)
+
+
+def gen_jobs(args):
+    """Generates the conversion jobs selected by the parsed CLI options
+
+    Args:
+        args (obj): The parsed CLI options.
+
+    Yields:
+        (dict): jobs with keys `source`, `dest`, `mapping`, and `options`
+
+    Examples:
+        >>> args = parser.parse_args(['-q', '-b', 'data/test/mint.csv'])
+        >>> next(gen_jobs(args)) == {
+        ...     'source': 'data/test/mint.csv', 'dest': 'data/test/mint.qif',
+        ...     'mapping': '', 'options': ''}
+        True
+    """
+    if args.batch:
+        for source in gen_sources(args.batch):
+            dest = get_dest(source, args.outdir, args.qif)
+            yield {"source": source, "dest": dest, "mapping": "", "options": ""}
+
+    if args.manifest:
+        root = os.path.dirname(args.manifest)
+
+        with open(args.manifest, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                job = {k: (row.get(k) or "").strip() for k in MANIFEST_FIELDS}
+                job["source"] = os.path.join(root, job["source"])
+                qif = args.qif or "-q" in shlex.split(job["options"])
+
+                if job["dest"]:
+                    job["dest"] = os.path.join(args.outdir or root, job["dest"])
+                else:
+                    job["dest"] = get_dest(job["source"], args.outdir, qif)
+
+                yield job
+
+
+def get_argv(job):
+    """Gets the CLI options for a job
+
+    Args:
+        job (dict): A job from `gen_jobs`.
+
+    Returns:
+        (list): the CLI options (without source and dest)
+
+    Examples:
+        >>> get_argv({'mapping': 'mint', 'options': '-q -e 20150101'})
+        ['-q', '-e', '20150101', '-m', 'mint']
+        >>> get_argv({'mapping': 'my/mapping.py', 'options': ''})
+        ['-x', 'my/mapping.py']
+    """
+    argv = shlex.split(job["options"])
+    mapping = job["mapping"]
+
+    if mapping.endswith(".py"):
+        argv += ["-x", mapping]
+    elif mapping:
+        argv += ["-m", mapping]
+
+    return argv
+
+
+def init_worker():
+    """Imports every packaged mapping once per worker process"""
+    for name in MODULES:
+        # a mapping with missing requirements (e.g., locales) only fails the
+        # jobs that use it
+        with suppress(Exception):
+            load_package_module(name)
+
+
+def convert_job(base, job):
+    """Converts the source file of a job
+
+    Args:
+        base (obj): The parsed CLI options shared by all jobs.
+        job (dict): A job from `gen_jobs`.
+
+    Returns:
+        (tuple): the job, exit status (0 on success), and elapsed seconds
+    """
+    start = time.perf_counter()
+
+    try:
+        args = parser.parse_args(get_argv(job), namespace=copy(base))
+        args.source, args.dest = job["source"], job["dest"]
+        # the files are already spread across the pool
+        args.parallel = False
+        status = convert_file(args)
+    except SystemExit as err:
+        status = err.code
+    except (ConversionError, OSError) as err:
+        status = err
+    except Exception as err:  # pylint: disable=broad-except
+        # report the bug, but keep converting the other files
+        traceback.print_exc()
+        status = err
+
+    # exceptions may not survive the trip back to the parent process
+    status = status if status is None or isinstance(status, int) else str(status)
+    return job, status, time.perf_counter() - start
+
+
+def run_batch(args):
+    """Converts every file selected by the parsed CLI options
+
+    Prints one status line per file, followed by a summary, to stderr.
+
+    Args:
+        args (obj): The parsed CLI options.
+
+    Returns:
+        (int): 0 if every file converted, otherwise 1
+    """
+    jobs = list(gen_jobs(args))
+    start = time.perf_counter()
+    failed = 0
+
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+
+    if not jobs:
+        print("No files to convert.", file=sys.stderr)
+        return 1
+
+    convert = partial(convert_job, args)
+    num_jobs = min(args.jobs or os.cpu_count() or 1, len(jobs))
+
+    if num_jobs > 1:
+        executor = ProcessPoolExecutor(num_jobs, initializer=init_worker)
+        results = executor.map(convert, jobs)
+    else:
+        executor = None
+        results = map(convert, jobs)
+
+    try:
+        for job, status, elapsed in results:
+            if status:
+                failed += 1
+                error = "" if status == 1 else f": {status}"
+                line = f"FAILED {job['source']}{error}"
+            else:
+                line = f"ok {job['source']} -> {job['dest']} ({elapsed:.2f}s)"
+
+            print(line, file=sys.stderr)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    converted = len(jobs) - failed
+    msg = f"Converted {converted} of {len(jobs)} files in {elapsed:.2f}s"
+    print(f"{msg} using {num_jobs} process(es).", file=sys.stderr)
+    return 1 if failed else 0
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+csv2ofx.columnar
+~~~~~~~~~~~~~~~~
+
+Provides a vectorized (NumPy) engine for mappings made of nothing but columns
+(i.e., `operator.itemgetter`) and constants
+
+Records are processed in batches. The dates, amounts, DEBIT/CREDIT types,
+signs, and start/end range of each batch are computed column-wise, and the
+transaction data is attached to the `Transaction` records so the usual
+grouping, cleaning, and `gen_body` stages reuse it. Whatever the engine can't
+handle exactly (e.g., investment transactions, or amounts which would need
+rounding) is left to the row path, so the output is identical either way.
+
+Examples:
+    literal blocks::
+
+        csv2ofx --columnar -m mint transactions.csv transactions.ofx
+
+Attributes:
+    BATCH_SIZE (int): Number of records processed together.
+    MAX_CENTS (int): Largest amount (in cents) converted with floats.
+"""
+
+import itertools as it
+from contextlib import suppress
+from decimal import Decimal
+from operator import itemgetter
+
+import numpy as np
+
+from . import FIELDS
+
+BATCH_SIZE = 2**12
+MAX_CENTS = 10**12
+
+# the default of fields whose default depends on the transaction
+MISSING = object()
+
+
+def get_spec(cont, mapping):
+    """Gets the source of each field of a simple mapping
+
+    Args:
+        cont (obj): The OFX or QIF content object.
+        mapping (dict): The bank mapping.
+
+    Returns:
+        (dict): the ('column', name) or ('constant', value) source of each
+            field, or None if the mapping isn't simple
+
+    Examples:
+        >>> from csv2ofx import Content
+        >>> from csv2ofx.mappings.default import mapping
+        >>> spec = get_spec(Content(mapping), mapping)
+        >>> spec['date'], spec['bank'], spec['class']
+        (('column', 'Date'), ('constant', 'Bank'), ('constant', None))
+        >>> get_spec(Content({'date': str.upper}), {'date': str.upper})
+    """
+    if "filter" in mapping:
+        return None
+
+    spec = {}
+
+    for name in FIELDS:
+        attr = getattr(cont, name, None)
+
+        if name == "account" and not callable(mapping.get(name)):
+            # `Content` wraps a constant account in a function
+            attr = attr(None)
+
+        if isinstance(attr, itemgetter):
+            keys = attr.__reduce__()[1]
+
+            if len(keys) != 1 or not isinstance(keys[0], str):
+                return None
+
+            spec[name] = ("column", keys[0])
+        elif callable(attr):
+            return None
+        else:
+            spec[name] = ("constant", attr)
+
+    if spec["date"][0] != "column" or spec["amount"][0] != "column":
+        return None
+
+    investment = ("shares", "symbol", "price")
+
+    if any(spec[name] != ("constant", None) for name in investment):
+        return None
+
+    return spec
+
+
+def get_column(source, trxns, default=None):
+    """Gets the values of a field
+
+    Args:
+        source (tuple): The ('column', name) or ('constant', value) source of
+            the field (see `get_spec`).
+        trxns (List[dict]): The transactions.
+        default (obj): Value to use if the field isn't found.
+
+    Returns:
+        (list): the value of each transaction
+
+    Examples:
+        >>> trxns = [{'a': '1'}, {}]
+        >>> get_column(('column', 'a'), trxns, 'x')
+        ['1', 'x']
+        >>> get_column(('constant', None), trxns, 'x')
+        ['x', 'x']
+    """
+    kind, value = source
+
+    if kind == "column":
+        return [trxn.get(value, default) for trxn in trxns]
+    else:
+        return [value or default] * len(trxns)
+
+
+def to_array(values):
+    """Converts a list of strings to a NumPy array
+
+    Examples:
+        >>> to_array(['a', 'bc'])
+        array(['a', 'bc'], dtype='<U2')
+        >>> to_array(['a', None])
+        Traceback (most recent call last):
+        ...
+        TypeError: Expected strings
+    """
+    if not all(isinstance(value, str) for value in values):
+        raise TypeError("Expected strings")
+
+    return np.array(values, dtype=str)
+
+
+def parse_dates(cont, values):
+    """Parses a column of date strings
+
+    Each distinct string is parsed once, in order of first appearance (so any
+    date format is inferred from the same samples as the row path).
+
+    Args:
+        cont (obj): The OFX or QIF content object.
+        values (List[str]): The date strings.
+
+    Returns:
+        (Tuple): the parsed dates and whether each is within the start/end
+            range
+
+    Examples:
+        >>> from datetime import datetime as dt
+        >>> from csv2ofx import Content
+        >>> cont = Content(start=dt(2015, 1, 1), end=dt(2016, 1, 1))
+        >>> dates, in_range = parse_dates(cont, ['1/2/15', '1/2/17', '1/2/15'])
+        >>> dates[0], in_range.tolist()
+        (datetime.datetime(2015, 1, 2, 0, 0), [True, False, True])
+    """
+    strings = to_array(values)
+    uniques, first, inverse = np.unique(strings, return_index=True, return_inverse=True)
+    parsed = [None] * len(uniques)
+
+    for pos in np.argsort(first).tolist():
+        parsed[pos] = cont.parse_datestr(str(uniques[pos]))
+
+    start, end = cont.start, cont.end
+    bounds = np.array([start <= date <= end for date in parsed], dtype=bool)
+    positions = inverse.ravel().tolist()
+    return [parsed[pos] for pos in positions], bounds[inverse.ravel()]
+
+
+def parse_cents(parser, values):
+    """Converts a column of amounts to cents
+
+    Args:
+        parser (obj): The column's `utils.AmountParser` (with its separators
+            already known).
+        values (List[str]): The amounts.
+
+    Returns:
+        (Tuple): the cents of each amount and whether they were converted
+            exactly (otherwise, the amount should be converted by `parser`)
+
+    Examples:
+        >>> from csv2ofx.utils import AmountParser
+        >>> parser = AmountParser(',', '.')
+        >>> cents, exact = parse_cents(parser, ['$1,000.5', '-2', '1.005', '0'])
+        >>> cents.tolist(), exact.tolist()
+        ([100050, -200, 0, 0], [True, True, False, False])
+    """
+    stripped = [value.translate(parser.strip_table) for value in values]
+    matches = np.array([bool(parser.matcher(value)) for value in stripped], bool)
+    table = parser.table
+    numbers = [v.translate(table) if m else "0" for v, m in zip(stripped, matches)]
+    scaled = np.array(numbers, dtype=np.float64) * 100
+    cents = np.rint(scaled)
+
+    # amounts with fractional cents need rounding, and negative zero its sign
+    exact = matches & (np.abs(scaled - cents) < 1e-6)
+    exact &= (np.abs(cents) < MAX_CENTS) & (cents != 0)
+    return cents.astype(np.int64), exact
+
+
+def gen_data(cont, spec, trxns, cents, types):
+    """Generates the transaction data of (non investment) transactions
+
+    Mirrors `Content.transaction_data`.
+
+    Args:
+        cont (obj): The OFX or QIF content object.
+        spec (dict): The source of each field (see `get_spec`).
+        trxns (List[Transaction]): The transactions (with parsed dates).
+        cents (List[int]): The signed amount of each transaction, in cents.
+        types (List[str]): The type of each transaction.
+
+    Yields:
+        (dict): the transaction data
+    """
+    hash_identity, hash_fitid = cont.hash_identity, cont.hash_fitid
+    column = partial_column(spec, trxns)
+    shares = Decimal(FIELDS["shares"])
+    price = Decimal(FIELDS["price"])
+    symbol = spec["symbol"][1] or FIELDS["symbol"]
+    convert_balance = cont.convert_balance
+    has_balance = spec["balance"] != ("constant", None)
+
+    columns = zip(
+        trxns,
+        cents,
+        types,
+        column("account"),
+        column("bank", MISSING),
+        column("bank_id", MISSING),
+        column("account_id", MISSING),
+        column("split_account"),
+        column("inv_split_account"),
+        column("date"),
+        column("amount"),
+        column("payee"),
+        column("desc"),
+        column("notes"),
+        column("check_num"),
+        column("category"),
+        column("currency"),
+        column("class"),
+        column("id", MISSING),
+    )
+
+    for (
+        trxn,
+        amount,
+        _type,
+        account,
+        bank,
+        bank_id,
+        account_id,
+        split_account,
+        inv_split_account,
+        date,
+        raw_amount,
+        payee,
+        desc,
+        notes,
+        check_num,
+        category,
+        currency,
+        _class,
+        _id,
+    ) in columns:
+        bank = account if bank is MISSING else bank
+        memo = f"{desc} {notes}" if desc and notes else desc or notes
+        details = "".join(filter(None, [date, str(raw_amount), payee, memo]))
+
+        if split_account:
+            split_account_id = hash_identity(split_account)
+        else:
+            split_account_id = None
+
+        if bank_id is MISSING:
+            bank_id = hash_identity(bank)
+
+        if account_id is MISSING:
+            account_id = hash_identity(account)
+
+        data = {
+            "date": trxn.date,
+            "currency": currency,
+            "shares": shares,
+            "symbol": symbol,
+            "price": price,
+            "action": "",
+            "x_action": "",
+            "category": category,
+            "is_investment": False,
+            "bank": bank,
+            "bank_id": bank_id,
+            "account": account,
+            "account_id": account_id,
+            "split_account": split_account,
+            "inv_split_account": inv_split_account,
+            "split_account_id": split_account_id,
+            "amount": Decimal(amount).scaleb(-2),
+            "payee": payee,
+            "memo": memo,
+            "class": _class,
+            "id": (check_num if _id is MISSING else _id) or hash_fitid(details),
+            "check_num": check_num,
+            "type": _type,
+            "balance": convert_balance(trxn) if has_balance else None,
+        }
+
+        yield cont.format_data(data)
+
+
+def partial_column(spec, trxns):
+    """Gets a function which returns the values of a field (see `get_column`)"""
+
+    def column(name, default=None):
+        return get_column(spec[name], trxns, FIELDS[name] or default)
+
+    return column
+
+
+def prepare_rows(cont, trxns):
+    """Gets the transaction data of each transaction with the row path
+
+    Any error is left for the serial stages to raise (in their usual order).
+    """
+    for trxn in trxns:
+        with suppress(Exception):
+            trxn.data = cont.transaction_data(trxn)
+
+
+def prepare(cont, spec, trxns):
+    """Parses the dates, amounts, and transaction data of a batch of
+    transactions column-wise
+
+    Args:
+        cont (obj): The OFX or QIF content object.
+        spec (dict): The source of each field (see `get_spec`).
+        trxns (List[Transaction]): The transactions.
+    """
+    try:
+        dates, in_range = parse_dates(cont, get_column(spec["date"], trxns))
+    except (TypeError, ValueError, OverflowError):
+        # e.g., a missing or unparseable date, leave it to the row path
+        return
+
+    for trxn, date in zip(trxns, dates):
+        trxn.date = date
+
+    # split transactions are included (or not) as a group
+    keep = np.ones(len(trxns), bool) if cont.is_split else in_range
+    kept = list(it.compress(trxns, keep.tolist()))
+    parser = cont.amount_parser
+    sampled = 0
+
+    # until its separators are known, the amounts must be sampled in order
+    # (see `utils.AmountParser`), which only the row path does for splits
+    while not (parser.separators or cont.is_split) and sampled < len(kept):
+        prepare_rows(cont, kept[sampled : sampled + 1])
+        sampled += 1
+
+    if not parser.separators:
+        return
+
+    kept = kept[sampled:]
+
+    try:
+        cents, exact = parse_cents(parser, get_column(spec["amount"], kept))
+        types = np.char.upper(to_array(get_column(spec["type"], kept, "")))
+        categories = get_column(spec["category"], kept, "")
+        exact &= np.array(["invest" not in category for category in categories], bool)
+    except (TypeError, ValueError):
+        # e.g., a missing amount or type, leave it to the row path
+        prepare_rows(cont, kept)
+        return
+
+    valid = (types == "DEBIT") | (types == "CREDIT")
+    types = np.where(valid, types, np.where(cents > 0, "CREDIT", "DEBIT"))
+    signed = np.where(types == "DEBIT", -np.abs(cents), np.abs(cents))
+    rows = np.flatnonzero(exact).tolist()
+    vectorized = [kept[row] for row in rows]
+
+    for trxn, amount in zip(vectorized, cents[rows].tolist()):
+        trxn.amount = Decimal(amount).scaleb(-2)
+
+    args = (signed[rows].tolist(), types[rows].tolist())
+
+    for trxn, data in zip(vectorized, gen_data(cont, spec, vectorized, *args)):
+        trxn.data = data
+
+    prepare_rows(cont, it.compress(kept, (~exact).tolist()))
+
+
+def gen_prepared(cont, spec, records, batch_size=None):
+    """Generates transactions whose data was computed column-wise
+
+    Args:
+        cont (obj): The OFX or QIF content object.
+        spec (dict): The source of each field (see `get_spec`).
+        records (Iter[dict]): The csv records.
+        batch_size (int): Number of records processed together (default:
+            `BATCH_SIZE`).
+
+    Yields:
+        (Transaction): the transactions, in file order
+
+    Examples:
+        >>> from csv2ofx.mappings.default import mapping
+        >>> from csv2ofx.qif import QIF
+        >>> from meza.io import read_csv
+        >>>
+        >>> qif = QIF(mapping)
+        >>> spec = get_spec(qif, mapping)
+        >>> with open('data/test/default.csv', encoding='utf-8') as f:
+        ...     trxns = list(gen_prepared(qif, spec, read_csv(f)))
+        >>> trxns[0].data == qif.transaction_data(dict(trxns[0]))
+        True
+    """
+    trxns = cont.gen_records(records)
+
+    batch_size = batch_size or BATCH_SIZE
+
+    while batch := list(it.islice(trxns, batch_size)):
+        prepare(cont, spec, batch)
+        yield from batch
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+csv2ofx.dedupe
+~~~~~~~~~~~~~~
+
+Provides a pipeline stage which removes duplicate transactions (i.e., those
+with the same account and FITID), e.g., from overlapping exports
+
+A Bloom filter quickly rules out transactions which haven't been seen before,
+and an on-disk (SQLite) set confirms the rest, so memory use stays bounded no
+matter how many transactions have been seen. The set can be kept between runs
+to remove transactions which were already converted from another file.
+
+Transactions are checked and added to the set a batch at a time, each batch in
+its own (write locked) transaction, so conversions sharing a set (e.g., batch
+workers) see each other's transactions. Once another conversion has added to
+the set, the Bloom filter can no longer rule anything out, so every
+transaction is checked against the set. A filter which is missing transactions
+(e.g., after concurrent conversions) is rebuilt from the set when it's loaded.
+
+Examples:
+    literal blocks::
+
+        csv2ofx --dedupe ~/.csv2ofx-seen.db --duplicates dups.csv week.csv week.ofx
+
+Attributes:
+    CAPACITY (int): Default number of transactions the Bloom filter is sized
+        for.
+    ERROR_RATE (float): Default Bloom filter false positive rate.
+    FLUSH_SIZE (int): Number of transactions checked (and added to the on-disk
+        set) at a time.
+    SCHEMA (str): The on-disk set tables. `bloom.version` counts the batches
+        added to the set, and `bloom.synced` is the version whose transactions
+        are all in the saved `bloom.bits`.
+"""
+
+import csv
+import hashlib
+import os
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from math import ceil, log
+
+CAPACITY = 10**6
+ERROR_RATE = 0.01
+FLUSH_SIZE = 2**12
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen (
+    account TEXT NOT NULL,
+    fitid TEXT NOT NULL,
+    PRIMARY KEY (account, fitid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bloom (
+    capacity INTEGER NOT NULL,
+    error_rate REAL NOT NULL,
+    bits BLOB,
+    version INTEGER NOT NULL,
+    synced INTEGER NOT NULL
+);
+"""
+
+
+class BloomFilter:
+    """A Bloom filter of strings
+
+    Args:
+        capacity (int): The expected number of items.
+        error_rate (float): The false positive rate at capacity.
+        bits (bytes): The bits of a saved filter with the same capacity and
+            error rate (optional).
+
+    Examples:
+        >>> bloom = BloomFilter(1000)
+        >>> bloom.add('a')
+        False
+        >>> bloom.add('a')
+        True
+        >>> 'a' in bloom, 'b' in bloom
+        (True, False)
+        >>> bloom.size, bloom.hashes
+        (9586, 7)
+    """
+
+    def __init__(self, capacity=CAPACITY, error_rate=ERROR_RATE, bits=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * log(2)))
+        self.bits = bytearray(bits or (self.size + 7) // 8)
+
+    def positions(self, item):
+        """Gets the bit positions of an item (by double hashing)"""
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + num * second) % self.size for num in range(self.hashes)]
+
+    def add(self, item):
+        """Adds an item
+
+        Returns:
+            (bool): whether the item may have been added before
+        """
+        bits = self.bits
+        present = True
+
+        for pos in self.positions(item):
+            byte, mask = pos >> 3, 1 << (pos & 7)
+
+            if not bits[byte] & mask:
+                present = False
+                bits[byte] |= mask
+
+        return present
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(item))
+
+
+class Deduper:
+    """Removes duplicate transactions from the transaction data stream
+
+    Args:
+        path (str): The SQLite set file path. The set is kept between runs
+            (default: a temporary file, i.e., only remove duplicates within
+            this run).
+        duplicates (str): Write the csv rows of the removed transactions to
+            this file path (optional). It is opened by `__enter__`.
+        capacity (int): The Bloom filter capacity (ignored if the set file
+            already has a filter).
+
+    Examples:
+        >>> from csv2ofx import utils
+        >>> from csv2ofx.mappings.default import mapping
+        >>> from csv2ofx.qif import QIF
+        >>> from meza.io import read_csv
+        >>>
+        >>> qif = QIF(mapping)
+        >>> with Deduper(capacity=1000) as deduper:
+        ...     for _ in range(2):
+        ...         with open('data/test/default.csv', encoding='utf-8') as f:
+        ...             records = read_csv(f, has_header=True)
+        ...             trxns = qif.gen_trxns(qif.gen_groups(records))
+        ...             data = deduper.filter(utils.gen_data(qif.clean_trxns(trxns)), qif)
+        ...             print(len(list(data)), deduper.removed)
+        8 0
+        0 8
+    """
+
+    def __init__(self, path=None, duplicates=None, capacity=CAPACITY):
+        if path:
+            self.tmpdir = None
+        else:
+            self.tmpdir = tempfile.TemporaryDirectory(prefix="csv2ofx-")
+            path = os.path.join(self.tmpdir.name, "seen.db")
+
+        # transactions are managed explicitly (see `transaction`)
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.executescript(SCHEMA)
+        self.pending = []
+        self.removed = 0
+        self.duplicate = False
+        self.opened = False
+        self.duplicates = duplicates
+        self.writer = None
+        self.dups_file = None
+
+        with self.transaction() as execute:
+            query = "SELECT capacity, error_rate, bits, version, synced FROM bloom"
+            saved = execute(query).fetchone()
+
+            if not saved:
+                saved = (capacity, ERROR_RATE, None, 0, 0)
+                execute("INSERT INTO bloom VALUES (?, ?, ?, ?, ?)", saved)
+
+            capacity, error_rate, bits, self.version, synced = saved
+            stale = synced != self.version
+            self.bloom = BloomFilter(capacity, error_rate, None if stale else bits)
+
+            if stale:
+                self.rebuild(execute)
+
+        # whether the Bloom filter has every transaction of the set
+        self.covered = True
+
+    def __enter__(self):
+        if self.duplicates:
+            self.dups_file = open(self.duplicates, "w", newline="", encoding="utf-8")
+
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @contextmanager
+    def transaction(self):
+        """Runs statements in a transaction which holds the write lock from
+        the start, so that what it reads can't change until it commits"""
+        self.conn.execute("BEGIN IMMEDIATE")
+
+        try:
+            yield self.conn.execute
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        self.conn.execute("COMMIT")
+
+    def rebuild(self, execute):
+        """Rebuilds the Bloom filter from the on-disk set"""
+        bloom = self.bloom
+
+        for key in execute("SELECT account, fitid FROM seen"):
+            bloom.add("\x1f".join(key))
+
+        values = (bytes(bloom.bits), self.version)
+        execute("UPDATE bloom SET bits = ?, synced = ?", values)
+
+    def flush(self):
+        """Checks the buffered transactions against (and adds the new ones to)
+        the on-disk set
+
+        Returns:
+            (List[dict]): the buffered transaction data which isn't a duplicate.
+                If the first transaction of a group is removed, the next one
+                kept becomes its main transaction (so the account still starts).
+        """
+        kept, new, added = [], [], 0
+        insert = "INSERT OR IGNORE INTO seen VALUES (?, ?)"
+        executemany = self.conn.executemany
+
+        with self.transaction() as execute:
+            version = execute("SELECT version FROM bloom").fetchone()[0]
+
+            # another conversion added transactions the filter doesn't have
+            self.covered = self.covered and version == self.version
+
+            for datum, key in self.pending:
+                # a split (i.e., without a key) follows its transaction's main
+                # split
+                if key is None:
+                    duplicate = self.duplicate
+                elif self.bloom.add("\x1f".join(key)) or not self.covered:
+                    # a possible hit, so check the on-disk set
+                    if new:
+                        added += executemany(insert, new).rowcount
+                        new.clear()
+
+                    duplicate = not execute(insert, key).rowcount
+                    added += not duplicate
+                else:
+                    new.append(key)
+                    duplicate = False
+
+                self.duplicate = duplicate
+                self.opened = self.opened and not datum["is_main"]
+
+                if duplicate:
+                    self.removed += 1
+                else:
+                    # the first transaction kept starts the group
+                    datum["is_main"] = not self.opened
+                    self.opened = True
+                    kept.append(datum)
+
+                if duplicate and self.dups_file:
+                    self.write_duplicate(datum["trxn"])
+
+            if new:
+                added += executemany(insert, new).rowcount
+
+            self.version = version + 1 if added else version
+
+            if added:
+                execute("UPDATE bloom SET version = ?", (self.version,))
+
+        self.pending.clear()
+        return kept
+
+    def write_duplicate(self, trxn):
+        """Writes the csv row of a removed transaction to the duplicates file"""
+        # the source's row (i.e., before any OFX escaping)
+        row = getattr(trxn, "raw", trxn)
+
+        if not self.writer:
+            fields = list(row)
+            self.writer = csv.DictWriter(self.dups_file, fields, extrasaction="ignore")
+            self.writer.writeheader()
+
+        self.writer.writerow(row)
+
+    def filter(self, data, cont):
+        """Removes duplicate transactions
+
+        The splits of a transaction are kept or removed together, based on the
+        FITID of its main split.
+
+        Args:
+            data (Iter[dict]): The transaction data (see `utils.gen_data`).
+            cont (obj): The OFX or QIF content object.
+
+        Yields:
+            (dict): the transaction data which isn't a duplicate
+        """
+        pending = self.pending
+
+        for datum in data:
+            trxn = datum["trxn"]
+
+            if datum["is_main"] or not cont.is_split:
+                if len(pending) >= FLUSH_SIZE:
+                    yield from self.flush()
+
+                # keep the data for `gen_body`
+                trxn.data = trxn_data = cont.get_data(trxn)
+                key = (str(trxn_data["account"] or ""), str(trxn_data["id"]))
+            else:
+                key = None
+
+            pending.append((datum, key))
+
+        yield from self.flush()
+
+    def commit(self):
+        """Saves the Bloom filter (if it has every transaction of the set)"""
+        bloom = self.bloom
+
+        if self.tmpdir:
+            # the set won't outlive this run
+            return
+
+        with self.transaction() as execute:
+            version = execute("SELECT version FROM bloom").fetchone()[0]
+
+            # otherwise, the next conversion rebuilds it
+            if self.covered and version == self.version:
+                values = (bytes(bloom.bits), version)
+                execute("UPDATE bloom SET bits = ?, synced = ?", values)
+
+    def summary(self):
+        """Summarizes the removed duplicates
+
+        Returns:
+            (str): the number of duplicates removed
+        """
+        summary = f"Removed {self.removed} duplicate transactions"
+
+        if self.duplicates and self.removed:
+            summary += f" (see {self.duplicates})"
+
+        return f"{summary}."
+
+    def close(self):
+        self.conn.close()
+
+        if self.dups_file:
+            self.dups_file.close()
+
+        if self.tmpdir:
+            self.tmpdir.cleanup()
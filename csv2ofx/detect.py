@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+csv2ofx.detect
+~~~~~~~~~~~~~~
+
+Provides functions for detecting the mapping of a csv file from its header
+
+The signature of each bundled mapping, i.e., the columns it reads (via
+`itemgetter`s and the `row['column']` or `row.get('column')` lookups of its
+functions), its delimiter, whether it expects a header, and the line the
+header is on (its `first_row`), is taken from the mapping's source without
+importing it. The signatures are cached on disk and rebuilt whenever a
+mapping changes.
+
+Headers are matched through an index of column names, so the work per file
+depends on the number of columns in the header rather than the number of
+mappings. A mapping's confidence is the share of the columns it reads which
+are in the line it takes as the header. Mappings with the same confidence are
+listed by how much of the header they account for, then by name, but the
+caller should treat a tie for the best match as ambiguous.
+
+Examples:
+    literal blocks::
+
+        csv2ofx -m auto transactions.csv transactions.ofx
+
+Attributes:
+    CACHE_VERSION (int): Version of the cache file format.
+    MIN_CONFIDENCE (float): The lowest confidence a detected mapping may have.
+    HEADER_LINES (int): Number of lines read from the start of a file, i.e.,
+        one more than the largest `first_row` a detected mapping may have.
+"""
+
+import ast
+import csv
+import hashlib
+import json
+import os
+from collections import defaultdict
+from pathlib import Path
+
+from .index import MAPPINGS
+from .source import open_source
+
+CACHE_VERSION = 2
+MIN_CONFIDENCE = 0.3
+HEADER_LINES = 16
+
+MAPPINGS_DIR = Path(__file__).parent / "mappings"
+
+
+class ColumnVisitor(ast.NodeVisitor):
+    """Collects the columns a mapping's source reads along with the constant
+    options of its `mapping` dict"""
+
+    def __init__(self):
+        self.columns = set()
+        self.options = {}
+        self.params = []
+
+    def is_row(self, node):
+        """Determines whether a node is a parameter of the enclosing function"""
+        return isinstance(node, ast.Name) and any(node.id in p for p in self.params)
+
+    def visit_FunctionDef(self, node):
+        self.params.append({arg.arg for arg in node.args.args})
+        self.generic_visit(node)
+        self.params.pop()
+
+    visit_Lambda = visit_FunctionDef
+
+    def visit_Call(self, node):
+        func = node.func
+        name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", "")
+        args = [arg.value for arg in node.args if isinstance(arg, ast.Constant)]
+
+        if name == "itemgetter":
+            self.columns.update(arg for arg in args if isinstance(arg, str))
+        elif name == "get" and self.is_row(func.value) and args:
+            self.columns.update(args[:1] if isinstance(args[0], str) else [])
+
+        self.generic_visit(node)
+
+    def visit_Subscript(self, node):
+        key = node.slice
+
+        if self.is_row(node.value) and isinstance(key, ast.Constant):
+            self.columns.update([key.value] if isinstance(key.value, str) else [])
+
+        self.generic_visit(node)
+
+    def visit_Assign(self, node):
+        targets = [getattr(target, "id", None) for target in node.targets]
+
+        if "mapping" in targets and isinstance(node.value, ast.Dict):
+            for key, value in zip(node.value.keys, node.value.values):
+                if isinstance(key, ast.Constant) and isinstance(value, ast.Constant):
+                    self.options[key.value] = value.value
+
+        self.generic_visit(node)
+
+
+def normalize(column):
+    """Normalizes a column name
+
+    Examples:
+        >>> normalize(' "Merchant Name" ')
+        'Merchant Name'
+    """
+    return column.strip().strip('"').strip()
+
+
+def get_signature(source):
+    """Gets the signature of a mapping from its source
+
+    Args:
+        source (str): The mapping module's source code.
+
+    Returns:
+        (dict): the `columns` the mapping reads, its `delimiter`, whether it
+            `has_header`, and its `first_row`
+
+    Examples:
+        >>> source = '''
+        ... from operator import itemgetter
+        ...
+        ... def get_payee(row):
+        ...     return row.get('Payee') or row['Merchant']
+        ...
+        ... mapping = {
+        ...     'has_header': True,
+        ...     'delimiter': ';',
+        ...     'date': itemgetter('Date'),
+        ...     'payee': get_payee,
+        ...     'amount': lambda tr: tr['Amount'].replace(',', '.'),
+        ... }'''
+        >>> get_signature(source) == {
+        ...     'columns': ['Amount', 'Date', 'Merchant', 'Payee'],
+        ...     'delimiter': ';', 'has_header': True, 'first_row': 0}
+        True
+    """
+    visitor = ColumnVisitor()
+    visitor.visit(ast.parse(source))
+    columns = sorted({normalize(column) for column in visitor.columns})
+    delimiter = visitor.options.get("delimiter") or ","
+    has_header = visitor.options.get("has_header", True)
+    first_row = visitor.options.get("first_row") or 0
+    return {
+        "columns": columns,
+        "delimiter": delimiter,
+        "has_header": has_header,
+        "first_row": first_row if isinstance(first_row, int) else 0,
+    }
+
+
+def get_cache_path():
+    """Gets the path of the signature cache
+
+    Examples:
+        >>> get_cache_path().name
+        'signatures.json'
+    """
+    root = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(root, "csv2ofx", "signatures.json")
+
+
+def get_cache_key(names=MAPPINGS, mappings_dir=MAPPINGS_DIR):
+    """Gets a key which changes whenever a mapping (or the cache format) does"""
+    stamps = [CACHE_VERSION]
+
+    for name in names:
+        stat = (mappings_dir / f"{name}.py").stat()
+        stamps.append([name, stat.st_mtime_ns, stat.st_size])
+
+    return hashlib.md5(json.dumps(stamps).encode()).hexdigest()
+
+
+def load_signatures(cache_path=None, names=MAPPINGS, mappings_dir=MAPPINGS_DIR):
+    """Loads the signatures of the bundled mappings from the cache, or builds
+    (and caches) them
+
+    Args:
+        cache_path (Path): The cache file (default: `get_cache_path()`).
+        names (Iter[str]): The mapping names.
+        mappings_dir (Path): The directory of the mapping modules.
+
+    Returns:
+        (dict): the signature of each mapping (see `get_signature`)
+
+    Examples:
+        >>> import tempfile
+        >>> cache_path = Path(tempfile.mkdtemp(), 'signatures.json')
+        >>> signatures = load_signatures(cache_path)
+        >>> signatures['mint']['columns'][:3]
+        ['Account Name', 'Amount', 'Category']
+        >>> load_signatures(cache_path) == signatures
+        True
+    """
+    cache_path = cache_path or get_cache_path()
+    key = get_cache_key(names, mappings_dir)
+
+    try:
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        cached = {}
+
+    if cached.get("key") == key:
+        return cached["signatures"]
+
+    signatures = {}
+
+    for name in names:
+        source = (mappings_dir / f"{name}.py").read_text(encoding="utf-8")
+        signatures[name] = get_signature(source)
+
+    content = json.dumps({"key": key, "signatures": signatures})
+    temp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+
+    # a missing or read only cache only costs rebuilding the signatures
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path.write_text(content, encoding="utf-8")
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass
+
+    return signatures
+
+
+def build_index(signatures):
+    """Builds the index of the mappings which read each column
+
+    Args:
+        signatures (dict): The mapping signatures (see `load_signatures`).
+
+    Returns:
+        (dict): the mapping names keyed by header line and delimiter, and then
+            by column (mappings without a header are left out)
+
+    Examples:
+        >>> signatures = {
+        ...     'a': {'columns': ['Date'], 'delimiter': ',', 'has_header': True},
+        ...     'b': {'columns': ['Date'], 'delimiter': ',', 'has_header': False},
+        ...     'c': {
+        ...         'columns': ['Date'], 'delimiter': ',', 'has_header': True,
+        ...         'first_row': 2}}
+        >>> build_index(signatures)
+        {(0, ','): {'Date': ['a']}, (2, ','): {'Date': ['c']}}
+    """
+    index = defaultdict(lambda: defaultdict(list))
+
+    for name, signature in signatures.items():
+        if signature["has_header"]:
+            key = (signature.get("first_row", 0), signature["delimiter"])
+
+            for column in signature["columns"]:
+                index[key][column].append(name)
+
+    return {key: dict(columns) for key, columns in index.items()}
+
+
+def rank(lines, signatures, index=None):
+    """Ranks the mappings by how well they match a file's header
+
+    Args:
+        lines (List[str]): The first lines of the file.
+        signatures (dict): The mapping signatures (see `load_signatures`).
+        index (dict): The column index (see `build_index`).
+
+    Returns:
+        (List[Tuple]): the name and confidence of each mapping which reads any
+            of the columns of its header line, best first
+
+    Examples:
+        >>> signatures = {
+        ...     'mint': {
+        ...         'columns': ['Amount', 'Date', 'Description'],
+        ...         'delimiter': ',', 'has_header': True},
+        ...     'short': {
+        ...         'columns': ['Amount', 'Date'],
+        ...         'delimiter': ',', 'has_header': True},
+        ...     'euro': {
+        ...         'columns': ['Amount', 'Date', 'Payee'],
+        ...         'delimiter': ';', 'has_header': True},
+        ...     'extra': {
+        ...         'columns': ['Amount', 'Date', 'Description'],
+        ...         'delimiter': ',', 'has_header': True, 'first_row': 1}}
+        >>> rank(['Date,Description,Amount'], signatures)
+        [('mint', 1.0), ('short', 1.0)]
+        >>> rank(['"Date";"Amount";"Notes"'], signatures)
+        [('euro', 0.6666666666666666)]
+        >>> rank(['', 'Date,Description,Amount'], signatures)
+        [('extra', 1.0)]
+    """
+    index = build_index(signatures) if index is None else index
+    ranked = []
+
+    for (first_row, delimiter), columns in index.items():
+        if first_row >= len(lines):
+            continue
+
+        row = next(csv.reader([lines[first_row]], delimiter=delimiter), [])
+        header = {normalize(column) for column in row} - {""}
+        matches = defaultdict(int)
+
+        for column in header:
+            for name in columns.get(column, []):
+                matches[name] += 1
+
+        for name, matched in matches.items():
+            confidence = matched / len(signatures[name]["columns"])
+            ranked.append((confidence, matched / len(header), name))
+
+    ranked.sort(key=lambda match: (-match[0], -match[1], match[2]))
+    return [(name, confidence) for confidence, _, name in ranked]
+
+
+def read_lines(path, encoding="utf-8"):
+    """Reads the first `HEADER_LINES` lines of a (possibly compressed) file
+
+    Examples:
+        >>> lines = read_lines('data/test/mint_extra.csv')
+        >>> lines[:3], lines[3][:16]
+        (['', '', ''], 'Date,Description')
+    """
+    with open_source(path, encoding, errors="replace") as f:
+        lines = [line.rstrip("\r\n") for _, line in zip(range(HEADER_LINES), f)]
+
+    if lines:
+        lines[0] = lines[0].lstrip("\ufeff")
+
+    return lines
+
+
+def detect(path, encoding="utf-8", cache_path=None):
+    """Detects the mapping of a csv file from its header
+
+    Args:
+        path (str): The csv file path.
+        encoding (str): The file encoding.
+        cache_path (Path): The signature cache (default: `get_cache_path()`).
+
+    Returns:
+        (List[Tuple]): the name and confidence of the matching mappings, best
+            first (see `rank`)
+
+    Examples:
+        >>> detect('data/test/xero.csv')[0]
+        ('xero', 1.0)
+        >>> detect('data/test/mint_extra.csv')[0]
+        ('mint_extra', 1.0)
+    """
+    ranked = rank(read_lines(path, encoding), load_signatures(cache_path))
+    return [match for match in ranked if match[1] >= MIN_CONFIDENCE]
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+csv2ofx.grouping
+~~~~~~~~~~~~~~~~
+
+Provides functions for grouping transactions by account (or split id) with
+bounded memory
+
+Records are buffered and sorted in memory. Whenever the buffer fills up, it is
+written to a temporary file as a sorted run. Once every record has been read,
+the runs are k-way merged (see `heapq.merge`) so that each key forms exactly
+one group, no matter how its records are spread across the file.
+
+Groups can also be kept in order of first appearance with `group_hashed`,
+which hashes (rather than sorts) records into their groups. Sources which are
+already contiguous by group (e.g., most bank exports) can skip grouping
+entirely with `group_presorted`.
+
+Attributes:
+    BATCH_SIZE (int): Number of records pickled together in a run.
+    MERGE_WIDTH (int): Maximum number of runs merged (i.e., open) at once.
+"""
+
+import heapq
+import itertools as it
+import os
+import pickle
+import tempfile
+from operator import itemgetter
+
+from . import UnsortedError
+
+BATCH_SIZE = 2**10
+MERGE_WIDTH = 2**6
+
+
+def write_run(entries, path):
+    """Writes a sorted run to a file
+
+    Args:
+        entries (Iter[tuple]): The sorted (key, position, record) entries.
+        path (str): The run file path.
+    """
+    entries = iter(entries)
+
+    with open(path, "wb") as f:
+        while batch := list(it.islice(entries, BATCH_SIZE)):
+            pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+
+
+def read_run(path):
+    """Reads a sorted run from a file
+
+    Args:
+        path (str): The run file path.
+
+    Yields:
+        (tuple): the sorted (key, position, record) entries
+    """
+    with open(path, "rb") as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+
+            yield from batch
+
+
+def merge_runs(runs, last=()):
+    """Merges sorted runs
+
+    Runs are merged in passes (oldest first) so that at most `MERGE_WIDTH` of
+    them are open at once.
+
+    Args:
+        runs (List[str]): The run file paths.
+        last (List[tuple]): The last (in-memory) sorted run.
+
+    Yields:
+        (tuple): the merged entries
+    """
+    while len(runs) >= MERGE_WIDTH:
+        merging, runs = runs[:MERGE_WIDTH], runs[MERGE_WIDTH:]
+        path = f"{merging[-1]}.merged"
+        write_run(heapq.merge(*map(read_run, merging)), path)
+        runs.append(path)
+
+        for merged in merging:
+            os.remove(merged)
+
+    yield from heapq.merge(*map(read_run, runs), last) if runs else last
+
+
+def spill(entries, runs, tmpdir=None):
+    """Writes a sorted run to a new temporary file
+
+    Args:
+        entries (Iter[tuple]): The sorted entries.
+        runs (List[str]): The run file paths (the new path is appended).
+        tmpdir (obj): The `tempfile.TemporaryDirectory` holding the runs.
+
+    Returns:
+        (obj): the `tempfile.TemporaryDirectory` holding the runs
+    """
+    tmpdir = tmpdir or tempfile.TemporaryDirectory(prefix="csv2ofx-")
+    path = os.path.join(tmpdir.name, f"{len(runs)}.run")
+    write_run(entries, path)
+    runs.append(path)
+    return tmpdir
+
+
+def gen_sorted(records, keyfunc, buffer_size=None):
+    """Sorts records by key, spilling sorted runs to temporary files
+
+    The sort is stable, i.e., records with the same key keep their file order.
+
+    Args:
+        records (Iter[dict]): The records.
+        keyfunc (func): Receives a record and returns its (sortable) key.
+        buffer_size (int): Maximum number of records held in memory
+            (default: unlimited).
+
+    Yields:
+        (tuple): the (key, position, record) entries, sorted
+
+    Examples:
+        >>> records = ['b1', 'a1', 'b2', 'c1', 'a2']
+        >>> sorted_ = gen_sorted(records, itemgetter(0), 2)
+        >>> [record for key, pos, record in sorted_]
+        ['a1', 'a2', 'b1', 'b2', 'c1']
+    """
+    # the unique position breaks ties so records themselves are never compared
+    entries = ((keyfunc(record), pos, record) for pos, record in enumerate(records))
+    buffered, runs, tmpdir = [], [], None
+
+    try:
+        for entry in entries:
+            buffered.append(entry)
+
+            if buffer_size and len(buffered) >= buffer_size:
+                buffered.sort(key=itemgetter(0))
+                tmpdir = spill(buffered, runs, tmpdir)
+                buffered.clear()
+
+        buffered.sort(key=itemgetter(0))
+        yield from merge_runs(runs, buffered)
+    finally:
+        if tmpdir:
+            tmpdir.cleanup()
+
+
+def group_records(records, keyfunc, buffer_size=None, lazy=False):
+    """Groups records by key with bounded memory
+
+    Args:
+        records (Iter[dict]): The records.
+        keyfunc (func): Receives a record and returns its (sortable) key.
+        buffer_size (int): Maximum number of records held in memory while
+            sorting (default: unlimited).
+        lazy (bool): Yield each group as an iterator instead of a list. Each
+            group must then be consumed before the next one is requested.
+
+    Yields:
+        (tuple): the key and records of each group, sorted by key
+
+    Examples:
+        >>> records = ['b1', 'a1', 'b2', 'c1', 'a2']
+        >>> groups = group_records(records, itemgetter(0), 2)
+        >>> next(groups)
+        ('a', ['a1', 'a2'])
+        >>> [key for key, group in groups]
+        ['b', 'c']
+    """
+    sorted_entries = gen_sorted(records, keyfunc, buffer_size)
+
+    for key, entries in it.groupby(sorted_entries, itemgetter(0)):
+        grouped = map(itemgetter(2), entries)
+        yield (key, grouped if lazy else list(grouped))
+
+
+def gen_hashed_entries(groups, run):
+    """Generates the entries of a run of hashed groups, in order of appearance
+
+    Args:
+        groups (dict): The records of each group, keyed by ordinal.
+        run (int): The run number.
+
+    Yields:
+        (tuple): the (ordinal, run, record) entries
+    """
+    # ordinals are unique per key and run numbers are unique per run, so
+    # entries from different runs never tie (and records are never compared)
+    for ordinal in sorted(groups):
+        for record in groups[ordinal]:
+            yield (ordinal, run, record)
+
+
+def group_hashed(records, keyfunc, buffer_size=None, lazy=False):
+    """Groups records by key in order of first appearance
+
+    Records are hashed into their group in a single pass, i.e., O(n) rather
+    than O(n log n). If there are more than `buffer_size` records, the groups
+    are spilled to temporary files and k-way merged (see `merge_runs`).
+
+    Args:
+        records (Iter[dict]): The records.
+        keyfunc (func): Receives a record and returns its (hashable) key.
+        buffer_size (int): Maximum number of records held in memory while
+            grouping (default: unlimited).
+        lazy (bool): Yield each group as an iterator instead of a list. Each
+            group must then be consumed before the next one is requested.
+
+    Yields:
+        (tuple): the key and records of each group, in order of appearance
+
+    Examples:
+        >>> records = ['b1', 'a1', 'b2', 'c1', 'a2']
+        >>> groups = group_hashed(records, itemgetter(0), 2)
+        >>> next(groups)
+        ('b', ['b1', 'b2'])
+        >>> [key for key, group in groups]
+        ['a', 'c']
+    """
+    keys, ordinals = [], {}
+    groups, size, runs, tmpdir = {}, 0, [], None
+
+    try:
+        for record in records:
+            key = keyfunc(record)
+            ordinal = ordinals.get(key)
+
+            if ordinal is None:
+                ordinal = ordinals[key] = len(keys)
+                keys.append(key)
+
+            groups.setdefault(ordinal, []).append(record)
+            size += 1
+
+            if buffer_size and size >= buffer_size:
+                entries = gen_hashed_entries(groups, len(runs))
+                tmpdir = spill(entries, runs, tmpdir)
+                groups, size = {}, 0
+
+        if runs:
+            last = list(gen_hashed_entries(groups, len(runs)))
+            merged = merge_runs(runs, last)
+            ordered = it.groupby(merged, itemgetter(0))
+            grouped = ((ordinal, map(itemgetter(2), e)) for ordinal, e in ordered)
+        else:
+            # each group was first inserted in order of appearance
+            grouped = ((ordinal, iter(group)) for ordinal, group in groups.items())
+
+        for ordinal, group in grouped:
+            yield (keys[ordinal], group if lazy else list(group))
+    finally:
+        if tmpdir:
+            tmpdir.cleanup()
+
+
+def group_presorted(records, keyfunc, lazy=False):
+    """Groups records which are already contiguous by key
+
+    Group boundaries are detected as the records stream past, so nothing but
+    the current group (and the keys seen so far) is held in memory.
+
+    Args:
+        records (Iter[dict]): The records.
+        keyfunc (func): Receives a record and returns its key.
+        lazy (bool): Yield each group as an iterator instead of a list. Each
+            group must then be consumed before the next one is requested.
+
+    Yields:
+        (tuple): the key and records of each group, in file order
+
+    Raises:
+        UnsortedError: If a key reappears after its group has ended.
+
+    Examples:
+        >>> records = ['b1', 'b2', 'a1', 'c1']
+        >>> [key for key, group in group_presorted(records, itemgetter(0))]
+        ['b', 'a', 'c']
+        >>> records = ['b1', 'a1', 'b2']
+        >>> list(group_presorted(records, itemgetter(0)))
+        Traceback (most recent call last):
+        ...
+        csv2ofx.UnsortedError: Group 'b' isn't contiguous
+    """
+    seen = set()
+
+    for key, grouped in it.groupby(records, keyfunc):
+        if key in seen:
+            raise UnsortedError(f"Group {key!r} isn't contiguous")
+
+        seen.add(key)
+
+        if not lazy:
+            grouped = list(grouped)
+
+        yield (key, grouped)
@@ -0,0 +1,45 @@
+"""
+csv2ofx.index
+~~~~~~~~~~~~~
+
+The names of the bundled mappings (see `csv2ofx.mappings`)
+
+Generated by `helpers/build-index`, do not edit.
+
+Attributes:
+    MAPPINGS (tuple): The mapping names.
+"""
+
+MAPPINGS = (
+    "abnamro",
+    "amazon",
+    "boursorama",
+    "capitalone",
+    "creditunion",
+    "custom",
+    "default",
+    "eqbank",
+    "exim",
+    "gls",
+    "ingdirect",
+    "ingesp",
+    "mdb",
+    "mint",
+    "mint_extra",
+    "mint_headerless",
+    "mintapi",
+    "msmoneyreport",
+    "n26",
+    "outbank",
+    "payoneer",
+    "pcmastercard",
+    "rabobank",
+    "schwabchecking",
+    "split_account",
+    "starling",
+    "stripe",
+    "ubs-ch-fr",
+    "ubs",
+    "xero",
+    "yodlee",
+)
@@ -16,19 +16,17 @@ Attributes:
     ENCODING (str): Default file encoding.
 """
 
-import itertools as it
 import os.path
 import pathlib
 import sys
 import time
 import traceback
 from argparse import ArgumentParser, RawTextHelpFormatter
+from contextlib import ExitStack
 from datetime import datetime as dt
+from functools import cache
 from importlib import import_module, util
 from math import inf
-from operator import itemgetter
-from pkgutil import iter_modules
-from pprint import pprint
 
 try:
     FileNotFoundError
@@ -37,29 +35,35 @@ except NameError:
 
 import builtins
 
-from dateutil.parser import parse
-from meza.io import IterStringIO, read_csv, write
-
-from . import BalanceError, utils
-from .ofx import OFX
-from .qif import QIF
+# Heavier modules (`meza`, `dateutil`, and the OFX and QIF writers) are only
+# imported once a conversion starts, so e.g. `--version` and `--list-mappings`
+# stay fast
+from . import (
+    BalanceError,
+    MappingError,
+    MissingFieldError,
+    NoDataError,
+    UnsortedError,
+    utils,
+)
+from .index import MAPPINGS
 
 parser = ArgumentParser(  # pylint: disable=invalid-name
     description="description: csv2ofx converts a csv file to ofx and qif",
     prog="csv2ofx",
-    usage="%(prog)s [options] <source> <dest>",
+    usage="%(prog)s [options] <source> <dest>\n       %(prog)s serve [options]",
     formatter_class=RawTextHelpFormatter,
 )
 
 TYPES = ["CHECKING", "SAVINGS", "MONEYMRKT", "CREDITLINE", "Bank", "Cash"]
-MAPPINGS = import_module("csv2ofx.mappings")
-MODULES = tuple(itemgetter(1)(m) for m in iter_modules(MAPPINGS.__path__))
+MODULES = MAPPINGS
 
 
 def load_package_module(name):
     return import_module(f"csv2ofx.mappings.{name}")
 
 
+@cache
 def load_custom_module(filepath: str):
     """
     >>> mod = load_custom_module("csv2ofx/mappings/amazon.py")
@@ -110,20 +114,34 @@ parser.add_argument(
     action="store_true",
     default=False,
 )
+parser.add_argument(
+    "-I",
+    "--infer-dates",
+    help="infer the date format from the first dates instead of guessing each one",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "-H",
+    "--fitid-hash",
+    metavar="ALGORITHM",
+    help="hash used to generate missing transaction ids (default: md5)",
+    default="md5",
+    choices=utils.FITID_HASHES,
+)
 parser.add_argument(
     "-m",
     "--mapping",
     metavar="MAPPING_NAME",
-    help="the account mapping (default: default)",
+    help="the account mapping, or 'auto' to detect it from the csv header (default: default)",
     default="default",
-    choices=MODULES,
+    choices=["auto", *MODULES],
 )
 parser.add_argument(
     "-x",
     "--custom",
     metavar="FILE_PATH",
     help="path to a custom mapping file",
-    type=load_custom_module,
 )
 parser.add_argument(
     "-c",
@@ -139,7 +157,29 @@ parser.add_argument(
     metavar="ROWS",
     type=int,
     default=2**14,
-    help="number of rows to process at a time (default: 2 ** 14)",
+    help="number of rows to group in memory before spilling to disk (default: 2 ** 14)",
+)
+parser.add_argument(
+    "--buffer-size",
+    metavar="CHARS",
+    type=int,
+    default=2**16,
+    help="number of characters encoded and written at a time (default: 2 ** 16)",
+)
+parser.add_argument(
+    "-g",
+    "--group-order",
+    metavar="ORDER",
+    choices=["sorted", "appearance"],
+    default="sorted",
+    help="order of the account (or split id) groups, 'sorted' or 'appearance' (default: sorted)",
+)
+parser.add_argument(
+    "-S",
+    "--presorted",
+    help="stream groups from a source which is already contiguous by account (or split id)",
+    action="store_true",
+    default=False,
 )
 parser.add_argument(
     "-r",
@@ -165,6 +205,76 @@ parser.add_argument(
     default=0,
     help="the first column to process (zero based)",
 )
+parser.add_argument(
+    "-b",
+    "--batch",
+    metavar="PATTERN",
+    help="convert every csv file matching a glob pattern or in a directory",
+)
+parser.add_argument(
+    "-f",
+    "--manifest",
+    metavar="FILE_PATH",
+    help="convert the files listed in a csv manifest (source,dest,mapping,options)",
+)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    metavar="NUM",
+    type=int,
+    help="number of worker processes for batch or parallel conversion (default: cpu count)",
+)
+parser.add_argument(
+    "-P",
+    "--parallel",
+    help="split a large source file across the --jobs worker processes",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--columnar",
+    help="compute dates, amounts, and types column-wise with NumPy (mappings of only columns and constants)",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "-t",
+    "--outdir",
+    metavar="DIR",
+    help="batch output directory (default: alongside each source file)",
+)
+parser.add_argument(
+    "-p",
+    "--profile",
+    metavar="FORMAT",
+    nargs="?",
+    const="text",
+    choices=["text", "json"],
+    help="print the time spent in each stage and row counts as 'text' or 'json'",
+)
+parser.add_argument(
+    "--state",
+    metavar="FILE_PATH",
+    help="only convert transactions added since the last conversion recorded in this SQLite state file",
+)
+parser.add_argument(
+    "--reset-state",
+    help="forget the source's conversion state first",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--dedupe",
+    metavar="FILE_PATH",
+    nargs="?",
+    const="",
+    help="remove duplicate transactions (same account and FITID), also across runs if given a SQLite file to remember them in",
+)
+parser.add_argument(
+    "--duplicates",
+    metavar="FILE_PATH",
+    help="write the csv rows of the removed duplicate transactions to this file",
+)
 parser.add_argument(
     "-L",
     "--list-mappings",
@@ -221,109 +331,268 @@ def _time_from_file(path):
     return os.path.getmtime(path)
 
 
-def run(args=None):  # noqa: C901
+def run(args=None):
     """Parses the CLI options and runs the main program"""
+    args = sys.argv[1:] if args is None else args
+
+    if args[:1] == ["serve"]:
+        from .serve import run_server
+
+        sys.exit(run_server(args[1:]))
+
     args = parser.parse_args(args)
     if args.debug:
+        from pprint import pprint
+
         pprint(dict(args._get_kwargs()))  # pylint: disable=W0212
         sys.exit(0)
 
     if args.version:
-        from . import __version__ as version
+        from importlib.metadata import version
 
-        print(f"v{version}")
+        print(f"v{version('csv2ofx')}")
         sys.exit(0)
 
     if args.list_mappings:
         print(", ".join(MODULES))
         sys.exit(0)
 
-    mapping = (args.custom or load_package_module(args.mapping)).mapping
+    if args.batch or args.manifest:
+        from .batch import run_batch
+
+        sys.exit(run_batch(args))
+
+    sys.exit(convert_file(args))
+
+
+def load_mapping(args):
+    """Loads the mapping selected by the parsed CLI options"""
+    if args.custom:
+        module = load_custom_module(args.custom)
+    else:
+        module = load_package_module(args.mapping)
+
+    return module.mapping
+
+
+def detect_mapping(args):
+    """Replaces the `auto` mapping with the one detected from the source's
+    header, and shows the confidence of the match and the runners-up
+
+    Returns:
+        An error message if no mapping (or more than one) was detected.
+    """
+    from .detect import detect
+
+    if not args.source:
+        return "Can't detect the mapping of stdin. Use `-m` or `-x` option."
+
+    matches = detect(args.source, args.encoding)
+
+    if not matches:
+        return (
+            f"No mapping matches the header of {args.source}. Use `-m` or `-x` option."
+        )
+
+    (name, confidence), *runners_up = matches
+    tied = [other for other, conf in runners_up if conf == confidence]
+
+    if tied:
+        names = ", ".join(f"'{other}'" for other in [name, *tied])
+        return (
+            f"The mapping of {args.source} is ambiguous ({names} match its header "
+            "equally well). Use `-m` or `-x` option."
+        )
+
+    msg = f"Detected mapping '{name}' ({confidence:.0%} confidence)"
+
+    if runners_up:
+        others = (f"{other} ({conf:.0%})" for other, conf in runners_up[:3])
+        msg += f"; runners-up: {', '.join(others)}"
+
+    print(msg, file=sys.stderr)
+    args.mapping = name
+
+
+def get_content(args, mapping):
+    """Creates the OFX or QIF content object selected by the parsed CLI options"""
+    from . import api
 
     okwargs = {
-        "def_type": args.account_type or "Bank" if args.qif else "CHECKING",
-        "start": parse(args.start, dayfirst=args.dayfirst) if args.start else None,
-        "end": parse(args.end, dayfirst=args.dayfirst) if args.end else None,
+        "account_type": args.account_type,
+        "start": args.start,
+        "end": args.end,
+        "dayfirst": args.dayfirst,
         "ms_money": args.ms_money,
+        "infer_fmt": args.infer_dates,
+        "fitid_hash": args.fitid_hash,
     }
 
-    cont = QIF(mapping, **okwargs) if args.qif else OFX(mapping, **okwargs)
-    source = (
-        builtins.open(args.source, encoding=args.encoding) if args.source else sys.stdin
-    )
-
-    ckwargs = {
-        "has_header": cont.has_header,
-        "custom_header": getattr(cont, "custom_header", None),
-        "delimiter": mapping.get("delimiter", ","),
-        "first_row": mapping.get("first_row", args.first_row),
-        "last_row": mapping.get("last_row", args.last_row),
-        "first_col": mapping.get("first_col", args.first_col),
-    }
+    return api.get_content(mapping, qif=args.qif, **okwargs)
+
 
+def read_columnar(cont, mapping, records):
+    """Computes the transaction data of the records column-wise (if NumPy is
+    installed and the mapping is simple enough, see `csv2ofx.columnar`)"""
     try:
-        records = read_csv(source, **ckwargs)
-        groups = cont.gen_groups(records, args.chunksize)
-        trxns = cont.gen_trxns(groups, args.collapse)
-        cleaned_trxns = cont.clean_trxns(trxns)
-        data = utils.gen_data(cleaned_trxns)
-        body = cont.gen_body(data)
+        from .columnar import gen_prepared, get_spec
+    except ImportError:
+        return records
+
+    spec = get_spec(cont, mapping)
+    return gen_prepared(cont, spec, records) if spec else records
+
+
+def convert_file(args):  # noqa: C901
+    """Converts a single source file
+
+    Args:
+        args (obj): The parsed CLI options.
+
+    Returns:
+        The exit status: 0 on success, otherwise an error message, exception,
+        or 1 if a traceback was printed.
+    """
+    from dateutil.parser import parse
+    from meza.io import read_csv
+
+    from . import api
+    from .profile import Profiler
+    from .source import open_source
+
+    if args.mapping == "auto" and not args.custom:
+        msg = detect_mapping(args)
+
+        if msg:
+            return msg
+
+    mapping = load_mapping(args)
+    cont = get_content(args, mapping)
+    source = open_source(args.source, args.encoding) if args.source else sys.stdin
+
+    rkwargs = {k: getattr(args, k) for k in ["first_row", "last_row", "first_col"]}
+    ckwargs = api.get_read_kwargs(cont, **rkwargs)
+    profiler = Profiler(cont) if args.profile else None
+    state = deduper = None
+    resources = ExitStack()
+
+    try:
+        if args.state:
+            from .state import State
+
+            state = State(args.state, args.source, args.reset_state)
+            resources.callback(state.close)
+            records = state.read(cont, ckwargs, args.encoding)
+        elif args.parallel and args.source:
+            from .parallel import read_parallel
+
+            records = read_parallel(args, cont, ckwargs)
+        else:
+            records = None
+
+        records = records or read_csv(source, **ckwargs)
+
+        if args.columnar and not args.parallel:
+            records = read_columnar(cont, mapping, records)
+
+        if args.dedupe is not None or args.duplicates:
+            from .dedupe import Deduper
+
+            deduper = resources.enter_context(Deduper(args.dedupe, args.duplicates))
 
         if args.server_date:
             server_date = parse(args.server_date, dayfirst=args.dayfirst)
         else:
             try:
-                mtime = _time_from_file(source.name)
+                mtime = _time_from_file(args.source or source.name)
             except (AttributeError, FileNotFoundError):
                 mtime = time.time()
 
             server_date = dt.fromtimestamp(mtime)
 
-        header = cont.header(date=server_date, language=args.language)
-        footer = cont.footer(date=server_date, balance=args.ending_balance)
-        filtered = filter(None, [header, body, footer])
-        content = it.chain.from_iterable(filtered)
-        kwargs = {
-            "overwrite": args.overwrite,
+        gkwargs = {
+            "collapse": args.collapse,
             "chunksize": args.chunksize,
-            "encoding": args.encoding,
+            "presorted": args.presorted,
+            "group_order": args.group_order,
+            "server_date": server_date,
+            "language": args.language,
+            "ending_balance": args.ending_balance,
+            "deduper": deduper,
+            "profiler": profiler,
         }
-    except Exception as err:  # pylint: disable=broad-except
-        source.close() if args.source else None
-        sys.exit(err)
 
-    dest = (
-        builtins.open(args.dest, "w", encoding=args.encoding)
-        if args.dest
-        else sys.stdout
-    )
+        content = api.gen_content(cont, records, **gkwargs)
 
-    try:
-        res = write(dest, IterStringIO(content), **kwargs)
-    except KeyError as err:
-        msg = f"Field {err} is missing from file. Check `mapping` option."
-    except TypeError as err:
-        msg = f"No data to write. {str(err)}. "
-
-        if args.collapse:
-            msg += "Check `start` and `end` options."
-        else:
-            msg += "Try again with `-c` option."
-    except ValueError as err:
-        # csv2ofx called with no arguments or broken mapping
-        msg = f"Possible mapping problem: {str(err)}."
-        parser.print_help()
-    except BalanceError as err:
-        msg = f"{err}.  Try again with `--ending-balance` option."
-    except Exception:  # pylint: disable=broad-except
-        msg = 1
-        traceback.print_exc()
-    else:
-        msg = 0 if res else "No data to write. Check `start` and `end` options."
-    finally:
+        if profiler:
+            content = profiler.count_bytes(content, args.encoding)
+    except Exception as err:  # pylint: disable=broad-except
         source.close() if args.source else None
-        dest.close() if args.dest else None
-        sys.exit(msg)
+        resources.close()
+        return err
+
+    with resources:
+        dest = (
+            builtins.open(args.dest, "w", encoding=args.encoding)
+            if args.dest
+            else sys.stdout
+        )
+
+        # no new transactions isn't an error when converting incrementally or
+        # removing duplicates
+        msg = 0
+
+        try:
+            api.write_content(content, dest, args.buffer_size, args.encoding)
+        except MissingFieldError as err:
+            msg = f"{err}. Check `mapping` option."
+        except NoDataError as err:
+            skipped = (state and state.skipped) or (deduper and deduper.removed)
+
+            if str(err) and args.collapse:
+                msg = f"No data to write. {err}. Check `start` and `end` options."
+            elif str(err):
+                msg = f"No data to write. {err}. Try again with `-c` option."
+            elif not skipped:
+                msg = "No data to write. Check `start` and `end` options."
+        except MappingError as err:
+            # csv2ofx called with no arguments or broken mapping
+            msg = f"Possible mapping problem: {err}."
+
+            if not (args.batch or args.manifest):
+                parser.print_help()
+        except BalanceError as err:
+            msg = f"{err}.  Try again with `--ending-balance` option."
+        except UnsortedError as err:
+            msg = f"{err}. Try again without `--presorted` option."
+        except Exception:  # pylint: disable=broad-except
+            msg = 1
+            traceback.print_exc()
+        finally:
+            source.close() if args.source else None
+            dest.close() if args.dest else None
+
+        if state and not msg:
+            state.commit()
+
+        if state and state.warning() and not msg:
+            print(state.warning(), file=sys.stderr)
+
+        if deduper and not msg:
+            deduper.commit()
+            print(deduper.summary(), file=sys.stderr)
+
+        if args.verbose and not msg:
+            print(f"Date parsing: {cont.date_stats()}", file=sys.stderr)
+
+        if args.verbose and state and not msg:
+            print(state.summary(), file=sys.stderr)
+
+    if profiler:
+        profiler.stop()
+        print(profiler.format(args.profile), file=sys.stderr)
+
+    return msg
 
 
 if __name__ == "__main__":
@@ -8,10 +8,10 @@ Provides a mapping for transactions obtained via ING Direct
 (Spanish bank)
 """
 
-import hashlib
-import json
 from operator import itemgetter
 
+from csv2ofx.utils import row_fingerprint
+
 
 def find_type(transaction):
     amount = float(transaction.get("amount"))
@@ -19,10 +19,7 @@ def find_type(transaction):
 
 
 def gen_transaction_id(transaction):
-    hasher = hashlib.sha256()
-    stringified = json.dumps(transaction).encode("utf-8")
-    hasher.update(stringified)
-    return hasher.hexdigest()
+    return row_fingerprint(transaction)
 
 
 def get_payee(transaction):
@@ -1,7 +1,7 @@
-import hashlib
-import json
 from operator import itemgetter
 
+from csv2ofx.utils import row_fingerprint
+
 
 def find_type(transaction):
     amount = float(transaction.get("Amount (EUR)"))
@@ -9,10 +9,7 @@ def find_type(transaction):
 
 
 def gen_transaction_id(transaction):
-    hasher = hashlib.sha256()
-    stringified = json.dumps(transaction).encode("utf-8")
-    hasher.update(stringified)
-    return hasher.hexdigest()
+    return row_fingerprint(transaction)
 
 
 mapping = {
@@ -21,16 +21,26 @@ tricky:
 
 """
 
-# Financial numbers are expressed as "2'045.56" in de/fr/it_CH (utf8 has some
-# glitches, so we go for the default one)
 import locale
+from functools import cache
 from operator import itemgetter
 
-locale.setlocale(locale.LC_NUMERIC, 'fr_CH')
-
 __author__ = 'Marco "sphakka" Poleggi'
 
 
+# Financial numbers are expressed as "2'045.56" in de/fr/it_CH (utf8 has some
+# glitches, so we go for the default one). The locale is only set once an
+# amount is parsed, so importing (or listing) the mapping has no side effects.
+@cache
+def set_locale():
+    locale.setlocale(locale.LC_NUMERIC, 'fr_CH')
+
+
+def atof(content):
+    set_locale()
+    return locale.atof(content)
+
+
 def fixdate(ds):
     dmy = ds.split(".")
     # BUG (!?): can't format here ISO-style as it won't accept first
@@ -62,7 +72,7 @@ mapping = {
     # 'Débit' and 'Crédit' columns are always provided, but only one may have
     # a value in a given row
     "type": lambda tr: "debit" if tr.get("Débit") != "" else "credit",
-    "amount": lambda tr: locale.atof(tr["Débit"] or tr["Crédit"]),
+    "amount": lambda tr: atof(tr["Débit"] or tr["Crédit"]),
     # debits show _your_ notes in "Desc 2", whereas credits report the
     # _payee_. Thus a better "class" value comes from "Desc 1" + "Desc 2"
     "class": map_class,
@@ -73,5 +83,5 @@ mapping = {
     "desc": map_descr,
     "payee": map_payee,
     "check_num": itemgetter("N° de transaction"),
-    "balance": lambda tr: locale.atof(tr["Solde"]),
+    "balance": lambda tr: atof(tr["Solde"]),
 }
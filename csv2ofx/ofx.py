@@ -19,10 +19,8 @@ Attributes:
 
 import datetime
 
-from meza.fntools import chunk, xmlize
-from meza.process import group
-
-from . import BalanceError, Content, utils
+from . import BLOCK_SIZE, BalanceError, Content, Transaction, utils
+from .grouping import group_hashed, group_presorted, group_records
 
 
 class OFX(Content):
@@ -48,6 +46,17 @@ class OFX(Content):
         super().__init__(mapping, **kwargs)
         self.resp_type = "INTRATRNRS" if self.split_account else "STMTTRNRS"
         self.def_type = kwargs.get("def_type")
+        self.account_types = {
+            "CHECKING": ("checking", "income", "receivable", "payable"),
+            "SAVINGS": ("savings",),
+            "MONEYMRKT": ("market", "cash", "expenses"),
+            "CREDITLINE": ("visa", "master", "express", "discover"),
+        }
+        self.classify_account = utils.Classifier(self.account_types, self.def_type)
+
+    def init_context(self):
+        """Sets up the state of a single conversion (see `Content.context`)"""
+        super().init_context()
         self.prev_group = None
         self.first_trxn = None
         self.last_trxn = None
@@ -57,12 +66,6 @@ class OFX(Content):
         self.dates_descending = 0
         self.balances_ascending = 0
         self.balances_descending = 0
-        self.account_types = {
-            "CHECKING": ("checking", "income", "receivable", "payable"),
-            "SAVINGS": ("savings",),
-            "MONEYMRKT": ("market", "cash", "expenses"),
-            "CREDITLINE": ("visa", "master", "express", "discover"),
-        }
 
     def header(self, **kwargs):
         """ Gets OFX format transaction content
@@ -142,11 +145,11 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
         content += "\t\t\t</STATUS>\n"
         yield content
 
-    def transaction_data(self, trxn):
-        """gets OFX transaction data
+    def format_data(self, data):
+        """Adds the OFX specific transaction data
 
         Args:
-            trxn (dict): the transaction
+            data (dict): the transaction data
 
         Returns:
             (dict): the OFX transaction data
@@ -177,10 +180,8 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
             ...     'balance': None}
             True
         """
-        data = super().transaction_data(trxn)
-        args = [self.account_types, self.def_type]
         split = data["split_account"]
-        sa_type = utils.get_account_type(split, *args) if split else None
+        sa_type = self.classify_account(split) if split else None
         memo = data.get("memo")
         _class = data.get("class")
         memo = f"{memo} {_class}" if memo and _class else memo or _class
@@ -200,7 +201,7 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
                 date = date.replace(hour=12)
 
         new_data = {
-            "account_type": utils.get_account_type(data["account"], *args),
+            "account_type": self.classify_account(data["account"]),
             "split_account_type": sa_type,
             "memo": memo,
             "payee": payee,
@@ -246,27 +247,24 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
             # world. In the example above, a <DTPOSTED>20000505120000 would
             # always display as 5/5/00 anywhere the world except for the
             # center of the Pacific Ocean."
-            kwargs.update({
-                "start_date": self.start.strftime("%Y%m%d120000"),
-                "end_date": self.end.strftime("%Y%m%d120000"),
-            })
+            start_date = self.start.strftime("%Y%m%d120000")
+            end_date = self.end.strftime("%Y%m%d120000")
         else:
-            kwargs.update({
-                "start_date": self.start.strftime("%Y%m%d"),
-                "end_date": self.end.strftime("%Y%m%d"),
-            })
-
-        content = "\t\t\t<STMTRS>\n"
-        content += "\t\t\t\t<CURDEF>{currency}</CURDEF>\n".format(**kwargs)
-        content += "\t\t\t\t<BANKACCTFROM>\n"
-        content += "\t\t\t\t\t<BANKID>{bank_id}</BANKID>\n".format(**kwargs)
-        content += "\t\t\t\t\t<ACCTID>{account_id}</ACCTID>\n".format(**kwargs)
-        content += "\t\t\t\t\t<ACCTTYPE>{account_type}</ACCTTYPE>\n".format(**kwargs)
-        content += "\t\t\t\t</BANKACCTFROM>\n"
-        content += "\t\t\t\t<BANKTRANLIST>\n"
-        content += "\t\t\t\t\t<DTSTART>{start_date}</DTSTART>\n".format(**kwargs)
-        content += "\t\t\t\t\t<DTEND>{end_date}</DTEND>\n".format(**kwargs)
-        return content
+            start_date = self.start.strftime("%Y%m%d")
+            end_date = self.end.strftime("%Y%m%d")
+
+        return (
+            "\t\t\t<STMTRS>\n"
+            f"\t\t\t\t<CURDEF>{kwargs['currency']}</CURDEF>\n"
+            "\t\t\t\t<BANKACCTFROM>\n"
+            f"\t\t\t\t\t<BANKID>{kwargs['bank_id']}</BANKID>\n"
+            f"\t\t\t\t\t<ACCTID>{kwargs['account_id']}</ACCTID>\n"
+            f"\t\t\t\t\t<ACCTTYPE>{kwargs['account_type']}</ACCTTYPE>\n"
+            "\t\t\t\t</BANKACCTFROM>\n"
+            "\t\t\t\t<BANKTRANLIST>\n"
+            f"\t\t\t\t\t<DTSTART>{start_date}</DTSTART>\n"
+            f"\t\t\t\t\t<DTEND>{end_date}</DTEND>\n"
+        )
 
     def transaction(self, **kwargs):
         """ Gets OFX format transaction content
@@ -297,27 +295,31 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
             True
         """
         time_stamp = kwargs["date"].strftime("%Y%m%d%H%M%S")  # yyyymmddhhmmss
-
-        content = "\t\t\t\t\t<STMTTRN>\n"
-        content += "\t\t\t\t\t\t<TRNTYPE>{type}</TRNTYPE>\n".format(**kwargs)
-        content += f"\t\t\t\t\t\t<DTPOSTED>{time_stamp}</DTPOSTED>\n"
-        content += "\t\t\t\t\t\t<TRNAMT>{amount:0.2f}</TRNAMT>\n".format(**kwargs)
-        content += "\t\t\t\t\t\t<FITID>{id}</FITID>\n".format(**kwargs)
-
-        if (self.ms_money and kwargs.get("check_num")) or (
-            not self.ms_money and kwargs.get("check_num") is not None
+        check_num = kwargs.get("check_num")
+        payee = kwargs.get("payee")
+        memo = kwargs.get("memo")
+
+        # Each optional element renders to either a full line or nothing, so
+        # every record shape is built by the single template below.
+        if (self.ms_money and check_num) or (
+            not self.ms_money and check_num is not None
         ):
-            extra = "\t\t\t\t\t\t<CHECKNUM>%(check_num)s</CHECKNUM>\n"
-            content += extra % kwargs
-
-        if kwargs.get("payee") is not None:
-            content += "\t\t\t\t\t\t<NAME>{payee}</NAME>\n".format(**kwargs)
-
-        if kwargs.get("memo"):
-            content += "\t\t\t\t\t\t<MEMO>{memo}</MEMO>\n".format(**kwargs)
-
-        content += "\t\t\t\t\t</STMTTRN>\n"
-        return content
+            check_line = f"\t\t\t\t\t\t<CHECKNUM>{check_num}</CHECKNUM>\n"
+        else:
+            check_line = ""
+
+        name_line = "" if payee is None else f"\t\t\t\t\t\t<NAME>{payee}</NAME>\n"
+        memo_line = f"\t\t\t\t\t\t<MEMO>{memo}</MEMO>\n" if memo else ""
+
+        return (
+            "\t\t\t\t\t<STMTTRN>\n"
+            f"\t\t\t\t\t\t<TRNTYPE>{kwargs['type']}</TRNTYPE>\n"
+            f"\t\t\t\t\t\t<DTPOSTED>{time_stamp}</DTPOSTED>\n"
+            f"\t\t\t\t\t\t<TRNAMT>{kwargs['amount']:0.2f}</TRNAMT>\n"
+            f"\t\t\t\t\t\t<FITID>{kwargs['id']}</FITID>\n"
+            f"{check_line}{name_line}{memo_line}"
+            "\t\t\t\t\t</STMTTRN>\n"
+        )
 
     def account_end(self, **kwargs):
         """ Gets OFX format transaction account end content
@@ -338,7 +340,6 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
             True
         """
         time_stamp = kwargs["date"].strftime("%Y%m%d%H%M%S")  # yyyymmddhhmmss
-        content = "\t\t\t\t</BANKTRANLIST>\n"
 
         # Use the following ranked rules to guess at transaction order:
         # 1. If the transaction with the latest date is the only transcation
@@ -377,16 +378,19 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
             time_stamp = endbaltrxn['date'].strftime("%Y%m%d%H%M%S")
 
         if balamt is not None:
-            content += "\t\t\t\t<LEDGERBAL>\n"
-            content += f"\t\t\t\t\t<BALAMT>{balamt:0.2f}</BALAMT>\n"
-            content += f"\t\t\t\t\t<DTASOF>{time_stamp}</DTASOF>\n"
-            content += "\t\t\t\t</LEDGERBAL>\n"
+            ledger = (
+                "\t\t\t\t<LEDGERBAL>\n"
+                f"\t\t\t\t\t<BALAMT>{balamt:0.2f}</BALAMT>\n"
+                f"\t\t\t\t\t<DTASOF>{time_stamp}</DTASOF>\n"
+                "\t\t\t\t</LEDGERBAL>\n"
+            )
         elif self.ms_money:
             # MS Money import fails if <LEDGERBAL> is missing
             raise BalanceError(f"Ending balance not specified and {reason}")
+        else:
+            ledger = ""
 
-        content += "\t\t\t</STMTRS>\n"
-        return content
+        return f"\t\t\t\t</BANKTRANLIST>\n{ledger}\t\t\t</STMTRS>\n"
 
     def transfer(self, **kwargs):
         """ Gets OFX transfer start
@@ -419,18 +423,18 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
             >>> trxn == result.replace('\\n', '').replace('\\t', '')
             True
         """
-        content = "\t\t\t<INTRARS>\n"
-        content += "\t\t\t\t<CURDEF>{currency}</CURDEF>\n".format(**kwargs)
-        content += "\t\t\t\t<SRVRTID>{id}</SRVRTID>\n".format(**kwargs)
-        content += "\t\t\t\t<XFERINFO>\n"
-        content += "\t\t\t\t\t<TRNAMT>{amount:0.2f}</TRNAMT>\n".format(**kwargs)
-        content += "\t\t\t\t\t<BANKACCTFROM>\n"
-        content += "\t\t\t\t\t\t<BANKID>{bank_id}</BANKID>\n".format(**kwargs)
-        content += "\t\t\t\t\t\t<ACCTID>{account_id}</ACCTID>\n".format(**kwargs)
-        content += "\t\t\t\t\t\t<ACCTTYPE>{account_type}".format(**kwargs)
-        content += "</ACCTTYPE>\n"
-        content += "\t\t\t\t\t</BANKACCTFROM>\n"
-        return content
+        return (
+            "\t\t\t<INTRARS>\n"
+            f"\t\t\t\t<CURDEF>{kwargs['currency']}</CURDEF>\n"
+            f"\t\t\t\t<SRVRTID>{kwargs['id']}</SRVRTID>\n"
+            "\t\t\t\t<XFERINFO>\n"
+            f"\t\t\t\t\t<TRNAMT>{kwargs['amount']:0.2f}</TRNAMT>\n"
+            "\t\t\t\t\t<BANKACCTFROM>\n"
+            f"\t\t\t\t\t\t<BANKID>{kwargs['bank_id']}</BANKID>\n"
+            f"\t\t\t\t\t\t<ACCTID>{kwargs['account_id']}</ACCTID>\n"
+            f"\t\t\t\t\t\t<ACCTTYPE>{kwargs['account_type']}</ACCTTYPE>\n"
+            "\t\t\t\t\t</BANKACCTFROM>\n"
+        )
 
     def split_content(self, **kwargs):
         """ Gets OFX split content
@@ -478,24 +482,20 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
             >>> split == result.replace('\\n', '').replace('\\t', '')
             True
         """
-        content = "\t\t\t\t\t<BANKACCTTO>\n"
-        content += "\t\t\t\t\t\t<BANKID>{bank_id}</BANKID>\n".format(**kwargs)
-
-        if kwargs.get("split_account"):
-            content += "\t\t\t\t\t\t<ACCTID>{split_account_id}".format(**kwargs)
-        else:
-            content += "\t\t\t\t\t\t<ACCTID>{account_id}".format(**kwargs)
-
-        content += "</ACCTID>\n"
-
         if kwargs.get("split_account"):
-            content += "\t\t\t\t\t\t<ACCTTYPE>{split_account_type}".format(**kwargs)
+            account_id = kwargs["split_account_id"]
+            account_type = kwargs["split_account_type"]
         else:
-            content += "\t\t\t\t\t\t<ACCTTYPE>{account_type}".format(**kwargs)
-
-        content += "</ACCTTYPE>\n"
-        content += "\t\t\t\t\t</BANKACCTTO>\n"
-        return content
+            account_id = kwargs["account_id"]
+            account_type = kwargs["account_type"]
+
+        return (
+            "\t\t\t\t\t<BANKACCTTO>\n"
+            f"\t\t\t\t\t\t<BANKID>{kwargs['bank_id']}</BANKID>\n"
+            f"\t\t\t\t\t\t<ACCTID>{account_id}</ACCTID>\n"
+            f"\t\t\t\t\t\t<ACCTTYPE>{account_type}</ACCTTYPE>\n"
+            "\t\t\t\t\t</BANKACCTTO>\n"
+        )
 
     # pylint: disable=unused-argument
     def transfer_end(self, date=None, **kwargs):
@@ -514,10 +514,11 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
             True
         """
         time_stamp = date.strftime("%Y%m%d%H%M%S")  # yyyymmddhhmmss
-        content = "\t\t\t\t</XFERINFO>\n"
-        content += f"\t\t\t\t<DTPOSTED>{time_stamp}</DTPOSTED>\n"
-        content += "\t\t\t</INTRARS>\n"
-        return content
+        return (
+            "\t\t\t\t</XFERINFO>\n"
+            f"\t\t\t\t<DTPOSTED>{time_stamp}</DTPOSTED>\n"
+            "\t\t\t</INTRARS>\n"
+        )
 
     def footer(self, **kwargs):
         """Gets OFX transfer end
@@ -529,15 +530,23 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
             (str): the OFX content
 
         Examples:
+            >>> ofx = OFX()
+            >>> ofx.prev_group = 'Checking'  # i.e., a transaction was written
             >>> ft = '</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>'
-            >>> result = OFX().footer(date=datetime.datetime(2012, 1, 15))
+            >>> result = ofx.footer(date=datetime.datetime(2012, 1, 15))
             >>> result = list(result)[0]
             >>> ft == result.replace('\\n', '').replace('\\t', '')
             True
+            >>> result = list(OFX().footer())[0]
+            >>> result.replace('\\n', '').replace('\\t', '')
+            '</STMTTRNRS></BANKMSGSRSV1></OFX>'
         """
         kwargs.setdefault("date", datetime.datetime.now())
 
-        if self.is_split:
+        if self.prev_group is None:
+            # no transaction was written (e.g., they were all duplicates)
+            content = ""
+        elif self.is_split:
             content = self.transfer_end(**kwargs)
         elif not self.split_account:
             content = self.account_end(**kwargs)
@@ -548,7 +557,14 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
         yield content
 
     def gen_body(self, data):  # noqa: C901
-        """Generate the OFX body"""
+        """Generate the OFX body
+
+        Rendered records are appended to a shared buffer which is yielded in
+        blocks of `BLOCK_SIZE` records rather than one string at a time.
+        """
+        block = []
+        emit = block.append
+
         for datum in data:
             grp = datum["group"]
 
@@ -556,34 +572,41 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
                 # OFX doesn't support more than 2 splits
                 raise TypeError(f"Group {grp} has too many splits.\n")
 
-            trxn_data = self.transaction_data(datum["trxn"])
+            trxn_data = self.get_data(datum["trxn"])
             split_like = self.is_split or self.split_account
             full_split = self.is_split and self.split_account
             new_group = self.prev_group and self.prev_group != grp
 
             if new_group and full_split:
-                yield self.transfer_end(**trxn_data)
+                emit(self.transfer_end(**trxn_data))
             elif new_group and not split_like:
-                yield self.account_end(**trxn_data)
+                emit(self.account_end(**trxn_data))
 
             if self.split_account:
-                yield self.transfer(**trxn_data)
-                yield self.split_content(**trxn_data)
-                yield self.transfer_end(**trxn_data)
+                emit(self.transfer(**trxn_data))
+                emit(self.split_content(**trxn_data))
+                emit(self.transfer_end(**trxn_data))
             elif self.is_split and datum["is_main"]:
-                yield self.transfer(**trxn_data)
+                emit(self.transfer(**trxn_data))
             elif self.is_split:
-                yield self.split_content(**trxn_data)
+                emit(self.split_content(**trxn_data))
             elif datum["is_main"]:
                 self.calc_balances(trxn_data)
-                yield self.account_start(**trxn_data)
-                yield self.transaction(**trxn_data)
+                emit(self.account_start(**trxn_data))
+                emit(self.transaction(**trxn_data))
             else:
                 self.calc_balances(trxn_data)
-                yield self.transaction(**trxn_data)
+                emit(self.transaction(**trxn_data))
 
             self.prev_group = grp
 
+            if len(block) >= BLOCK_SIZE:
+                yield "".join(block)
+                block.clear()
+
+        if block:
+            yield "".join(block)
+
     def calc_balances(self, trxn):
         """Analyzes pairs of transactions to help determine the correct ending
         balance to use in <LEDGERBAL> block.
@@ -637,10 +660,7 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
             >>> ofx.latest_date_count
             1
         """
-        if self.latest_trxn is None:
-            self.latest_trxn = trxn
-            self.latest_date_count = 1
-        elif trxn['date'] > self.latest_trxn['date']:
+        if self.latest_trxn is None or trxn['date'] > self.latest_trxn['date']:
             self.latest_trxn = trxn
             self.latest_date_count = 1
         elif trxn['date'] == self.latest_trxn['date']:
@@ -734,10 +754,50 @@ ENCODING:USASCIICHARSET:1252COMPRESSION:NONEOLDFILEUID:NONENEWFILEUID:NONE\
         """Ending balance will be here if transactions are in ascending order"""
         self.last_trxn = trxn
 
-    def gen_groups(self, records, chunksize=None):
-        """Generate the OFX groups"""
-        for chnk in chunk(records, chunksize):
-            cleansed = [{k: next(xmlize([v])) for k, v in c.items()} for c in chnk]
-            keyfunc = self.id if self.is_split else self.account
+    def gen_records(self, records):
+        """Generate normalized and xml compliant transaction records
+
+        Args:
+            records (Iter[dict]): The csv rows.
+
+        Yields:
+            (Transaction): a transaction record
+
+        Examples:
+            >>> trxn = next(OFX().gen_records([{'Payee': 'A&W'}]))
+            >>> trxn, trxn.raw
+            ({'Payee': 'A&ampW'}, {'Payee': 'A&W'})
+        """
+        for record in records:
+            if isinstance(record, Transaction):
+                yield record
+                continue
 
-            yield from group(cleansed, keyfunc)
+            escaped = utils.xmlize_row(record)
+            trxn = Transaction(escaped)
+
+            if escaped is not record:
+                # keep the csv row (e.g., for `csv2ofx.dedupe`)
+                trxn.raw = record
+
+            yield trxn
+
+    def gen_groups(self, records, chunksize=None, presorted=False, order="sorted"):
+        """Generate the OFX groups
+
+        Each account (or split `id`) forms exactly one group. Groups are
+        `sorted` by key or kept in `appearance` order. At most `chunksize`
+        records are held in memory while grouping, the rest are spilled to
+        temporary files (see `csv2ofx.grouping`). If `presorted`, the records
+        must already be contiguous by group and are streamed as is.
+        """
+        keyfunc = self.id if self.is_split else self.account
+        trxns = self.gen_records(records)
+        lazy = not self.is_split
+
+        if presorted:
+            yield from group_presorted(trxns, keyfunc, lazy=lazy)
+        elif order == "appearance":
+            yield from group_hashed(trxns, keyfunc, chunksize, lazy=lazy)
+        else:
+            yield from group_records(trxns, keyfunc, chunksize, lazy=lazy)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+csv2ofx.parallel
+~~~~~~~~~~~~~~~~
+
+Provides functions for reading a single large csv file with a pool of worker
+processes
+
+The source is split into byte ranges which end on record boundaries (i.e.,
+newlines outside of quoted fields). Each worker reads its range and parses the
+date, amount, balance, and transaction data of every row, which travel back
+attached to the `Transaction` records. The records are then fed, in order,
+through the usual grouping, cleaning, and `gen_body` stages so the output is
+identical to a serial conversion.
+
+The first range is read in the parent process so that the date format and
+amount separators it learns (see `Content.parse_datestr` and
+`utils.AmountParser`) are shared by every worker. If it doesn't settle them,
+the parent keeps reading ranges until it does. Like a serial conversion (see
+`Content.gen_learned`), they are learned from the rows in file order.
+
+Examples:
+    literal blocks::
+
+        csv2ofx --parallel --jobs 8 transactions.csv transactions.ofx
+
+Attributes:
+    HEAD_SIZE (int): Size (in bytes) of the first range.
+    RANGE_SIZE (int): Size (in bytes) of the remaining ranges.
+"""
+
+import csv
+import io
+import itertools as it
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+from math import inf
+
+from meza.io import read_csv
+
+from .main import get_content, load_mapping
+from .source import MappedSource, is_mappable
+
+HEAD_SIZE = 2**18
+RANGE_SIZE = 2**22
+
+# Content attributes learned while parsing the first range
+STATE_ATTRS = ("inferred_fmt", "date_samples", "amount_parser", "balance_parser")
+
+
+def gen_ranges(data, head_size=HEAD_SIZE, range_size=RANGE_SIZE, quotechar=b'"'):
+    """Generates byte ranges of csv content which end on record boundaries
+
+    Args:
+        data (bytes): The csv content (or a `mmap` of the csv file).
+        head_size (int): Minimum size of the first range.
+        range_size (int): Minimum size of the remaining ranges.
+        quotechar (bytes): The csv quote character.
+
+    Yields:
+        (Tuple[int]): the start and end offset of each range
+
+    Examples:
+        >>> data = b'a,b\\n1,"x\\ny"\\n2,z\\n3,w\\n'
+        >>> list(gen_ranges(data, 4, 4))
+        [(0, 4), (4, 12), (12, 16), (16, 20)]
+        >>> list(gen_ranges(data, 4, 16))
+        [(0, 4), (4, 20)]
+    """
+    size = len(data)
+    start = pos = quotes = 0
+    end = head_size
+
+    while end < size:
+        newline = data.find(b"\n", max(end - 1, pos))
+
+        if newline < 0:
+            break
+
+        # `quotes` counts the quote characters before `pos`. A newline only
+        # ends a record if it isn't inside a quoted field.
+        quotes += data[pos:newline].count(quotechar)
+        pos = newline + 1
+
+        if not quotes % 2:
+            yield (start, pos)
+            start, end = pos, pos + range_size
+
+    if start < size:
+        yield (start, size)
+
+
+def get_header(line, has_header=True, custom_header=None, **kwargs):
+    """Gets the field names `meza.io.read_csv` uses for a csv file
+
+    Args:
+        line (str): The first line of the file.
+        has_header (bool): Whether or not the file has a header row.
+        custom_header (List[str]): Header row to use instead.
+        kwargs (dict): Keyword arguments passed to `read_csv`.
+
+    Returns:
+        (List[str]): the field names
+
+    Examples:
+        >>> get_header('Date,,Amount\\n')
+        ['Date', 'Amount']
+        >>> get_header('1/1/15;10\\n', False, delimiter=';')
+        ['column_1', 'column_2']
+    """
+    names = next(csv.reader([line], delimiter=kwargs.get("delimiter", ",")))
+
+    if has_header or custom_header:
+        return [name for name in custom_header or names if name.strip()]
+    else:
+        return [f"column_{n + 1}" for n in range(len(names))]
+
+
+def read_range(source, span, encoding="utf-8", **kwargs):
+    """Reads the records of a byte range of a csv file
+
+    Args:
+        source (str): The csv file path.
+        span (Tuple[int]): The start and end offset of the range.
+        encoding (str): The file encoding.
+        kwargs (dict): Keyword arguments passed to `read_csv`.
+
+    Returns:
+        (Iter[dict]): the csv records
+    """
+    start, end = span
+
+    with open(source, "rb") as f:
+        f.seek(start)
+        raw = f.read(end - start)
+
+    # decode the same way `open` does (e.g., universal newlines)
+    return read_csv(io.TextIOWrapper(io.BytesIO(raw), encoding=encoding), **kwargs)
+
+
+def prepare(cont, records):
+    """Parses the date, amount, balance, and transaction data of each record
+
+    Any error is left for the serial stages to raise (in their usual order).
+
+    Args:
+        cont (obj): The OFX or QIF content object.
+        records (Iter[dict]): The csv records.
+
+    Returns:
+        (List[Transaction]): the transactions
+    """
+    trxns = list(cont.gen_records(records))
+
+    for trxn in trxns:
+        with suppress(Exception):
+            cont.parse_date(trxn)
+
+        with suppress(Exception):
+            cont.convert_amount(trxn)
+
+        with suppress(Exception):
+            cont.convert_balance(trxn)
+
+        with suppress(Exception):
+            trxn.data = cont.transaction_data(trxn)
+
+    return trxns
+
+
+def prepare_range(args, span, state, **kwargs):
+    """Reads and prepares the transactions of a byte range (in a worker)
+
+    Args:
+        args (obj): The parsed CLI options.
+        span (Tuple[int]): The start and end offset of the range.
+        state (dict): Content attributes learned from the first range.
+        kwargs (dict): Keyword arguments passed to `read_csv`.
+
+    Returns:
+        (List[Transaction]): the transactions
+    """
+    cont = get_content(args, load_mapping(args))
+    vars(cont).update(state)
+    records = read_range(args.source, span, args.encoding, **kwargs)
+    return prepare(cont, records)
+
+
+def gen_prepared(args, spans, state, jobs, **kwargs):
+    """Generates the prepared transactions of each range, in file order
+
+    At most two ranges per worker are in flight so memory use stays bounded.
+    """
+    executor = ProcessPoolExecutor(jobs)
+    pending = deque()
+
+    try:
+        for span in spans:
+            future = executor.submit(prepare_range, args, span, state, **kwargs)
+            pending.append(future)
+
+            if len(pending) > 2 * jobs:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def read_parallel(args, cont, ckwargs, head_size=None, range_size=None):
+    """Reads the transactions of a csv file with a pool of worker processes
+
+    Args:
+        args (obj): The parsed CLI options.
+        cont (obj): The OFX or QIF content object.
+        ckwargs (dict): Keyword arguments passed to `read_csv`.
+        head_size (int): Size of the first range (default: `HEAD_SIZE`).
+        range_size (int): Size of the other ranges (default: `RANGE_SIZE`).
+
+    Returns:
+        (Iter[Transaction]): the transactions, or None if the file can't be
+            split (e.g., it is compressed, too small, or rows or columns are
+            skipped), in which case it should be read serially.
+    """
+    jobs = args.jobs or os.cpu_count() or 1
+    skips = (ckwargs["first_row"], ckwargs["last_row"], ckwargs["first_col"])
+
+    if jobs < 2 or skips != (0, inf, 0) or not is_mappable(args.source, args.encoding):
+        return None
+
+    with MappedSource(args.source, args.encoding) as source:
+        sizes = (head_size or HEAD_SIZE, range_size or RANGE_SIZE)
+        spans = list(gen_ranges(source.data, *sizes))
+        first_line = source.data[: source.data.find(b"\n") + 1 or source.size]
+
+    if len(spans) < 2:
+        return None
+
+    line = first_line.decode(args.encoding)
+    header = get_header(line, **ckwargs)
+    rkwargs = {**ckwargs, "has_header": False, "custom_header": header}
+    head, spans = [], iter(spans)
+
+    try:
+        records = read_range(args.source, next(spans), args.encoding, **ckwargs)
+        head.extend(prepare(cont, records))
+
+        # keep reading until the formats are learned so the workers share them
+        while not cont.settled:
+            span = next(spans, None)
+
+            if span is None:
+                return iter(head)
+
+            records = read_range(args.source, span, args.encoding, **rkwargs)
+            head.extend(prepare(cont, records))
+    except (csv.Error, OSError, ValueError):
+        # e.g., an encoding problem which the serial reader can recover from
+        return None
+
+    state = {attr: getattr(cont, attr) for attr in STATE_ATTRS}
+    rest = gen_prepared(args, spans, state, jobs, **rkwargs)
+    return it.chain(head, rest)
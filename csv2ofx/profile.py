@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+csv2ofx.profile
+~~~~~~~~~~~~~~~
+
+Provides a profiler for the stages of the (lazy) conversion pipeline
+
+Examples:
+    literal blocks::
+
+        csv2ofx --profile json file.csv file.ofx
+
+Attributes:
+    STAGES (list): The conversion pipeline stages, in order.
+    COUNTERS (list): The profiler counters, in order.
+"""
+
+import json
+import time
+from collections import Counter
+
+STAGES = ["read", "group", "trxns", "clean", "data", "body", "write"]
+COUNTERS = [
+    "rows_read",
+    "filtered",
+    "out_of_range",
+    "groups",
+    "transactions",
+    "splits",
+    "bytes_written",
+]
+
+
+def no_wrap(name, iterable, counter=None):  # pylint: disable=unused-argument
+    """Stands in for `Profiler.wrap` when not profiling"""
+    return iterable
+
+
+class Profiler:
+    """Measures the wall and CPU time spent in each stage of the pipeline,
+    along with the number of rows read, dropped, grouped, and emitted
+
+    The time of each stage excludes the time spent pulling items from the
+    stages it wraps. The `write` stage gets whatever time is left.
+
+    Args:
+        cont (obj): The OFX or QIF content object (optional). Its `filter` and
+            `in_range` methods are wrapped to count the dropped transactions.
+
+    Examples:
+        >>> profiler = Profiler()
+        >>> rows = profiler.wrap('read', range(3), profiler.count('rows_read'))
+        >>> doubled = profiler.wrap('body', (n * 2 for n in rows))
+        >>> list(doubled)
+        [0, 2, 4]
+        >>> profiler.counts['rows_read']
+        3
+        >>> report = profiler.report()
+        >>> sorted(report['stages'])
+        ['body', 'read', 'write']
+    """
+
+    def __init__(self, cont=None):
+        self.wall = Counter()
+        self.cpu = Counter()
+        self.counts = Counter(dict.fromkeys(COUNTERS, 0))
+        self.nested = []
+        self.started = (time.perf_counter(), time.process_time())
+        self.stopped = None
+        self.is_split = getattr(cont, "is_split", False)
+        split_accounts = ("split_account", "inv_split_account")
+        self.has_split_account = any(getattr(cont, a, None) for a in split_accounts)
+
+        if cont is not None:
+            cont.filter = self.count_drops(cont.filter, "filtered")
+            cont.in_range = self.count_drops(cont.in_range, "out_of_range")
+
+    def count(self, name):
+        """Gets a counter function which adds one per item"""
+        counts = self.counts
+
+        def counter(item):  # pylint: disable=unused-argument
+            counts[name] += 1
+
+        return counter
+
+    def count_data(self, datum):
+        """Counts the transactions (and splits) passed on to `gen_body`"""
+        self.counts["transactions"] += 1
+
+        # mirrors when `gen_body` emits `split_content`
+        if self.has_split_account or (self.is_split and not datum["is_main"]):
+            self.counts["splits"] += 1
+
+    def count_bytes(self, content, encoding="utf-8"):
+        """Counts the bytes of the encoded content as it is written
+
+        Args:
+            content (Iter[str]): The rendered content.
+            encoding (str): The output encoding.
+
+        Yields:
+            (str): the content
+
+        Examples:
+            >>> profiler = Profiler()
+            >>> ''.join(profiler.count_bytes(['caf', 'é']))
+            'café'
+            >>> profiler.counts['bytes_written']
+            5
+        """
+        counts = self.counts
+
+        for chunk in content:
+            counts["bytes_written"] += len(chunk.encode(encoding))
+            yield chunk
+
+    def count_drops(self, func, name):
+        """Wraps a transaction filter to count the transactions it drops"""
+        counts = self.counts
+
+        def wrapper(trxn):
+            kept = func(trxn)
+
+            if not kept:
+                counts[name] += 1
+
+            return kept
+
+        return wrapper
+
+    def wrap(self, name, iterable, counter=None):
+        """Times a pipeline stage
+
+        Args:
+            name (str): The stage name.
+            iterable (Iter): The stage.
+            counter (func): Called with each item of the stage (optional).
+
+        Yields:
+            the stage items
+        """
+        iterator = iter(iterable)
+        wall, cpu, nested = self.wall, self.cpu, self.nested
+        perf_counter, process_time = time.perf_counter, time.process_time
+
+        while True:
+            nested.append([0.0, 0.0])
+            start, start_cpu = perf_counter(), process_time()
+
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed = perf_counter() - start
+                elapsed_cpu = process_time() - start_cpu
+                inner, inner_cpu = nested.pop()
+                wall[name] += elapsed - inner
+                cpu[name] += elapsed_cpu - inner_cpu
+
+                if nested:
+                    nested[-1][0] += elapsed
+                    nested[-1][1] += elapsed_cpu
+
+            if counter:
+                counter(item)
+
+            yield item
+
+    def stop(self):
+        """Stops the profiler clock"""
+        self.stopped = (time.perf_counter(), time.process_time())
+
+    def report(self):
+        """Gets the profile
+
+        Returns:
+            (dict): The `wall` and `cpu` seconds in total and per stage, along
+                with the counters.
+        """
+        stopped = self.stopped or (time.perf_counter(), time.process_time())
+        wall, cpu = (end - start for start, end in zip(self.started, stopped))
+        names = [name for name in STAGES if name in self.wall]
+        stages = {
+            name: {"wall": self.wall[name], "cpu": self.cpu[name]} for name in names
+        }
+        stages["write"] = {
+            "wall": wall - sum(self.wall.values()),
+            "cpu": cpu - sum(self.cpu.values()),
+        }
+
+        return {
+            "wall": wall,
+            "cpu": cpu,
+            "stages": stages,
+            "counts": dict(self.counts),
+        }
+
+    def format(self, fmt="text"):
+        """Formats the profile
+
+        Args:
+            fmt (str): Either 'text' or 'json' (default: 'text').
+
+        Returns:
+            (str): the formatted profile
+
+        Examples:
+            >>> profiler = Profiler()
+            >>> print(profiler.format())  # doctest: +ELLIPSIS
+            stage       wall (s)    cpu (s)
+            write          0.000      0.000
+            total          0.000      0.000
+            rows_read           0
+            ...
+            bytes_written       0
+        """
+        report = self.report()
+
+        if fmt == "json":
+            return json.dumps(report)
+
+        lines = [f"{'stage':<8}{'wall (s)':>12}{'cpu (s)':>11}"]
+
+        for name, times in report["stages"].items():
+            lines.append(f"{name:<8}{times['wall']:>12.3f}{times['cpu']:>11.3f}")
+
+        lines.append(f"{'total':<8}{report['wall']:>12.3f}{report['cpu']:>11.3f}")
+        lines.extend(f"{name:<14}{num:>7}" for name, num in report["counts"].items())
+        return "\n".join(lines)
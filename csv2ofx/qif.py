@@ -17,10 +17,8 @@ Attributes:
     ENCODING (str): Default file encoding.
 """
 
-from meza.fntools import chunk
-from meza.process import group
-
-from . import Content, utils
+from . import BLOCK_SIZE, Content, utils
+from .grouping import group_hashed, group_presorted, group_records
 
 DEF_DATE_FMT = "%m/%d/%Y"
 
@@ -49,8 +47,6 @@ class QIF(Content):
 
         super().__init__(mapping, date_fmt=date_fmt, **kwargs)
         self.def_type = kwargs.get("def_type")
-        self.prev_account = None
-        self.prev_group = None
         self.account_types = {
             "Invst": ("roth", "ira", "401k", "vanguard"),
             "Bank": ("checking", "savings", "market", "income"),
@@ -59,16 +55,23 @@ class QIF(Content):
             "CCard": ("visa", "master", "express", "discover", "platinum"),
             "Cash": ("cash", "expenses"),
         }
+        self.classify_account = utils.Classifier(self.account_types, self.def_type)
+
+    def init_context(self):
+        """Sets up the state of a single conversion (see `Content.context`)"""
+        super().init_context()
+        self.prev_account = None
+        self.prev_group = None
 
     def header(self, **kwargs):  # pylint: disable=unused-argument
         """Get the QIF header"""
         return None
 
-    def transaction_data(self, tr):
-        """gets QIF transaction data
+    def format_data(self, data):
+        """Adds the QIF specific transaction data
 
         Args:
-            tr (dict): the transaction
+            data (dict): the transaction data
 
         Returns:
             (dict): the QIF transaction data
@@ -101,8 +104,6 @@ class QIF(Content):
             ...     'balance': None}
             True
         """
-        data = super().transaction_data(tr)
-        args = [self.account_types, self.def_type]
         memo = data.get("memo")
         _class = data.get("class")
 
@@ -112,7 +113,7 @@ class QIF(Content):
             split_memo = memo or _class
 
         new_data = {
-            "account_type": utils.get_account_type(data["account"], *args),
+            "account_type": self.classify_account(data["account"]),
             "split_memo": split_memo,
         }
 
@@ -140,7 +141,7 @@ class QIF(Content):
             >>> start == result.replace('\\n', '').replace('\\t', '')
             True
         """
-        return "!Account\nN{account}\nT{account_type}\n^\n".format(**kwargs)
+        return f"!Account\nN{kwargs['account']}\nT{kwargs['account_type']}\n^\n"
 
     def transaction_start(self, account_type=None, **kwargs):
         """Gets QIF format transaction start content
@@ -192,41 +193,40 @@ class QIF(Content):
             True
         """
         date_fmt = kwargs.get("date_fmt", self.date_fmt)
-        kwargs.update({"time_stamp": kwargs["date"].strftime(date_fmt)})
+        time_stamp = kwargs["date"].strftime(date_fmt)
         is_investment = kwargs.get("is_investment")
-        is_transaction = not is_investment
-
-        if self.is_split:
-            kwargs.update({"amount": kwargs["amount"] * -1})
+        amount = kwargs["amount"] * -1 if self.is_split else kwargs["amount"]
+        check_num = kwargs.get("check_num")
+        memo = kwargs.get("memo")
 
-        if is_transaction and kwargs.get("check_num"):
-            content = "N{check_num}\n".format(**kwargs)
-        else:
-            content = ""
-
-        content += "D{time_stamp}\n".format(**kwargs)
+        # Each optional field renders to either a full line or nothing, so
+        # every record shape is built by the single template below.
+        num_line = f"N{check_num}\n" if check_num and not is_investment else ""
+        memo_line = f"M{memo}\n" if memo else ""
 
         if is_investment:
             if kwargs.get("inv_split_account"):
-                content += "N{x_action}\n".format(**kwargs)
+                action = kwargs["x_action"]
             else:
-                content += "N{action}\n".format(**kwargs)
-
-            content += "Y{symbol}\n".format(**kwargs)
-            content += "I{price}\n".format(**kwargs)
-            content += "Q{shares}\n".format(**kwargs)
-            content += "Cc\n"
+                action = kwargs["action"]
+
+            commission = kwargs.get("commission")
+            details = (
+                f"N{action}\n"
+                f"Y{kwargs['symbol']}\n"
+                f"I{kwargs['price']}\n"
+                f"Q{kwargs['shares']}\n"
+                "Cc\n"
+            )
+            extra = f"O{commission}\n" if commission else ""
         else:
-            content += "P{payee}\n".format(**kwargs) if kwargs.get("payee") else ""
-            content += "L{class}\n".format(**kwargs) if kwargs.get("class") else ""
+            payee = kwargs.get("payee")
+            _class = kwargs.get("class")
+            payee_line = f"P{payee}\n" if payee else ""
+            details = f"{payee_line}L{_class}\n" if _class else payee_line
+            extra = ""
 
-        content += "M{memo}\n".format(**kwargs) if kwargs.get("memo") else ""
-
-        if is_investment and kwargs.get("commission"):
-            content += "O{commission}\n".format(**kwargs)
-
-        content += "T{amount:0.2f}\n".format(**kwargs)
-        return content
+        return f"{num_line}D{time_stamp}\n{details}{memo_line}{extra}T{amount:0.2f}\n"
 
     def split_content(self, **kwargs):
         """Gets QIF format split content
@@ -259,24 +259,21 @@ class QIF(Content):
             True
         """
         is_investment = kwargs.get("is_investment")
-        is_transaction = not is_investment
 
         if is_investment and kwargs.get("inv_split_account"):
-            content = "L{inv_split_account}\n".format(**kwargs)
+            line = f"L{kwargs['inv_split_account']}\n"
         elif is_investment and self.is_split:
-            content = "L{account}\n".format(**kwargs)
-        elif is_transaction and kwargs.get("split_account"):
-            content = "S{split_account}\n".format(**kwargs)
-        elif is_transaction:
-            content = "S{account}\n".format(**kwargs)
+            line = f"L{kwargs['account']}\n"
+        elif is_investment:
+            return ""
+        elif kwargs.get("split_account"):
+            line = f"S{kwargs['split_account']}\n"
         else:
-            content = ""
-
-        if content and kwargs.get("split_memo"):
-            content += "E{split_memo}\n".format(**kwargs)
+            line = f"S{kwargs['account']}\n"
 
-        content += "${amount:0.2f}\n".format(**kwargs) if content else ""
-        return content
+        split_memo = kwargs.get("split_memo")
+        memo_line = f"E{split_memo}\n" if split_memo else ""
+        return f"{line}{memo_line}${kwargs['amount']:0.2f}\n"
 
     def transaction_end(self):
         """Gets QIF transaction end
@@ -304,36 +301,62 @@ class QIF(Content):
         return self.transaction_end() if self.is_split else ""
 
     def gen_body(self, data):
-        """Generate the QIF body"""
+        """Generate the QIF body
+
+        Rendered records are appended to a shared buffer which is yielded in
+        blocks of `BLOCK_SIZE` records rather than one string at a time.
+        """
         split_account = self.split_account or self.inv_split_account
+        block = []
+        emit = block.append
 
         for datum in data:
-            trxn_data = self.transaction_data(datum["trxn"])
+            trxn_data = self.get_data(datum["trxn"])
             account = self.account(datum["trxn"])
             grp = datum["group"]
 
             if self.prev_group and self.prev_group != grp and self.is_split:
-                yield self.transaction_end()
+                emit(self.transaction_end())
 
             if datum["is_main"] and self.prev_account != account:
-                yield self.account_start(**trxn_data)
-                yield self.transaction_start(**trxn_data)
+                emit(self.account_start(**trxn_data))
+                emit(self.transaction_start(**trxn_data))
 
             if (self.is_split and datum["is_main"]) or not self.is_split:
-                yield self.transaction(**trxn_data)
+                emit(self.transaction(**trxn_data))
                 self.prev_account = account
 
             if (self.is_split and not datum["is_main"]) or split_account:
-                yield self.split_content(**trxn_data)
+                emit(self.split_content(**trxn_data))
 
             if not self.is_split:
-                yield self.transaction_end()
+                emit(self.transaction_end())
 
             self.prev_group = grp
 
-    def gen_groups(self, records, chunksize=None):
-        """Generate the QIF groups"""
-        for chnk in chunk(records, chunksize):
-            keyfunc = self.id if self.is_split else self.account
+            if len(block) >= BLOCK_SIZE:
+                yield "".join(block)
+                block.clear()
 
-            yield from group(chnk, keyfunc)
+        if block:
+            yield "".join(block)
+
+    def gen_groups(self, records, chunksize=None, presorted=False, order="sorted"):
+        """Generate the QIF groups
+
+        Each account (or split `id`) forms exactly one group. Groups are
+        `sorted` by key or kept in `appearance` order. At most `chunksize`
+        records are held in memory while grouping, the rest are spilled to
+        temporary files (see `csv2ofx.grouping`). If `presorted`, the records
+        must already be contiguous by group and are streamed as is.
+        """
+        keyfunc = self.id if self.is_split else self.account
+        trxns = self.gen_records(records)
+        lazy = not self.is_split
+
+        if presorted:
+            yield from group_presorted(trxns, keyfunc, lazy=lazy)
+        elif order == "appearance":
+            yield from group_hashed(trxns, keyfunc, chunksize, lazy=lazy)
+        else:
+            yield from group_records(trxns, keyfunc, chunksize, lazy=lazy)
@@ -0,0 +1,645 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+csv2ofx.serve
+~~~~~~~~~~~~~
+
+Provides a local (loopback only) HTTP conversion server built on asyncio
+
+A csv file `POST`ed (or `PUT`) to `/convert` is converted with the mapping and options
+given as query parameters (named after the CLI options), and the OFX or QIF
+content is streamed back with chunked transfer encoding as it is produced.
+`GET /mappings` lists the available mappings.
+
+Each conversion runs in a bounded pool of worker threads which read the upload
+as it arrives and hand the content back through a small queue. A slow client
+therefore stalls its worker (backpressure) rather than buffering the output in
+memory. At most `--jobs` conversions run at once, and at most `--queue-depth`
+requests wait for a worker; further requests are answered with
+`503 Service Unavailable`.
+
+Conversions are pure Python, so the worker threads take turns holding the GIL
+(along with the event loop). More than one job only lets a conversion proceed
+while another waits on its client, so the pool defaults to a single worker.
+Use `csv2ofx --batch` (which runs worker processes) to convert many files on
+several cores.
+
+Errors raised before the first `BUFFER_SIZE` bytes of content are sent are
+answered with an error status and message. Later errors (e.g., a bad value in
+the middle of a presorted file) abort the response, i.e., the connection is
+closed without the final (empty) chunk.
+
+Examples:
+    literal blocks::
+
+        csv2ofx serve --port 8000 --jobs 2
+        curl -T transactions.csv 'localhost:8000/convert?mapping=mint&qif'
+
+Attributes:
+    HOST (str): The address the server listens on.
+    BUFFER_SIZE (int): Number of content bytes buffered before the response
+        status is sent.
+    PIPE_SIZE (int): Number of content chunks a worker may get ahead of the
+        client.
+    FLAGS (set): The boolean query parameters.
+    OPTIONS (dict): The other query parameters and their types.
+"""
+
+import asyncio
+import codecs
+import io
+import json
+import sys
+import traceback
+from argparse import ArgumentParser
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from contextlib import suppress
+from functools import lru_cache, partial
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+from dateutil.parser import parse
+
+from . import ConversionError, NoDataError, api, utils
+from .main import MODULES, TYPES, load_package_module
+
+HOST = "127.0.0.1"
+BUFFER_SIZE = 2**14
+PIPE_SIZE = 4
+
+FLAGS = {"qif", "ms_money", "dayfirst", "infer_dates", "presorted"}
+OPTIONS = {
+    "mapping": str,
+    "account": str,
+    "start": str,
+    "end": str,
+    "fitid_hash": str,
+    "collapse": str,
+    "group_order": str,
+    "first_row": int,
+    "last_row": int,
+    "first_col": int,
+    "server_date": str,
+    "language": str,
+    "ending_balance": float,
+    "encoding": str,
+}
+
+CHOICES = {
+    "mapping": MODULES,
+    "account": TYPES,
+    "fitid_hash": utils.FITID_HASHES,
+    "group_order": ["sorted", "appearance"],
+}
+
+MEDIA_TYPES = {False: "application/x-ofx", True: "application/qif"}
+
+server_parser = ArgumentParser(  # pylint: disable=invalid-name
+    description="description: serves csv2ofx conversions over HTTP on localhost",
+    prog="csv2ofx serve",
+)
+server_parser.add_argument(
+    "-p", "--port", type=int, default=8000, help="the port (default: 8000)"
+)
+server_parser.add_argument(
+    "-j",
+    "--jobs",
+    metavar="NUM",
+    type=int,
+    default=1,
+    help=(
+        "number of conversions run at once (default: 1); they run in threads "
+        "which share a single core (the GIL), so more jobs only help with slow "
+        "clients"
+    ),
+)
+server_parser.add_argument(
+    "-Q",
+    "--queue-depth",
+    metavar="NUM",
+    type=int,
+    default=32,
+    help="number of requests which may wait for a worker (default: 32)",
+)
+server_parser.add_argument(
+    "-C",
+    "--chunksize",
+    metavar="ROWS",
+    type=int,
+    default=2**14,
+    help="number of rows each conversion groups in memory before spilling to disk (default: 2 ** 14)",
+)
+server_parser.add_argument(
+    "-T",
+    "--timeout",
+    metavar="SECONDS",
+    type=float,
+    default=60,
+    help="time to wait for the client to send more data (default: 60)",
+)
+
+
+class RequestError(Exception):
+    """A request the server can't serve"""
+
+    def __init__(self, status, message=None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+def is_set(value):
+    """Determines whether a flag query parameter is set
+
+    Examples:
+        >>> is_set(''), is_set('1'), is_set('no'), is_set('False')
+        (True, True, False, False)
+    """
+    return value.lower() not in {"0", "false", "no", "off"}
+
+
+def parse_options(query):
+    """Parses the conversion options of a query string
+
+    Args:
+        query (str): The query string.
+
+    Returns:
+        (dict): the options (flags default to False, the rest to None)
+
+    Raises:
+        RequestError: If an option is unknown or invalid.
+
+    Examples:
+        >>> options = parse_options('mapping=mint&qif&start=2015-06-13')
+        >>> options['mapping'], options['qif'], options['start']
+        ('mint', True, '2015-06-13')
+        >>> options['ms_money'], options['end']
+        (False, None)
+        >>> parse_options('mapping=nope')
+        Traceback (most recent call last):
+        ...
+        csv2ofx.serve.RequestError: Invalid mapping: 'nope'
+        >>> parse_options('first-row=x')
+        Traceback (most recent call last):
+        ...
+        csv2ofx.serve.RequestError: Invalid first_row: 'x'
+    """
+    options = dict.fromkeys(FLAGS, False)
+    options.update(dict.fromkeys(OPTIONS))
+    options["mapping"] = "default"
+
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        name = key.replace("-", "_")
+        invalid = RequestError(HTTPStatus.BAD_REQUEST, f"Invalid {name}: {value!r}")
+
+        if name in FLAGS:
+            options[name] = is_set(value)
+        elif name in OPTIONS:
+            try:
+                options[name] = OPTIONS[name](value)
+            except ValueError as err:
+                raise invalid from err
+
+            if value not in CHOICES.get(name, [value]):
+                raise invalid
+        else:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Unknown option: {key!r}")
+
+    try:
+        codecs.lookup(options["encoding"] or "utf-8")
+
+        if options["server_date"]:
+            options["server_date"] = parse(
+                options["server_date"], dayfirst=options["dayfirst"]
+            )
+    except (LookupError, ValueError) as err:
+        raise RequestError(HTTPStatus.BAD_REQUEST, str(err)) from err
+
+    return options
+
+
+@lru_cache(maxsize=64)
+def get_converter(mapping, qif=False, **kwargs):
+    """Gets a configured OFX or QIF object, shared by every conversion with
+    the same options (see `Content.context`)
+
+    Args:
+        mapping (str): The mapping name.
+        qif (bool): Create QIF (rather than OFX) content.
+        kwargs (dict): Keyword arguments passed to `api.get_content`.
+
+    Returns:
+        (obj): the OFX or QIF content object
+
+    Examples:
+        >>> get_converter('mint', qif=True) is get_converter('mint', qif=True)
+        True
+    """
+    module = load_package_module(mapping)
+    return api.get_content(module.mapping, qif=qif, **kwargs)
+
+
+def run_threadsafe(coro, loop):
+    """Runs a coroutine on the event loop from a worker thread and waits for
+    the result
+
+    Raises:
+        ConnectionAbortedError: If the event loop is closed (or the coroutine
+            is cancelled) meanwhile.
+    """
+    try:
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+    except RuntimeError as err:
+        coro.close()
+        raise ConnectionAbortedError() from err
+
+    try:
+        return future.result()
+    except CancelledError as err:
+        raise ConnectionAbortedError() from err
+
+
+class Body:
+    """The body of a request, decoded as it is read
+
+    Args:
+        reader (obj): The `asyncio.StreamReader` of the connection.
+        headers (dict): The request headers (with lower case names).
+        timeout (float): Time to wait for the client to send more data.
+    """
+
+    def __init__(self, reader, headers, timeout=None):
+        self.reader = reader
+        self.timeout = timeout
+        self.chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+        self.remaining = 0 if self.chunked else int(headers["content-length"])
+        self.done = not (self.chunked or self.remaining)
+
+    async def receive(self, coro):
+        return await asyncio.wait_for(coro, self.timeout)
+
+    async def read(self, size):
+        """Reads up to `size` bytes (an empty result marks the end)"""
+        if self.chunked and not (self.remaining or self.done):
+            line = await self.receive(self.reader.readline())
+            self.remaining = int(line.split(b";")[0], 16)
+
+            if not self.remaining:
+                # skip any trailers
+                while line.strip():
+                    line = await self.receive(self.reader.readline())
+
+                self.done = True
+
+        if self.done:
+            return b""
+
+        data = await self.receive(self.reader.read(min(size, self.remaining)))
+        self.remaining -= len(data)
+
+        if not data:
+            self.done = True
+        elif self.chunked and not self.remaining:
+            await self.receive(self.reader.readline())
+        elif not self.remaining:
+            self.done = True
+
+        return data
+
+
+class BodyStream(io.RawIOBase):
+    """A (blocking) file like view of a request `Body` for worker threads"""
+
+    def __init__(self, body, loop):
+        self.body = body
+        self.loop = loop
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = run_threadsafe(self.body.read(len(buffer)), self.loop)
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class Pipe:
+    """A bounded queue carrying content from a worker thread to the event loop
+
+    `put` blocks the worker while the queue is full, and raises
+    `ConnectionAbortedError` once the consumer has gone away.
+    """
+
+    def __init__(self, loop, maxsize=PIPE_SIZE):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.closed = False
+
+    def put(self, item):
+        if self.closed:
+            raise ConnectionAbortedError()
+
+        run_threadsafe(self.queue.put(item), self.loop)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        """Stops the worker (after it puts at most one more item)"""
+        self.closed = True
+
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+def produce(pipe, source, cont, encoding, **kwargs):
+    """Converts a source in a worker thread and puts the encoded content
+    chunks into a `Pipe`, followed by None (or the error raised)"""
+    try:
+        for chunk in api.convert(source, cont, **kwargs):
+            pipe.put(chunk.encode(encoding))
+    except ConnectionAbortedError:
+        return
+    except (ConversionError, asyncio.TimeoutError) as err:
+        pipe.put(err)
+    except Exception as err:  # pylint: disable=broad-except
+        # report the bug, but still end the response
+        traceback.print_exc()
+        pipe.put(err)
+    else:
+        pipe.put(None)
+    finally:
+        source.close()
+
+
+def get_status(err):
+    """Gets the HTTP status and message of a conversion error
+
+    Examples:
+        >>> get_status(NoDataError())
+        (<HTTPStatus.UNPROCESSABLE_ENTITY: 422>, 'No data to write')
+    """
+    if isinstance(err, RequestError):
+        return err.status, str(err)
+    elif isinstance(err, asyncio.TimeoutError):
+        return HTTPStatus.REQUEST_TIMEOUT, HTTPStatus.REQUEST_TIMEOUT.phrase
+    elif isinstance(err, NoDataError):
+        return HTTPStatus.UNPROCESSABLE_ENTITY, str(err) or "No data to write"
+    elif isinstance(err, ConversionError):
+        return HTTPStatus.UNPROCESSABLE_ENTITY, str(err)
+    else:
+        status = HTTPStatus.INTERNAL_SERVER_ERROR
+        return status, status.phrase
+
+
+def format_head(status, content_type="text/plain; charset=utf-8", **headers):
+    """Formats the status line and headers of a response
+
+    Examples:
+        >>> format_head(HTTPStatus.OK, content_length=2)
+        b'HTTP/1.1 200 OK\\r\\nContent-Type: text/plain; charset=utf-8\\r\\nContent-Length: 2\\r\\nConnection: close\\r\\n\\r\\n'
+    """
+    headers = {"content_type": content_type, **headers, "connection": "close"}
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+    lines.extend(f"{k.replace('_', '-').title()}: {v}" for k, v in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def format_chunk(data):
+    """Formats data with chunked transfer encoding
+
+    Examples:
+        >>> format_chunk(b'hello'), format_chunk(b'')
+        (b'5\\r\\nhello\\r\\n', b'0\\r\\n\\r\\n')
+    """
+    return b"%X\r\n%s\r\n" % (len(data), data)
+
+
+class Server:
+    """A conversion server
+
+    Args:
+        jobs (int): Number of conversions run at once (default: 1).
+        queue_depth (int): Number of requests which may wait for a worker.
+        chunksize (int): Number of rows each conversion groups in memory.
+        timeout (float): Time to wait for the client to send more data.
+    """
+
+    def __init__(self, jobs=1, queue_depth=32, chunksize=2**14, timeout=60):
+        self.jobs = jobs or 1
+        self.queue_depth = queue_depth
+        self.chunksize = chunksize
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(self.jobs, thread_name_prefix="csv2ofx")
+        self.slots = asyncio.Semaphore(self.jobs)
+        self.waiting = 0
+
+    async def start(self, port=8000):
+        """Starts listening on `HOST`
+
+        Returns:
+            (obj): the `asyncio.Server`
+        """
+        return await asyncio.start_server(self.handle, HOST, port)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def read_head(self, reader):
+        """Reads the request line and headers"""
+        line = await asyncio.wait_for(reader.readline(), self.timeout)
+
+        try:
+            method, target, _ = line.decode("latin-1").split()
+        except ValueError as err:
+            raise RequestError(HTTPStatus.BAD_REQUEST) from err
+
+        headers = {}
+
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+
+            if not line.strip():
+                break
+
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        return method, urlsplit(target), headers
+
+    async def handle(self, reader, writer):
+        """Serves a single request (per connection)"""
+        try:
+            method, url, headers = await self.read_head(reader)
+
+            if url.path == "/mappings" and method == "GET":
+                content = json.dumps(MODULES).encode("utf-8")
+                ctype = "application/json"
+                writer.write(
+                    format_head(HTTPStatus.OK, ctype, content_length=len(content))
+                )
+                writer.write(content)
+            elif url.path == "/convert" and method in {"POST", "PUT"}:
+                await self.admit(reader, writer, url, headers)
+            elif url.path in {"/convert", "/mappings"}:
+                raise RequestError(HTTPStatus.METHOD_NOT_ALLOWED)
+            else:
+                raise RequestError(HTTPStatus.NOT_FOUND)
+        except (RequestError, asyncio.TimeoutError) as err:
+            await self.send_error(writer, err)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+            with suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def send_error(self, writer, err):
+        status, message = get_status(err)
+        content = f"{message}\n".encode()
+        writer.write(format_head(status, content_length=len(content)))
+        writer.write(content)
+
+        with suppress(ConnectionError):
+            await writer.drain()
+
+    async def admit(self, reader, writer, url, headers):
+        """Waits for a worker (if the queue isn't full) and converts"""
+        options = parse_options(url.query)
+
+        if not ("content-length" in headers or "transfer-encoding" in headers):
+            raise RequestError(HTTPStatus.LENGTH_REQUIRED)
+
+        if self.slots.locked() and self.waiting >= self.queue_depth:
+            raise RequestError(HTTPStatus.SERVICE_UNAVAILABLE, "Too many requests")
+
+        self.waiting += 1
+
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        try:
+            await self.convert(reader, writer, options, headers)
+        finally:
+            self.slots.release()
+
+    async def convert(self, reader, writer, options, headers):
+        """Converts a request body and streams back the content"""
+        encoding = options["encoding"] or "utf-8"
+        ckwargs = {
+            "account_type": options["account"],
+            "start": options["start"],
+            "end": options["end"],
+            "dayfirst": options["dayfirst"],
+            "ms_money": options["ms_money"],
+            "infer_fmt": options["infer_dates"],
+            "fitid_hash": options["fitid_hash"],
+        }
+
+        try:
+            cont = get_converter(options["mapping"], options["qif"], **ckwargs)
+        except ValueError as err:
+            raise RequestError(HTTPStatus.BAD_REQUEST, str(err)) from err
+
+        if headers.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        try:
+            body = Body(reader, headers, self.timeout)
+        except ValueError as err:
+            raise RequestError(HTTPStatus.BAD_REQUEST) from err
+
+        loop = asyncio.get_running_loop()
+        pipe = Pipe(loop)
+        stream = io.BufferedReader(BodyStream(body, loop))
+        source = io.TextIOWrapper(stream, encoding=encoding, newline="")
+        names = ["collapse", "presorted", "group_order", "server_date", "language"]
+        names += ["ending_balance", "first_row", "last_row", "first_col"]
+        kwargs = {name: options[name] for name in names if options[name] is not None}
+        kwargs["chunksize"] = self.chunksize
+        func = partial(produce, pipe, source, cont, encoding, **kwargs)
+        worker = loop.run_in_executor(self.executor, func)
+
+        try:
+            await self.respond(writer, pipe, MEDIA_TYPES[options["qif"]], encoding)
+        finally:
+            pipe.close()
+
+            # let the worker finish before its slot is released
+            with suppress(Exception):
+                await worker
+
+    async def respond(self, writer, pipe, media_type, encoding):
+        """Sends the content of a `Pipe` with chunked transfer encoding"""
+        buffered, size, item = [], 0, b""
+
+        # hold back the status until there is enough content (or an error)
+        while item is not None and size < BUFFER_SIZE:
+            item = await pipe.get()
+
+            if isinstance(item, Exception):
+                await self.send_error(writer, item)
+                return
+            elif item:
+                buffered.append(item)
+                size += len(item)
+
+        content_type = f"{media_type}; charset={encoding}"
+        writer.write(
+            format_head(HTTPStatus.OK, content_type, transfer_encoding="chunked")
+        )
+        writer.write(format_chunk(b"".join(buffered)))
+
+        while item is not None:
+            await writer.drain()
+            item = await pipe.get()
+
+            if isinstance(item, Exception):
+                return
+            elif item:
+                writer.write(format_chunk(item))
+
+        writer.write(format_chunk(b""))
+        await writer.drain()
+
+
+async def serve(port=8000, **kwargs):
+    """Runs a conversion server until cancelled
+
+    Args:
+        port (int): The port.
+        kwargs (dict): Keyword arguments passed to `Server`.
+    """
+    server = Server(**kwargs)
+    listener = await server.start(port)
+    print(f"Serving on http://{HOST}:{port}", file=sys.stderr)
+
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+def run_server(args=None):
+    """Parses the `serve` CLI options and runs the server
+
+    Returns:
+        (int): the exit status
+    """
+    args = server_parser.parse_args(args)
+    kwargs = {
+        "jobs": args.jobs,
+        "queue_depth": args.queue_depth,
+        "chunksize": args.chunksize,
+        "timeout": args.timeout,
+    }
+
+    with suppress(KeyboardInterrupt):
+        asyncio.run(serve(args.port, **kwargs))
+
+    return 0
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+csv2ofx.sink
+~~~~~~~~~~~~
+
+Provides a writer which encodes and writes content in large blocks
+
+Content chunks are joined into blocks of (at least) `buffer_size` characters.
+Each block is encoded once and handed to the binary layer of the file in a
+single call, bypassing the text layer (and its own buffering), so a block is
+usually written with a single system call.
+
+Examples:
+    literal blocks::
+
+        from csv2ofx.sink import BlockWriter
+
+        with open('out.ofx', 'wb') as f:
+            writer = BlockWriter(f, encoding='utf-8')
+            writer.writelines(content)
+            writer.close()
+
+Attributes:
+    BUFFER_SIZE (int): Default number of characters written at a time.
+"""
+
+import errno
+import io
+import os
+from codecs import getincrementalencoder
+
+BUFFER_SIZE = 2**16
+
+
+def is_binary(sink):
+    """Determines whether a file like object is opened in binary mode
+
+    Examples:
+        >>> is_binary(io.BytesIO()), is_binary(io.StringIO())
+        (True, False)
+    """
+    if isinstance(sink, (io.RawIOBase, io.BufferedIOBase)):
+        return True
+
+    return "b" in getattr(sink, "mode", "")
+
+
+class BlockWriter:
+    """Writes text to a file like object in large encoded blocks
+
+    Args:
+        sink (obj): The file like object (opened in text or binary mode).
+        encoding (str): The encoding of a binary `sink` (text files use their
+            own encoding).
+        errors (str): The encoding error policy of a binary `sink` (text files
+            use their own policy).
+        buffer_size (int): Number of characters written at a time (default:
+            `BUFFER_SIZE`).
+
+    Attributes:
+        written (int): Number of bytes written (characters if the `sink` is a
+            text file without a binary layer, e.g., `io.StringIO`).
+
+    Examples:
+        >>> f = io.BytesIO()
+        >>> writer = BlockWriter(f, buffer_size=5)
+        >>> writer.writelines(['caf', 'é', ' au ', 'lait'])
+        >>> f.getvalue()
+        b'caf\\xc3\\xa9 au '
+        >>> writer.close()
+        >>> f.getvalue().decode('utf-8')
+        'café au lait'
+        >>> writer.written
+        13
+        >>> f = io.BytesIO()
+        >>> writer = BlockWriter(f, 'utf-8-sig', buffer_size=1)
+        >>> writer.writelines(['a', 'b'])
+        >>> f.getvalue()
+        b'\\xef\\xbb\\xbfab'
+        >>> f = io.BytesIO()
+        >>> writer = BlockWriter(f, 'iso2022_jp')
+        >>> writer.write('日本')
+        >>> writer.close()
+        >>> f.getvalue()
+        b'\\x1b$BF|K\\\\\\x1b(B'
+        >>> f = io.StringIO()
+        >>> writer = BlockWriter(f)
+        >>> writer.write('café')
+        >>> writer.close()
+        >>> f.getvalue()
+        'café'
+    """
+
+    def __init__(self, sink, encoding="utf-8", errors="strict", buffer_size=None):
+        self.buffer_size = buffer_size or BUFFER_SIZE
+        self.pending = []
+        self.size = 0
+        self.written = 0
+        self.out = sink.write
+        self.encode = None
+        self.raw = isinstance(sink, io.RawIOBase)
+        binary = getattr(sink, "buffer", None)
+
+        # NOTE: The text layer translates newlines on Windows, so blocks are
+        # only written to its binary layer where there's nothing to translate.
+        if is_binary(sink):
+            self.encode = getincrementalencoder(encoding)(errors).encode
+        elif binary is not None and os.linesep == "\n":
+            # write anything already buffered by the text layer first
+            sink.flush()
+            self.out = binary.write
+            self.raw = isinstance(binary, io.RawIOBase)
+            encoder = getincrementalencoder(sink.encoding)(sink.errors)
+            self.encode = encoder.encode
+
+    def write(self, text):
+        """Adds text to the current block, writing it once it is full"""
+        self.pending.append(text)
+        self.size += len(text)
+
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def writelines(self, chunks):
+        """Adds each chunk to the current block, writing full blocks as they
+        fill up"""
+        pending, buffer_size = self.pending, self.buffer_size
+
+        for chunk in chunks:
+            pending.append(chunk)
+            self.size += len(chunk)
+
+            if self.size >= buffer_size:
+                self.flush()
+
+    def flush(self):
+        """Encodes and writes the current block"""
+        if not self.pending:
+            return
+
+        block = "".join(self.pending)
+        self.pending.clear()
+        self.size = 0
+
+        # an incremental encoder only writes a BOM (e.g., for `utf-8-sig`) once
+        if self.encode:
+            self.write_bytes(self.encode(block))
+        else:
+            self.out(block)
+            self.written += len(block)
+
+    def close(self):
+        """Writes the current block and whatever the encoder still holds
+        (e.g., the shift state of `iso2022_jp`). The sink is left open."""
+        self.flush()
+
+        if self.encode:
+            self.write_bytes(self.encode("", final=True))
+
+    def write_bytes(self, data):
+        """Writes all of the data (raw files and pipes may only take part of
+        it at a time)
+
+        Raises:
+            BlockingIOError: If the sink doesn't take any of the data (e.g., a
+                non blocking raw file).
+
+        Examples:
+            >>> class Full(io.RawIOBase):
+            ...     def writable(self):
+            ...         return True
+            ...
+            ...     def write(self, data):
+            ...         return None
+            >>> BlockWriter(Full()).write_bytes(b'abc')  # doctest: +ELLIPSIS
+            Traceback (most recent call last):
+            ...
+            BlockingIOError: [Errno ...] Sink would block
+        """
+        view = memoryview(data)
+
+        while view:
+            count = self.out(view)
+
+            # file likes which don't report what they wrote take everything,
+            # whereas raw files return None when they would block
+            if count is None and not self.raw:
+                count = len(view)
+
+            if not count:
+                written = len(data) - len(view)
+                self.written += written
+                raise BlockingIOError(errno.EAGAIN, "Sink would block", written)
+
+            view = view[count:]
+
+        self.written += len(data)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+csv2ofx.source
+~~~~~~~~~~~~~~
+
+Provides functions for opening csv sources
+
+Sources compressed with gzip, bzip2, or xz (judging by their file extension)
+are decompressed as they are read. Large uncompressed sources are memory
+mapped and decoded a block of lines at a time straight from the mapping (see
+`MappedSource`), which also exposes the byte offset read up to (e.g., for
+progress reporting or splitting the source into byte ranges).
+
+Examples:
+    literal blocks::
+
+        csv2ofx -m mint transactions.csv.gz transactions.ofx
+
+Attributes:
+    COMPRESSIONS (dict): The module which opens each compressed file
+        extension.
+    MMAP_SIZE (int): Size (in bytes) from which uncompressed sources are
+        memory mapped.
+    BLOCK_SIZE (int): Size (in bytes) of the blocks a `MappedSource` decodes.
+"""
+
+import io
+import mmap
+import os
+import re
+from contextlib import suppress
+from importlib import import_module
+
+COMPRESSIONS = {".gz": "gzip", ".bz2": "bz2", ".xz": "lzma"}
+MMAP_SIZE = 2**24
+BLOCK_SIZE = 2**20
+
+# the line endings `open` translates (i.e., universal newlines)
+NEWLINES = re.compile(rb"\r\n?|\n")
+
+
+def get_compression(path):
+    """Gets the module which opens a compressed file
+
+    Examples:
+        >>> get_compression('statement.csv.GZ'), get_compression('statement.csv')
+        ('gzip', None)
+    """
+    return COMPRESSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def is_mappable(path, encoding="utf-8"):
+    """Determines whether a file can be read as a `MappedSource`, i.e., it is
+    an uncompressed regular file which isn't empty and whose encoding keeps
+    newlines as is
+
+    Examples:
+        >>> is_mappable('data/test/mint.csv')
+        True
+        >>> is_mappable('data/test/mint.csv', 'utf-16')
+        False
+    """
+    if get_compression(path) or "\n".encode(encoding) != b"\n":
+        return False
+
+    try:
+        return os.stat(path).st_size > 0 and os.path.isfile(path)
+    except OSError:
+        return False
+
+
+def open_source(path, encoding="utf-8", errors=None, mmap_size=None):
+    """Opens a csv source for reading text
+
+    Args:
+        path (str): The source file path.
+        encoding (str): The file encoding.
+        errors (str): The decoding error policy (default: 'strict').
+        mmap_size (int): Size from which the file is memory mapped (default:
+            `MMAP_SIZE`).
+
+    Returns:
+        (obj): a text file like object
+
+    Examples:
+        >>> with open_source('data/test/mint.csv', mmap_size=0) as f:
+        ...     header = next(f)
+        ...     f.tell(), f.size
+        (429, 429)
+        >>> header[:16]
+        'Date,Description'
+    """
+    compression = get_compression(path)
+
+    if compression:
+        module = import_module(compression)
+        return module.open(path, "rt", encoding=encoding, errors=errors)
+
+    mmap_size = MMAP_SIZE if mmap_size is None else mmap_size
+    mappable = is_mappable(path, encoding) and os.stat(path).st_size >= mmap_size
+
+    if mappable:
+        return MappedSource(path, encoding, errors or "strict")
+
+    return open(path, encoding=encoding, errors=errors)
+
+
+class MappedSource:
+    """A text file like object which reads (a byte range of) a memory mapped
+    file a block of lines at a time
+
+    Each block ends on a line ending and is decoded straight from the mapping.
+    Line endings are translated the same way `open` translates them. The
+    encoding must keep newlines as is (e.g., utf-8 or latin-1, but not
+    utf-16).
+
+    Args:
+        path (str): The file path.
+        encoding (str): The file encoding.
+        errors (str): The decoding error policy.
+        span (Tuple[int]): The start and end offset of the range to read
+            (default: the whole file).
+        block_size (int): Number of bytes decoded at a time (default:
+            `BLOCK_SIZE`).
+
+    Attributes:
+        offset (int): The byte offset (in the file) up to which lines have
+            been decoded, i.e., the end of the current block.
+        size (int): The file size.
+
+    Examples:
+        >>> with MappedSource('data/test/mint_extra.csv') as f:
+        ...     lines = list(f)
+        >>> lines[:3]
+        ['\\n', '\\n', '\\n']
+        >>> lines[3][:16]
+        'Date,Description'
+        >>> with open('data/test/mint_extra.csv', encoding='utf-8') as f:
+        ...     lines == list(f)
+        True
+        >>> with MappedSource('data/test/mint.csv', span=(97, 264), block_size=1) as f:
+        ...     f.readline()[:26], f.offset
+        ...     f.readline()[:26], f.tell()
+        ...     f.readline()
+        ('6/12/15,Transfer from Chec', 181)
+        ('6/12/15,Transfer from Savi', 167)
+        ''
+    """
+
+    mode = "r"
+
+    def __init__(self, path, encoding="utf-8", errors="strict", **kwargs):
+        self.name = path
+        self.encoding = encoding
+        self.errors = errors
+        self.block_size = kwargs.get("block_size") or BLOCK_SIZE
+
+        with open(path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.start, self.end = kwargs.get("span") or (0, self.size)
+        self.view = memoryview(self.data)
+        self.seek(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        # iterating over each block's lines skips a `readline` call per line
+        while True:
+            yield from self.lines
+
+            if not self.read_block():
+                return
+
+    def __next__(self):
+        line = self.readline()
+
+        if not line:
+            raise StopIteration
+
+        return line
+
+    @property
+    def closed(self):
+        return self.data.closed
+
+    def read_block(self):
+        """Decodes the next block of lines
+
+        Returns:
+            (bool): whether there was anything left to decode
+        """
+        data, start, end = self.data, self.offset, self.end
+
+        if start >= end:
+            return False
+
+        limit = min(start + self.block_size, end)
+
+        # NOTE: A `\r` just before the limit may start a `\r\n`, so it can only
+        # end the block if the limit is the end of the range.
+        stop = data.rfind(b"\n", start, limit)
+        stop = max(stop, data.rfind(b"\r", start, limit if limit == end else limit - 1))
+
+        if stop < 0:
+            # a line longer than a block
+            newline = NEWLINES.search(data, limit - 1, end)
+            self.offset = newline.end() if newline else end
+        else:
+            self.offset = stop + 1
+
+        text = str(self.view[start : self.offset], self.encoding, self.errors)
+        self.lines = io.StringIO(text, newline=None)
+        return True
+
+    def readline(self):
+        """Reads the next line (an empty string at the end of the range)"""
+        line = self.lines.readline()
+
+        while not line and self.read_block():
+            line = self.lines.readline()
+
+        return line
+
+    def read(self, size=-1):
+        """Reads the rest of the range (`size` is ignored)"""
+        return "".join(self)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Moves to a byte offset (relative to the start of the range), which
+        should be the start of a line"""
+        if whence == os.SEEK_CUR:
+            offset += self.tell()
+        elif whence == os.SEEK_END:
+            offset += self.end - self.start
+
+        self.offset = self.start + offset
+
+        # end any iteration over the current block (see `__iter__`)
+        with suppress(AttributeError):
+            self.lines.seek(0, io.SEEK_END)
+
+        self.lines = io.StringIO()
+        return offset
+
+    def tell(self):
+        """Gets the byte offset (relative to the start of the range) up to
+        which lines have been decoded"""
+        return self.offset - self.start
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        # the mapping can't be closed while a view of it exists
+        self.view.release()
+        self.data.close()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:expandtab
+
+"""
+csv2ofx.state
+~~~~~~~~~~~~~
+
+Provides a persistent (SQLite) index of what has already been converted from
+each source file, for incremental conversion of append-only exports
+
+For each source, the index records how far (in bytes) the file has been read,
+a hash of the data read so far, and what was learned about its dates and
+amounts. For each account, it records the last transaction date and the FITIDs
+already emitted. Later conversions seek past the data already read and only
+emit new transactions. If the data already read has changed, the conversion
+stops until the source is reset. New transactions dated before their
+account's last converted transaction (which some apps ignore) are reported.
+
+Checking the data already read means hashing all of it, but the hash is then
+extended with the new data rather than computed again.
+
+Examples:
+    literal blocks::
+
+        csv2ofx --state ~/.csv2ofx.db checking.csv new.ofx
+
+Attributes:
+    SCHEMA (str): The index tables.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime as dt
+from math import inf
+
+from . import ConversionError
+from .parallel import get_header, read_range
+from .source import BLOCK_SIZE, is_mappable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    prefix_hash TEXT NOT NULL,
+    learned TEXT,
+    updated TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS accounts (
+    source TEXT NOT NULL,
+    account TEXT NOT NULL,
+    last_date TEXT NOT NULL,
+    PRIMARY KEY (source, account)
+);
+CREATE TABLE IF NOT EXISTS fitids (
+    source TEXT NOT NULL,
+    account TEXT NOT NULL,
+    fitid TEXT NOT NULL,
+    PRIMARY KEY (source, account, fitid)
+) WITHOUT ROWID;
+"""
+
+
+class StateError(ConversionError):
+    """Raised if a source has changed since it was last converted"""
+
+
+def update_hash(hasher, f, end):
+    """Hashes a file from its current position up to an offset
+
+    Args:
+        hasher (obj): The `hashlib` hash object to update.
+        f (obj): The file (opened in binary mode).
+        end (int): The offset.
+
+    Returns:
+        (obj): the hash object
+
+    Examples:
+        >>> from io import BytesIO
+        >>> f = BytesIO(b'a,b\\n1,2\\n3,4\\n')
+        >>> hasher = update_hash(hashlib.sha256(), f, 4)
+        >>> hasher = update_hash(hasher, f, 8)
+        >>> hasher.hexdigest() == hashlib.sha256(b'a,b\\n1,2\\n').hexdigest()
+        True
+    """
+    position = f.tell()
+
+    while position < end:
+        block = f.read(min(BLOCK_SIZE, end - position))
+
+        if not block:
+            break
+
+        hasher.update(block)
+        position += len(block)
+
+    return hasher
+
+
+def get_learned(cont):
+    """Gets what a content object learned about the dates and amounts
+
+    Args:
+        cont (obj): The OFX or QIF content object.
+
+    Returns:
+        (dict): the inferred date format and amount separators
+    """
+    return {
+        "inferred_fmt": cont.inferred_fmt,
+        "date_samples": cont.date_samples,
+        "amount_separators": cont.amount_parser.separators,
+        "balance_separators": cont.balance_parser.separators,
+    }
+
+
+def set_learned(cont, learned):
+    """Restores what a content object learned about the dates and amounts
+
+    Args:
+        cont (obj): The OFX or QIF content object.
+        learned (dict): The return value of `get_learned`.
+    """
+    if cont.date_samples is not None:
+        cont.inferred_fmt = learned["inferred_fmt"]
+        cont.date_samples = learned["date_samples"]
+
+    parsers = [(cont.amount_parser, "amount"), (cont.balance_parser, "balance")]
+
+    for parser, name in parsers:
+        separators = learned[f"{name}_separators"]
+
+        # separators given by the mapping take precedence
+        if separators and not parser.separators:
+            parser.lock(*separators)
+
+
+class State:
+    """The conversion state of a source file
+
+    Args:
+        path (str): The SQLite state file path.
+        source (str): The source file path.
+        reset (bool): Forget the state of the source first.
+
+    Examples:
+        >>> import tempfile
+        >>> from csv2ofx.mappings.default import mapping
+        >>> from csv2ofx.qif import QIF
+        >>>
+        >>> tmpdir = tempfile.TemporaryDirectory()
+        >>> path = os.path.join(tmpdir.name, 'state.db')
+        >>> ckwargs = {'first_row': 0, 'last_row': inf, 'first_col': 0}
+        >>> state = State(path, 'data/test/default.csv')
+        >>> state.read(QIF(mapping), ckwargs) is None
+        True
+        >>> state.commit()
+        >>> state.close()
+        >>> state = State(path, 'data/test/default.csv')
+        >>> state.offset == os.path.getsize('data/test/default.csv')
+        True
+        >>> list(state.read(QIF(mapping), ckwargs))
+        []
+        >>> state.close()
+        >>> tmpdir.cleanup()
+    """
+
+    def __init__(self, path, source, reset=False):
+        if not source:
+            raise StateError("Incremental conversion requires a source file")
+
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.source = os.path.abspath(source)
+        self.new_fitids = []
+        self.last_dates = {}
+        self.backdated = 0
+        self.skipped = 0
+        self.hasher = hashlib.sha256()
+        self.size = None
+        self.cont = None
+
+        if reset:
+            self.reset()
+
+        query = "SELECT offset, prefix_hash, learned FROM sources WHERE source = ?"
+        row = self.conn.execute(query, (self.source,)).fetchone()
+        self.offset, self.prefix_hash, learned = row or (0, None, None)
+        self.learned = json.loads(learned) if learned else None
+        query = "SELECT account, last_date FROM accounts WHERE source = ?"
+        self.prior_dates = dict(self.conn.execute(query, (self.source,)))
+
+    def reset(self):
+        """Forgets the state of the source"""
+        with self.conn:
+            for table in ["sources", "accounts", "fitids"]:
+                sql = f"DELETE FROM {table} WHERE source = ?"
+                self.conn.execute(sql, (self.source,))
+
+    def read(self, cont, ckwargs, encoding="utf-8"):
+        """Reads the records added to the source since it was last converted
+
+        Also wraps `cont.include` so that only transactions with new FITIDs
+        are emitted (see `include_new`).
+
+        Args:
+            cont (obj): The OFX or QIF content object.
+            ckwargs (dict): Keyword arguments passed to `read_csv`.
+            encoding (str): The file encoding.
+
+        Returns:
+            (Iter[dict]): the new records, or None if the whole source should
+                be read (e.g., it was never converted or rows or columns are
+                skipped).
+
+        Raises:
+            StateError: If the data already read has changed.
+        """
+        with open(self.source, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+
+            # the hash is extended with the rest of the file on `commit`
+            update_hash(self.hasher, f, self.offset)
+            changed = self.size < self.offset
+            changed = changed or self.hasher.hexdigest() != self.prefix_hash
+
+            if self.offset and changed:
+                msg = f"{self.source} has changed since it was last converted"
+                raise StateError(f"{msg}. Try again with `--reset-state` option.")
+
+            f.seek(0)
+            first_line = f.readline()
+
+        self.include_new(cont)
+        skips = (ckwargs["first_row"], ckwargs["last_row"], ckwargs["first_col"])
+        seekable = skips == (0, inf, 0) and is_mappable(self.source, encoding)
+
+        if not (self.offset and seekable):
+            return None
+
+        if self.learned:
+            set_learned(cont, self.learned)
+
+        self.skipped = self.offset
+
+        if self.offset == self.size:
+            # `read_csv` can't read an empty range
+            return iter([])
+
+        header = get_header(first_line.decode(encoding), **ckwargs)
+        rkwargs = {**ckwargs, "has_header": False, "custom_header": header}
+        return read_range(self.source, (self.offset, self.size), encoding, **rkwargs)
+
+    def include_new(self, cont):
+        """Wraps `cont.include` to drop transactions whose FITID was already
+        emitted, and to record the new ones"""
+        include = cont.include
+        execute = self.conn.execute
+        query = "SELECT 1 FROM fitids WHERE source = ? AND account = ? AND fitid = ?"
+        self.cont = cont
+
+        def wrapper(trxn):
+            if not include(trxn):
+                return False
+
+            # keep the data for `gen_body`
+            trxn.data = data = cont.get_data(trxn)
+            account, fitid = str(data["account"] or ""), str(data["id"])
+
+            if execute(query, (self.source, account, fitid)).fetchone():
+                return False
+
+            self.new_fitids.append((self.source, account, fitid))
+            date = data["date"].isoformat()
+            self.last_dates[account] = max(date, self.last_dates.get(account, date))
+            self.backdated += date < self.prior_dates.get(account, date)
+            return True
+
+        cont.include = wrapper
+
+    def commit(self):
+        """Records that the source has been converted"""
+        with open(self.source, "rb") as f:
+            f.seek(self.offset)
+            prefix_hash = update_hash(self.hasher, f, self.size).hexdigest()
+
+        learned = json.dumps(get_learned(self.cont)) if self.cont else None
+        dates = [(self.source, *item) for item in self.last_dates.items()]
+
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)",
+                (self.source, self.size, prefix_hash, learned, dt.now().isoformat()),
+            )
+            self.conn.executemany(
+                "INSERT INTO accounts VALUES (?, ?, ?) ON CONFLICT (source, account) "
+                "DO UPDATE"
+                " SET last_date = max(last_date, excluded.last_date)",
+                dates,
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO fitids VALUES (?, ?, ?)", self.new_fitids
+            )
+
+    def summary(self):
+        """Summarizes the conversion
+
+        Returns:
+            (str): the number of bytes skipped and new transactions
+        """
+        num = len(self.new_fitids)
+        return f"Skipped {self.skipped} bytes already converted; {num} new transactions"
+
+    def warning(self):
+        """Warns about new transactions dated before their account's last
+        converted transaction
+
+        Returns:
+            (str): the warning (or an empty string if there are none)
+        """
+        if self.backdated:
+            num = self.backdated
+            msg = f"Warning: {num} new transactions are dated before the last one"
+            return f"{msg} previously converted for their account."
+
+        return ""
+
+    def close(self):
+        self.conn.close()
@@ -16,10 +16,15 @@ Attributes:
     ENCODING (str): Default file encoding.
 """
 
+import hashlib
+import itertools as it
+import json
+import re
 from collections import OrderedDict
-
-from meza.convert import to_decimal
-from meza.fntools import get_separators
+from datetime import datetime as dt
+from decimal import ROUND_HALF_UP, Decimal
+from functools import cache, lru_cache, partial
+from json.encoder import encode_basestring_ascii
 
 # NOTE: Because we are testing for substrings, the order we iterate
 # over this dictionary matters (so place strings like "reinvest"
@@ -43,6 +48,95 @@ ACTION_TYPES = OrderedDict([
 
 TRANSFERABLE = {"Buy", "Div", "Int", "Sell"}
 
+# NOTE: The order of these matters since `infer_date_format` picks the first
+# format which agrees with `dateutil` for every sampled date
+MONTHFIRST_ORDERS = [("%m", "%d", "%Y"), ("%m", "%d", "%y")]
+DAYFIRST_ORDERS = [("%d", "%m", "%Y"), ("%d", "%m", "%y")]
+YEARFIRST_ORDERS = [("%Y", "%m", "%d")]
+DATE_SEPARATORS = ["/", "-", ".", ""]
+NAMED_DATE_FMTS = ["%d %b %Y", "%d-%b-%Y", "%d-%b-%y", "%b %d, %Y", "%B %d, %Y"]
+FITID_HASHES = ["md5", "sha1", "sha256", "blake2b", "blake2s"]
+DIGEST_SIZE = 16
+AMOUNT_SAMPLE_SIZE = 16
+CENTS = Decimal(".01")
+
+TIME_FMTS = ["", " %H:%M:%S", " %H:%M", "T%H:%M:%S", " %I:%M:%S %p", " %I:%M %p"]
+
+# NOTE: These are the replacements `meza.fntools.xmlize` makes (`&` really does
+# become `&amp`). Since none of them adds a special character, translating
+# each character at once is the same as replacing them one after another.
+XML_ESCAPES = str.maketrans({"&": "&amp", ">": "&gt", "<": "&lt", "\n": " "})
+XML_SPECIALS = re.compile("[&<>\n]")
+
+
+class Classifier:
+    """Classifies names (e.g., accounts or categories) using an ordered table
+    of keywords. A name gets the first key (in table order) with a keyword that
+    is a substring of the lowercased name.
+
+    The whole table is compiled into a single regex and the results are
+    memoized per distinct name.
+
+    Args:
+        types (dict): The types with matching (lowercase) keywords.
+        default (str): The type to use if no keyword matches (default: None).
+        maxsize (int): Number of distinct names to remember (default: 4096).
+
+    Examples:
+        >>> classify = Classifier(ACTION_TYPES, 'ShrsIn')
+        >>> classify('Reinvest Dividends')
+        'ReinvDiv'
+        >>> classify('invest')
+        'Buy'
+        >>> classify('transfer')
+        'ShrsIn'
+        >>> classify = Classifier({'Cash': ('cash',), 'Bank': ('checking',)})
+        >>> classify('checking cash')
+        'Cash'
+        >>> classify('savings') is None
+        True
+    """
+
+    def __init__(self, types, default=None, maxsize=2**12):
+        keys, alternatives = [], []
+
+        for key, values in types.items():
+            if values:
+                keys.append(key)
+                keywords = "|".join(map(re.escape, values))
+                alternatives.append(f"(?=.*?(?:{keywords}))()")
+
+        self.keys = keys
+        self.default = default
+        self.matcher = re.compile("|".join(alternatives), re.DOTALL).match
+        self.classify = lru_cache(maxsize=maxsize)(self.match)
+
+    def __call__(self, name):
+        return self.classify(name)
+
+    def match(self, name):
+        """Classifies a name without memoizing the result"""
+        matched = self.matcher(name.lower()) if self.keys else None
+        return self.keys[matched.lastindex - 1] if matched else self.default
+
+
+@lru_cache(maxsize=32)
+def get_classifier(table):
+    """Gets the (compiled and memoizing) `Classifier` of a keyword table
+
+    Args:
+        table (Tuple[Tuple]): The types and their keywords, as `(type,
+            keywords)` pairs.
+
+    Examples:
+        >>> classify = get_classifier((('Cash', ('cash',)),))
+        >>> classify is get_classifier((('Cash', ('cash',)),))
+        True
+        >>> classify('Petty Cash')
+        'Cash'
+    """
+    return Classifier(dict(table))
+
 
 def get_account_type(account, account_types, def_type="n/a"):
     """Detect the account type of a given account
@@ -61,14 +155,8 @@ def get_account_type(account, account_types, def_type="n/a"):
         >>> get_account_type('account', {'Cash': ('cash',)}) == 'n/a'
         True
     """
-    _type = def_type
-
-    for key, values in account_types.items():
-        if any(v in account.lower() for v in values):
-            _type = key
-            break
-
-    return _type
+    table = tuple((key, tuple(values)) for key, values in account_types.items())
+    return get_classifier(table)(account) or def_type
 
 
 def get_action(category, transfer=False, def_action="ShrsIn"):
@@ -93,12 +181,7 @@ def get_action(category, transfer=False, def_action="ShrsIn"):
         >>> get_action('reinvest') == 'ReinvDiv'
         True
     """
-    _type = def_action
-
-    for key, values in ACTION_TYPES.items():
-        if any(v in category.lower() for v in values):
-            _type = key
-            break
+    _type = ACTION_CLASSIFIER(category) or def_action
 
     if transfer and _type in TRANSFERABLE:
         return f"{_type}X"
@@ -106,6 +189,207 @@ def get_action(category, transfer=False, def_action="ShrsIn"):
         return _type
 
 
+def get_hasher(name="md5"):
+    """Gets a function which hashes a string into a hex digest
+
+    Args:
+        name (str): The `hashlib` algorithm. The blake2 algorithms use a 16
+            byte digest, i.e., the same length as md5 (default: 'md5').
+
+    Returns:
+        (func): The hash function.
+
+    Examples:
+        >>> get_hasher()('account')
+        'e268443e43d93dab7ebef303bbe9642f'
+        >>> len(get_hasher('blake2b')('account'))
+        32
+    """
+    if name.startswith("blake2"):
+        constructor = partial(getattr(hashlib, name), digest_size=DIGEST_SIZE)
+    else:
+        constructor = getattr(hashlib, name, partial(hashlib.new, name))
+
+    def hasher(content):
+        return constructor(content.encode("utf-8")).hexdigest()
+
+    return hasher
+
+
+@cache
+def _json_prefixes(columns):
+    first = "{" + encode_basestring_ascii(columns[0]) + ": "
+    rest = (", " + encode_basestring_ascii(c) + ": " for c in columns[1:])
+    return [first, *rest]
+
+
+def row_fingerprint(row, name="sha256"):
+    """Hashes an entire row. The result is the same as hashing
+    `json.dumps(row)`, but the json for each distinct column order is only
+    computed once.
+
+    Args:
+        row (dict): The csv row.
+        name (str): The `hashlib` algorithm (default: 'sha256').
+
+    Returns:
+        (str): The hex digest.
+
+    Examples:
+        >>> row = {'Date': '06/12/10', 'Payee': 'Caf\u00e9', 'Amount': '$10'}
+        >>> stringified = json.dumps(row).encode('utf-8')
+        >>> row_fingerprint(row) == hashlib.sha256(stringified).hexdigest()
+        True
+        >>> row = {'Date': '06/12/10', 'Amount': None}
+        >>> stringified = json.dumps(row).encode('utf-8')
+        >>> row_fingerprint(row) == hashlib.sha256(stringified).hexdigest()
+        True
+    """
+    try:
+        prefixes = _json_prefixes(tuple(row))
+        pairs = zip(prefixes, row.values())
+        stringified = "".join([p + encode_basestring_ascii(v) for p, v in pairs])
+        stringified += "}"
+    except (TypeError, IndexError):
+        # We have non-string values (or no columns at all)
+        stringified = json.dumps(row)
+
+    constructor = getattr(hashlib, name, partial(hashlib.new, name))
+    return constructor(stringified.encode("utf-8")).hexdigest()
+
+
+def xml_escape(content):
+    """Makes a string xml compliant (the same way `meza.fntools.xmlize` does)
+
+    Args:
+        content (str): The string to escape.
+
+    Returns:
+        (str): the escaped string (`content` itself if there is nothing to
+            escape)
+
+    Examples:
+        >>> xml_escape('A&W <Root Beer>\\r\\n')
+        'A&ampW &ltRoot Beer&gt\\r '
+        >>> xml_escape('payee')
+        'payee'
+    """
+    return content.translate(XML_ESCAPES) if XML_SPECIALS.search(content) else content
+
+
+def xmlize_row(row):
+    """Makes the values of a csv row xml compliant. The result is the same as
+    `{k: next(xmlize([v])) for k, v in row.items()}`, but rows without any
+    special characters are searched only once and returned as is.
+
+    Args:
+        row (dict): The csv row.
+
+    Returns:
+        (dict): the row with escaped values
+
+    Examples:
+        >>> from meza.fntools import xmlize
+        >>> row = {'Payee': 'A&W', 'Amount': '$10', 'Notes': None}
+        >>> xmlize_row(row) == {k: next(xmlize([v])) for k, v in row.items()}
+        True
+        >>> row = {'Payee': 'A&W', 'Amount': '$10'}
+        >>> xmlize_row(row)
+        {'Payee': 'A&ampW', 'Amount': '$10'}
+        >>> row = {'Payee': 'payee', 'Amount': '$10'}
+        >>> xmlize_row(row) is row
+        True
+    """
+    try:
+        special = XML_SPECIALS.search("".join(row.values()))
+    except TypeError:
+        # We have non-string values
+        from meza.fntools import xmlize
+
+        return {k: next(xmlize([v])) for k, v in row.items()}
+
+    return {k: xml_escape(v) for k, v in row.items()} if special else row
+
+
+def gen_date_fmts(dayfirst=False):
+    """Generates the candidate `strptime` formats used to infer a date format
+
+    Args:
+        dayfirst (bool): Try formats which start with the day before those
+            which start with the month (default: False).
+
+    Yields:
+        (str): a `strptime` format
+
+    Examples:
+        >>> next(gen_date_fmts())
+        '%m/%d/%Y'
+        >>> next(gen_date_fmts(True))
+        '%d/%m/%Y'
+    """
+    if dayfirst:
+        orders = DAYFIRST_ORDERS + MONTHFIRST_ORDERS + YEARFIRST_ORDERS
+    else:
+        orders = MONTHFIRST_ORDERS + DAYFIRST_ORDERS + YEARFIRST_ORDERS
+
+    numeric = (sep.join(order) for order in orders for sep in DATE_SEPARATORS)
+    date_fmts = it.chain(numeric, NAMED_DATE_FMTS)
+
+    for date_fmt, time_fmt in it.product(date_fmts, TIME_FMTS):
+        yield f"{date_fmt}{time_fmt}"
+
+
+def infer_date_format(values, dayfirst=False):
+    """Infers a `strptime` format which parses every value the same way
+    `dateutil` does
+
+    Args:
+        values (Iter[str]): Sample of date strings.
+        dayfirst (bool): Interpret the first value in ambiguous dates (e.g.
+            01/05/09) as the day (default: False).
+
+    Returns:
+        (str): The inferred format (or None if no candidate format agrees with
+            `dateutil` for every value).
+
+    Examples:
+        >>> infer_date_format(['06/12/10', '06/13/10'])
+        '%m/%d/%y'
+        >>> infer_date_format(['06/12/10', '06/11/10'], dayfirst=True)
+        '%d/%m/%y'
+        >>> infer_date_format(['2021-05-04 20:03:01'])
+        '%Y-%m-%d %H:%M:%S'
+        >>> infer_date_format(['6/12/15', '2015-06-13']) is None
+        True
+    """
+    from dateutil.parser import parse
+
+    fmts = list(gen_date_fmts(dayfirst))
+
+    for value in values:
+        try:
+            expected = parse(value, dayfirst=dayfirst)
+        except (ValueError, OverflowError):
+            return None
+
+        fmts = [fmt for fmt in fmts if _strptime(value, fmt) == expected]
+
+        if not fmts:
+            return None
+
+    return fmts[0] if fmts else None
+
+
+def _strptime(content, fmt):
+    try:
+        return dt.strptime(content, fmt)
+    except ValueError:
+        return None
+
+
+ACTION_CLASSIFIER = Classifier(ACTION_TYPES)
+
+
 def convert_amount(content):
     """Convert number to a decimal amount
 
@@ -119,9 +403,157 @@ def convert_amount(content):
         >>> convert_amount('$1.000,00')
         Decimal('1000.00')
     """
+    from meza.convert import to_decimal
+    from meza.fntools import get_separators
+
     return to_decimal(content, **get_separators(content))
 
 
+@cache
+def get_strip_table():
+    """Gets the translate table which removes currency symbols
+
+    Examples:
+        >>> '$1,000€'.translate(get_strip_table())
+        '1,000'
+    """
+    from meza.fntools import CURRENCIES
+
+    return str.maketrans(dict.fromkeys(CURRENCIES))
+
+
+class AmountParser:
+    """Converts the amounts of a csv column into decimals.
+
+    The thousands and decimal separators are either given or detected from a
+    sample of the column values (which are converted with `convert_amount`
+    while sampling). Once known, values are converted with a precompiled
+    translate table instead of guessing the separators of each one. Values
+    that don't look like a number in that convention are still handed to
+    `convert_amount`.
+
+    Args:
+        thousand_sep (char): thousand's separator (default: None, i.e., detect)
+        decimal_sep (char): decimal separator (default: None, i.e., detect)
+        sample_size (int): number of values with a separator to look at before
+            settling on a convention (default: 16)
+
+    Examples:
+        >>> parser = AmountParser(decimal_sep=',')
+        >>> parser('1.000,00€')
+        Decimal('1000.00')
+        >>> parser('-98,76')
+        Decimal('-98.76')
+        >>> parser.many(['$1,5', 12.5])
+        [Decimal('1.50'), Decimal('12.50')]
+        >>> parser = AmountParser(sample_size=2)
+        >>> parser.many(['1,000.00', '1000', '12.50'])
+        [Decimal('1000.00'), Decimal('1000.00'), Decimal('12.50')]
+        >>> parser.separators
+        (',', '.')
+        >>> parser.many(['12.345', '1.500', '0.005'])
+        [Decimal('12345.00'), Decimal('1500.00'), Decimal('5.00')]
+        >>> parser('-0')
+        Traceback (most recent call last):
+        ...
+        ValueError: Invalid number format for `-0`.
+        >>> AmountParser('.', ',')('1,500')
+        Decimal('1500.00')
+        >>> parser = AmountParser()
+        >>> parser.settled
+        True
+        >>> parser('12')
+        Decimal('12.00')
+        >>> parser.settled
+        False
+    """
+
+    def __init__(self, thousand_sep=None, decimal_sep=None, **kwargs):
+        self.sample_size = kwargs.get("sample_size", AMOUNT_SAMPLE_SIZE)
+        self.separators = None
+        self.conventions = set()
+        self.sampled = 0
+        self.seen = 0
+        self.convert = self.sample
+
+        if thousand_sep or decimal_sep:
+            decimal_sep = decimal_sep or ("," if thousand_sep == "." else ".")
+            thousand_sep = thousand_sep or ("." if decimal_sep == "," else ",")
+            self.lock(thousand_sep, decimal_sep)
+
+    def __call__(self, content):
+        return self.convert(content)
+
+    @property
+    def settled(self):
+        """Whether the way values are converted won't change anymore, i.e.,
+        the separators are known (or mixed) or no value has been converted"""
+        return self.convert != self.sample or not self.seen
+
+    def many(self, values):
+        """Converts a batch of values
+
+        Args:
+            values (Iter[str]): The amounts.
+
+        Returns:
+            (List[decimal]): The converted amounts.
+        """
+        return [self.convert(value) for value in values]
+
+    def lock(self, thousand_sep, decimal_sep):
+        """Uses the given separators to convert all subsequent values"""
+        thousands = re.escape(thousand_sep)
+        decimal = re.escape(decimal_sep)
+
+        # NOTE: `convert_amount` rejects signed zeros and reads a fraction of
+        # three or more digits (e.g., '1.500') differently, so those values
+        # are left to it.
+        pattern = rf"(?![-+][0{thousands}{decimal}]*$)"
+        pattern += rf"[-+]?(?:0|[1-9]\d{{0,2}}(?:{thousands}\d{{3}})+|[1-9]\d*)"
+        pattern += rf"(?:{decimal}\d{{1,2}})?"
+
+        self.separators = (thousand_sep, decimal_sep)
+        self.matcher = re.compile(pattern).fullmatch
+        self.table = str.maketrans({thousand_sep: None, decimal_sep: "."})
+        self.strip_table = get_strip_table()
+        self.convert = self.translate
+
+    def sample(self, content):
+        """Converts a value while detecting the column's separators"""
+        from meza.fntools import get_separators
+
+        amount = convert_amount(content)
+        self.seen += 1
+
+        if isinstance(content, str) and ("," in content or "." in content):
+            separators = get_separators(content)
+            self.conventions.add(tuple(separators.values()))
+            self.sampled += 1
+
+        if len(self.conventions) > 1:
+            # the column mixes conventions, so keep guessing for each value
+            self.convert = convert_amount
+        elif self.sampled >= self.sample_size:
+            self.lock(*self.conventions.pop())
+
+        return amount
+
+    def translate(self, content):
+        """Converts a value using the column's separators"""
+        try:
+            stripped = content.translate(self.strip_table)
+        except AttributeError:
+            # We don't have a string
+            return convert_amount(content)
+
+        if self.matcher(stripped):
+            decimalized = Decimal(stripped.translate(self.table))
+            return decimalized.quantize(CENTS, rounding=ROUND_HALF_UP)
+        else:
+            return convert_amount(content)
+
+
 def get_max_split(splits, keyfunc):
     """Returns the split in a transaction with the largest absolute value
 
@@ -171,13 +603,19 @@ def verify_splits(splits, keyfunc):
 
 
 def gen_data(groups):
-    """Generate the transaction data"""
+    """Generate the transaction data
+
+    `len` is None for groups which are streamed rather than sorted (i.e., those
+    which aren't split).
+    """
     for group, main_pos, sorted_trxns in groups:
+        length = len(sorted_trxns) if isinstance(sorted_trxns, list) else None
+
         for pos, trxn in sorted_trxns:
             base_data = {
                 "trxn": trxn,
                 "is_main": pos == main_pos,
-                "len": len(sorted_trxns),
+                "len": length,
                 "group": group,
             }
 
@@ -1,20 +1,24 @@
 import itertools
+import json
 import os
 import pathlib
 import shlex
 import subprocess
+import sys
 import time
 
 import freezegun
 import pytest
 
 import csv2ofx.main
+import csv2ofx.profile
 
 samples = [
     (["-oq"], "default.csv", "default.qif"),
     (["-oq", "-m split_account"], "default.csv", "default_w_splits.qif"),
     (["-oqc Description", "-m xero"], "xero.csv", "xero.qif"),
     (["-oq", "-m mint"], "mint.csv", "mint.qif"),
+    (["-oqI", "-m mint"], "mint.csv", "mint.qif"),
     (["-oq", "-m mint_extra"], "mint_extra.csv", "mint_extra.qif"),
     (["-oq", "-m mint_headerless"], "mint_headerless.csv", "mint.qif"),
     (["-oqs20150613", "-e20150614", "-m mint"], "mint.csv", "mint_alt.qif"),
@@ -149,6 +153,47 @@ def test_sample(opts, in_filename, out_filename, capsys, monkeypatch):
     )
 
 
+@freezegun.freeze_time("2016-10-31 11:29:08")
+def test_buffer_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(csv2ofx.main, '_time_from_file', lambda path: time.time())
+    dest = tmp_path / 'mint.qif'
+    source = str(data / 'test' / 'mint.csv')
+    arguments = ['-q', '-m', 'mint', '--buffer-size', '7', '-E', 'utf-8-sig']
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run([*arguments, source, str(dest)])
+    assert exc.value.code == 0
+
+    # blocks are encoded one after another, but with a single byte order mark
+    expected = data.joinpath('converted', 'mint.qif').read_text(encoding='utf-8')
+    assert dest.read_bytes() == expected.encode('utf-8-sig')
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'bz2', 'lzma', 'mmap'])
+@freezegun.freeze_time("2016-10-31 11:29:08")
+def test_source(compression, tmp_path, capsys, monkeypatch):
+    import csv2ofx.source
+
+    monkeypatch.setattr(csv2ofx.main, '_time_from_file', lambda path: time.time())
+    raw = data.joinpath('test', 'mint_extra.csv').read_bytes()
+
+    if compression == 'mmap':
+        # map every (non empty) source
+        monkeypatch.setattr(csv2ofx.source, 'MMAP_SIZE', 0)
+        source = data / 'test' / 'mint_extra.csv'
+    else:
+        module = __import__(compression)
+        ext = {'gzip': 'gz', 'lzma': 'xz'}.get(compression, compression)
+        source = tmp_path / f'mint_extra.csv.{ext}'
+        source.write_bytes(module.compress(raw))
+
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run(['-oq', '-m', 'mint_extra', str(source)])
+    assert exc.value.code == 0
+
+    expected = data.joinpath('converted', 'mint_extra.qif').read_text(encoding='utf-8')
+    assert capsys.readouterr().out == expected
+
+
 def test_help():
     """
     Assert help command completes and is present in the README.
@@ -163,3 +208,490 @@ def test_help_in_readme():
     out = subprocess.check_output(['csv2ofx', '--help'], text=True, env=env)
     readme = pathlib.Path('README.md').read_text()
     assert out in readme, "README help is stale, please update."
+
+
+def test_mapping_index():
+    from pkgutil import iter_modules
+
+    import csv2ofx.mappings
+    from csv2ofx.index import MAPPINGS
+
+    names = tuple(name for _, name, _ in iter_modules(csv2ofx.mappings.__path__))
+    assert MAPPINGS == names, "Mapping index is stale, please run helpers/build-index."
+
+
+def test_lazy_imports():
+    code = 'import sys, csv2ofx.main; print(*sys.modules)'
+    modules = subprocess.check_output([sys.executable, '-c', code], text=True).split()
+    lazy = ['meza', 'dateutil', 'csv2ofx.api', 'csv2ofx.ofx', 'csv2ofx.mappings.']
+    assert not [m for m in modules if m.startswith(tuple(lazy))]
+
+
+def test_batch(tmp_path, capsys):
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text(
+        'source,dest,mapping,options\n'
+        f'{data.resolve()}/test/mint.csv,mint.qif,mint,-q\n'
+        f'{data.resolve()}/test/xero.csv,,xero,-q -c Description\n'
+        f'{data.resolve()}/test/missing.csv,,,-q\n',
+        encoding='utf-8',
+    )
+    outdir = tmp_path / 'out'
+    arguments = ['-oq', '-b', str(data / 'test' / 'default.csv'), '-f', str(manifest)]
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run([*arguments, '-j', '2', '-t', str(outdir)])
+    # one file is missing
+    assert exc.value.code == 1
+    assert 'Converted 3 of 4 files' in capsys.readouterr().err
+
+    for out_filename in ['default.qif', 'mint.qif', 'xero.qif']:
+        expected = data.joinpath('converted', out_filename).read_text(encoding='utf-8')
+        assert (outdir / out_filename).read_text(encoding='utf-8') == expected
+
+
+def test_detect(tmp_path, capsys, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text(
+        'source,dest,mapping,options\n'
+        f'{data.resolve()}/test/mint.csv,,auto,-q\n'
+        f'{data.resolve()}/test/mint_extra.csv,,auto,-q\n'
+        f'{data.resolve()}/test/xero.csv,,auto,-q -c Description\n'
+        f'{data.resolve()}/test/mint_headerless.csv,,auto,-q\n'
+        f'{data.resolve()}/test/default.csv,,auto,-q\n',
+        encoding='utf-8',
+    )
+    outdir = tmp_path / 'out'
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run(['-o', '-f', str(manifest), '-t', str(outdir)])
+    # a file without a header can't be detected, nor one matching two mappings
+    assert exc.value.code == 1
+    err = capsys.readouterr().err
+    assert "Detected mapping 'mint' (100% confidence); runners-up: pcmastercard" in err
+    assert "Detected mapping 'mint_extra' (100% confidence)\n" in err
+    assert "Detected mapping 'xero' (100% confidence)" in err
+    assert 'No mapping matches the header' in err
+    assert "('split_account', 'default' match its header equally well)" in err
+    assert 'Converted 3 of 5 files' in err
+    assert (tmp_path / 'cache' / 'csv2ofx' / 'signatures.json').exists()
+
+    for out_filename in ['mint.qif', 'mint_extra.qif', 'xero.qif']:
+        expected = data.joinpath('converted', out_filename).read_text(encoding='utf-8')
+        assert (outdir / out_filename).read_text(encoding='utf-8') == expected
+
+
+# samples whose accounts (or split ids) appear in sorted order
+presorted_samples = [
+    sample
+    for sample in samples
+    if sample[1] not in {'default.csv', 'xero.csv', 'mint.csv', 'mint_extra.csv'}
+    and sample[2] != 'mint.qif'
+]
+
+# the options of each alternative engine, and the module attributes patched so
+# even the small samples exercise it (e.g., spill every couple of rows and merge
+# the runs in several passes, or split them into several byte ranges)
+engines = {
+    'spilled': (['-C', '2'], {'csv2ofx.grouping.MERGE_WIDTH': 2}),
+    'presorted': (['-S'], {}),
+    'appearance': (['-g', 'appearance', '-C', '2'], {}),
+    'parallel': (
+        ['-P', '-j', '2'],
+        {'csv2ofx.parallel.HEAD_SIZE': 128, 'csv2ofx.parallel.RANGE_SIZE': 256},
+    ),
+    'columnar': (
+        ['--columnar'],
+        {'csv2ofx.columnar.BATCH_SIZE': 4, 'csv2ofx.utils.AMOUNT_SAMPLE_SIZE': 1},
+    ),
+}
+
+# the engine, the options of the run whose output it should match (if not the
+# converted sample's), and the sample
+engine_samples = [
+    *[('spilled', None, *sample) for sample in samples],
+    *[('presorted', None, *sample) for sample in presorted_samples],
+    *[('parallel', None, *sample) for sample in samples],
+    *[('columnar', None, *sample) for sample in samples],
+    # the samples are contiguous, so their groups appear in file order
+    *[('appearance', ['-S'], *sample) for sample in samples],
+]
+
+
+@pytest.mark.parametrize(
+    ['engine', 'reference', 'opts', 'in_filename', 'out_filename'], engine_samples
+)
+@freezegun.freeze_time("2016-10-31 11:29:08")
+def test_sample_engine(
+    engine, reference, opts, in_filename, out_filename, capsys, monkeypatch
+):
+    arguments, attrs = engines[engine]
+
+    for target, value in attrs.items():
+        # skip engines whose optional dependencies are missing
+        pytest.importorskip(target.rpartition('.')[0])
+        monkeypatch.setattr(target, value)
+
+    monkeypatch.setattr(csv2ofx.main, '_time_from_file', lambda path: time.time())
+    path = str(data / 'test' / in_filename)
+
+    def convert(options):
+        with pytest.raises(SystemExit) as exc:
+            csv2ofx.main.run([*flatten_opts(opts), *options, path])
+        assert exc.value.code == 0
+        return capsys.readouterr().out
+
+    if reference is None:
+        expected = data.joinpath("converted", out_filename).read_text(encoding='utf-8')
+    else:
+        expected = convert(reference)
+
+    assert convert(arguments) == expected
+
+
+def test_presorted_unsorted(tmp_path, capsys):
+    source = tmp_path / 'unsorted.csv'
+    rows = ['Date,Amount,Account', '1/1/15,5,Checking', '1/2/15,6,Savings']
+    source.write_text('\n'.join([*rows, '1/3/15,7,Checking']), encoding='utf-8')
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run(['-S', '-m', 'default', '-q', str(source)])
+
+    assert exc.value.code == (
+        "Group 'Checking' isn't contiguous. Try again without `--presorted` option."
+    )
+
+
+def test_parallel_settles(tmp_path, capsys, monkeypatch):
+    import csv2ofx.parallel
+
+    source = tmp_path / 'ambiguous.csv'
+    rows = [f'{day % 12 + 1}/{day % 11 + 1}/15,{day}.50,Checking' for day in range(200)]
+    source.write_text('\n'.join(['Date,Amount,Account', *rows]), encoding='utf-8')
+    states = []
+
+    def gen_prepared(args, spans, state, jobs, **kwargs):
+        states.append(state)
+        return prepare_rest(args, spans, state, jobs, **kwargs)
+
+    # the first range is too small to learn the date format or separators from
+    prepare_rest = csv2ofx.parallel.gen_prepared
+    monkeypatch.setattr(csv2ofx.parallel, 'gen_prepared', gen_prepared)
+    monkeypatch.setattr(csv2ofx.parallel, 'HEAD_SIZE', 64)
+    monkeypatch.setattr(csv2ofx.parallel, 'RANGE_SIZE', 256)
+    outputs = []
+
+    for arguments in [['-P', '-j', '2'], []]:
+        with pytest.raises(SystemExit) as exc:
+            csv2ofx.main.run(['-m', 'default', '-I', '-q', *arguments, str(source)])
+        assert exc.value.code == 0
+        outputs.append(capsys.readouterr().out)
+
+    assert outputs[0] == outputs[1]
+    [state] = states
+    assert state['inferred_fmt'] == '%m/%d/%y'
+    assert state['date_samples'] is None
+    assert state['amount_parser'].separators == (',', '.')
+
+
+def test_parallel_learning_order(tmp_path, capsys, monkeypatch):
+    import csv2ofx.parallel
+
+    # the first (day first) rows belong to the account which is sorted last
+    dayfirst = [f'{13 + n % 16}/{n // 16 + 1}/15,{n}.50,Savings' for n in range(70)]
+    monthfirst = [f'{n // 16 + 1}/{13 + n % 16}/15,{n}.50,Checking' for n in range(70)]
+    ambiguous = [f'{n % 12 + 1}/{n % 11 + 1}/15,{n}.50,Checking' for n in range(100)]
+    rows = [*dayfirst, *monthfirst, *ambiguous]
+    source = tmp_path / 'ambiguous.csv'
+    source.write_text('\n'.join(['Date,Amount,Account', *rows]), encoding='utf-8')
+    monkeypatch.setattr(csv2ofx.parallel, 'HEAD_SIZE', 64)
+    monkeypatch.setattr(csv2ofx.parallel, 'RANGE_SIZE', 256)
+    outputs = []
+
+    for arguments in [['-P', '-j', '2'], []]:
+        with pytest.raises(SystemExit) as exc:
+            csv2ofx.main.run(['-m', 'default', '-oI', '-q', *arguments, str(source)])
+        assert exc.value.code == 0
+        outputs.append(capsys.readouterr().out)
+
+    # the date format is learned from the first rows of the file in both cases
+    assert outputs[0] == outputs[1]
+    assert 'D01/12/2015' in outputs[1]
+
+
+def test_shared_converter():
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import datetime
+
+    from csv2ofx import api
+    from csv2ofx.mappings.mint import mapping
+
+    ofx = api.get_content(mapping)
+    server_date = datetime(2016, 10, 31)
+    paths = [data / 'test' / 'mint.csv'] * 8
+
+    def convert(path):
+        with path.open(encoding='utf-8') as source:
+            return ''.join(api.convert(source, ofx, server_date=server_date))
+
+    expected = [convert(path) for path in paths]
+
+    with ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(convert, paths)) == expected
+
+
+def test_serve():
+    import asyncio
+
+    from csv2ofx.serve import Server
+
+    content = data.joinpath('test', 'mint.csv').read_bytes()
+    expected = data.joinpath('converted', 'mint.qif').read_bytes()
+
+    async def request(port, path, body=None, chunked=False):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        length = f'Content-Length: {len(content)}'
+        header = 'Transfer-Encoding: chunked' if chunked else length
+        writer.write(f'PUT {path} HTTP/1.1\r\n{header}\r\n\r\n'.encode())
+
+        if body is not None:
+            writer.write(body)
+
+        return reader, writer
+
+    async def receive(connection):
+        reader, writer = connection
+        response = await reader.read()
+        writer.close()
+        head, _, rest = response.partition(b'\r\n\r\n')
+        status = int(head.split()[1])
+
+        if b'chunked' not in head:
+            return status, rest
+
+        body = b''
+
+        while True:
+            size, _, rest = rest.partition(b'\r\n')
+
+            if not int(size, 16):
+                return status, body
+
+            body += rest[: int(size, 16)]
+            rest = rest[int(size, 16) + 2 :]
+
+    async def main():
+        server = Server(jobs=1, queue_depth=1)
+        listener = await server.start(0)
+        port = listener.sockets[0].getsockname()[1]
+        path = '/convert?mapping=mint&qif'
+
+        # the first conversion waits for its upload, the second for a worker
+        first = await request(port, path)
+        second = await request(port, path, content)
+        await asyncio.sleep(0.1)
+        third = await request(port, path, content)
+        assert await receive(third) == (503, b'Too many requests\n')
+
+        first[1].write(content)
+        assert await receive(first) == (200, expected)
+        assert await receive(second) == (200, expected)
+
+        body = b'%X\r\n%s\r\n0\r\n\r\n' % (len(content), content)
+        chunked = await request(port, path, body, chunked=True)
+        assert await receive(chunked) == (200, expected)
+
+        invalid = await request(port, '/convert?mapping=nope', content)
+        assert await receive(invalid) == (400, b"Invalid mapping: 'nope'\n")
+
+        listener.close()
+        server.close()
+
+    asyncio.run(main())
+
+
+def test_profile(capsys):
+    arguments = ['-p', 'json', '-e', '20150301', '-m', 'split_account']
+    path = str(data / 'test' / 'default.csv')
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run([*arguments, path])
+    assert exc.value.code == 0
+
+    captured = capsys.readouterr()
+    profile = json.loads(captured.err)
+    assert list(profile['stages']) == csv2ofx.profile.STAGES
+    assert profile['counts'] == {
+        'rows_read': 8,
+        'filtered': 0,
+        'out_of_range': 4,
+        'groups': 2,
+        'transactions': 4,
+        'splits': 4,
+        'bytes_written': len(captured.out.encode('utf-8')),
+    }
+
+
+def test_state(tmp_path, capsys):
+    lines = (data / 'test' / 'default.csv').read_text(encoding='utf-8').splitlines()
+    source = tmp_path / 'default.csv'
+    arguments = ['-q', '--state', str(tmp_path / 'state.db'), str(source)]
+
+    def convert(*options):
+        with pytest.raises(SystemExit) as exc:
+            csv2ofx.main.run([*options, *arguments])
+
+        output = capsys.readouterr().out
+        return exc.value.code, [line for line in output.splitlines() if 'INV' in line]
+
+    source.write_text('\n'.join(lines[:5]) + '\n', encoding='utf-8')
+    assert convert() == (0, ['NINV-1', 'NINV-2', 'NINV-3', 'NINV-4'])
+    assert convert() == (0, [])
+
+    with source.open('a', encoding='utf-8') as f:
+        f.write('\n'.join(lines[5:7]) + '\n')
+
+    assert convert() == (0, ['NINV-5', 'NINV-6'])
+
+    source.write_text('\n'.join(lines[:1] + lines[2:7]) + '\n', encoding='utf-8')
+    code, _ = convert()
+    assert str(code).endswith('Try again with `--reset-state` option.')
+    assert convert('--reset-state') == (0, [f'NINV-{n}' for n in range(2, 7)])
+
+    # a new transaction dated before the account's last one
+    with source.open('a', encoding='utf-8') as f:
+        f.write(lines[1].replace('INV-1', 'INV-0').replace('-02-08', '-01-08'))
+
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run(arguments)
+    assert exc.value.code == 0
+
+    captured = capsys.readouterr()
+    assert captured.out.count('NINV-') == 1
+    assert 'NINV-0' in captured.out
+    assert captured.err.startswith('Warning: 1 new transactions are dated before')
+
+
+def test_state_changed(tmp_path, capsys):
+    lines = (data / 'test' / 'default.csv').read_text(encoding='utf-8').splitlines()
+    source = tmp_path / 'default.csv'
+    rows = [line.replace('INV-', f'INV-{n}') for n in range(800) for line in lines[1:]]
+    source.write_text('\n'.join([lines[0], *rows]) + '\n', encoding='utf-8')
+    arguments = ['-q', '--state', str(tmp_path / 'state.db'), str(source)]
+
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run(arguments)
+    assert exc.value.code == 0
+
+    # change a byte in the middle of the (large) data already converted
+    content = bytearray(source.read_bytes())
+    middle = content.index(b'INV-400')
+    content[middle : middle + 3] = b'ABC'
+    source.write_bytes(bytes(content) + lines[1].encode('utf-8') + b'\n')
+    capsys.readouterr()
+
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run(arguments)
+    assert str(exc.value.code).endswith('Try again with `--reset-state` option.')
+
+
+def test_dedupe(tmp_path, capsys):
+    lines = (data / 'test' / 'default.csv').read_text(encoding='utf-8').splitlines()
+    first, second = tmp_path / 'first.csv', tmp_path / 'second.csv'
+    first.write_text('\n'.join(lines[:6]) + '\n', encoding='utf-8')
+    second.write_text('\n'.join(lines[:1] + lines[4:]) + '\n', encoding='utf-8')
+    duplicates = tmp_path / 'duplicates.csv'
+    options = ['-q', '--dedupe', str(tmp_path / 'seen.db')]
+
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run([*options, str(first)])
+    assert exc.value.code == 0
+    assert capsys.readouterr().err == 'Removed 0 duplicate transactions.\n'
+
+    options += ['--duplicates', str(duplicates)]
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run([*options, str(second)])
+    assert exc.value.code == 0
+
+    captured = capsys.readouterr()
+    assert captured.err == f'Removed 2 duplicate transactions (see {duplicates}).\n'
+    invs = [line for line in captured.out.splitlines() if 'INV' in line]
+    assert sorted(invs) == ['NINV-6', 'NINV-7', 'NINV-8']
+
+    # the first (duplicate) transactions don't take the account header along
+    assert captured.out.startswith('!Account\nNCash\nTCash\n^\n!Type:Cash\n')
+    assert '^\n!Account\nNChecking\nTBank\n^\n!Type:Bank\n' in captured.out
+
+    rows = duplicates.read_text(encoding='utf-8').splitlines()
+    assert [row.split(',')[1] for row in rows] == ['Num', 'INV-4', 'INV-5']
+
+    # the csv row (rather than the escaped OFX record) of a duplicate
+    third = tmp_path / 'third.csv'
+    row = lines[1].replace('"Checking"', '"Checking & Savings"')
+    third.write_text('\n'.join([lines[0], row, row]) + '\n', encoding='utf-8')
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run(['-o', '--duplicates', str(duplicates), str(third)])
+    assert exc.value.code == 0
+    assert (
+        duplicates
+        .read_text(encoding='utf-8')
+        .splitlines()[1]
+        .endswith('Checking & Savings,Expenses,')
+    )
+
+
+def test_dedupe_ofx(tmp_path, capsys):
+    lines = (data / 'test' / 'default.csv').read_text(encoding='utf-8').splitlines()
+    first, second = tmp_path / 'first.csv', tmp_path / 'second.csv'
+    first.write_text('\n'.join(lines[:6]) + '\n', encoding='utf-8')
+    second.write_text('\n'.join(lines[:1] + lines[4:]) + '\n', encoding='utf-8')
+    options = ['--dedupe', str(tmp_path / 'seen.db')]
+    outputs = []
+
+    for source in [first, second, second]:
+        with pytest.raises(SystemExit) as exc:
+            csv2ofx.main.run([*options, str(source)])
+        assert exc.value.code == 0
+        outputs.append(capsys.readouterr().out.replace('\t', ''))
+
+    # the first (duplicate) transactions don't take the account header along
+    output = outputs[1]
+    assert output.count('<STMTRS>') == output.count('</STMTRS>') == 2
+    assert output.count('<BANKTRANLIST>') == output.count('</BANKTRANLIST>') == 2
+    assert '<ACCTTYPE>CHECKING</ACCTTYPE>' in output
+
+    # nor does an account end without transactions
+    output = outputs[2]
+    assert '<STMTTRN>' not in output
+    assert '</STMTRS>' not in output
+    assert output.endswith('</STMTTRNRS>\n</BANKMSGSRSV1>\n</OFX>\n')
+
+
+def test_dedupe_concurrent(tmp_path, capsys, monkeypatch):
+    import csv2ofx.dedupe
+
+    lines = (data / 'test' / 'default.csv').read_text(encoding='utf-8').splitlines()
+    rows = [f'{n}-{line}' for n in range(250) for line in lines[1:]]
+    sources = tmp_path / 'sources'
+    sources.mkdir()
+
+    for num in range(4):
+        source = sources / f'{num}.csv'
+        source.write_text('\n'.join([lines[0], *rows]) + '\n', encoding='utf-8')
+
+    # check small batches so the workers interleave
+    monkeypatch.setattr(csv2ofx.dedupe, 'FLUSH_SIZE', 16)
+    outdir = tmp_path / 'out'
+    options = ['-q', '--dedupe', str(tmp_path / 'seen.db')]
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run([*options, '-b', str(sources), '-t', str(outdir), '-j', '4'])
+    assert exc.value.code == 0
+
+    # each transaction is converted exactly once
+    outputs = [path.read_text(encoding='utf-8') for path in outdir.iterdir()]
+    lines = itertools.chain(*(output.splitlines() for output in outputs))
+    assert sum(line.startswith('NINV-') for line in lines) == len(rows)
+
+    # the next conversion rebuilds the filter the workers couldn't save
+    capsys.readouterr()
+    with pytest.raises(SystemExit) as exc:
+        csv2ofx.main.run([*options, str(sources / '0.csv')])
+    assert exc.value.code == 0
+    assert capsys.readouterr().err == f'Removed {len(rows)} duplicate transactions.\n'